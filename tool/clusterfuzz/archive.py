@@ -0,0 +1,604 @@
+"""Module for extracting zip archives while they are being downloaded.
+
+A zip archive starts every member with a local file header, so its members
+can be extracted in order from a stream. The central directory at the end of
+the stream only adds the permissions, which are applied once it is reached.
+
+Single members can also be extracted without downloading the rest of the
+archive, by reading the central directory and the members with range
+requests."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import stat
+import struct
+import zlib
+import logging
+import subprocess
+import re
+import shutil
+import zipfile
+import threading
+import collections
+import contextlib
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+
+from clusterfuzz import common
+from clusterfuzz import http_client
+
+logger = logging.getLogger('clusterfuzz')
+
+CHUNK_SIZE = 1024 * 1024
+READ_AHEAD_SIZE = 1024 * 1024
+# Members up to this compressed size are inflated on a thread while the rest
+# of the stream is read, as long as the data waiting for a thread fits in
+# MAX_PENDING_SIZE.
+MAX_PARALLEL_MEMBER_SIZE = 64 * 1024 * 1024
+MAX_PENDING_SIZE = 256 * 1024 * 1024
+GCS_URL_PREFIX = 'https://storage.cloud.google.com/'
+
+LOCAL_HEADER = struct.Struct('<IHHHHHIIIHH')
+LOCAL_HEADER_SIGNATURE = 0x04034b50
+CENTRAL_HEADER = struct.Struct('<IHHHHHHIIIHHHHHII')
+CENTRAL_HEADER_SIGNATURE = 0x02014b50
+DATA_DESCRIPTOR_SIGNATURE = 0x08074b50
+DATA_DESCRIPTOR_MAX_SIZE = 24
+# The central directory ends with an end record, preceded by zip64 records in
+# large archives.
+END_SIGNATURES = (0x06054b50, 0x06064b50)
+ZIP64_EXTRA_ID = 0x0001
+ZIP64_LIMIT = 0xffffffff
+
+FLAG_ENCRYPTED = 0x1
+FLAG_DATA_DESCRIPTOR = 0x8
+METHOD_STORED = 0
+METHOD_DEFLATED = 8
+UNIX_SYSTEM = 3
+
+
+class StreamingNotSupportedError(Exception):
+  """An exception raised when an archive can't be extracted from a stream.
+
+  The caller is expected to fall back to downloading the whole archive."""
+
+  def __init__(self, reason):
+    super(StreamingNotSupportedError, self).__init__(
+        'The archive cannot be extracted while downloading: %s' % reason)
+
+
+class BadArchiveError(common.ExpectedException):
+  """An exception raised when a downloaded archive is corrupted."""
+
+  def __init__(self, message):
+    super(BadArchiveError, self).__init__(message)
+
+
+class NullFile(object):
+  """A file that discards what is written to it."""
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, unused_type, unused_value, unused_traceback):
+    pass
+
+  def write(self, data):
+    pass
+
+
+class RangeReader(object):
+  """A seekable, read-only file of the content of a URL, which is read with
+    range requests. Reads are rounded up to READ_AHEAD_SIZE bytes so that
+    zipfile's small reads don't each cost a request."""
+
+  def __init__(self, url):
+    self.url = url
+    self.size = get_url_size(url)
+    self.position = 0
+    self.buffer_start = 0
+    self.buffer = ''
+
+  def seek(self, offset, whence=os.SEEK_SET):
+    if whence == os.SEEK_CUR:
+      offset += self.position
+    elif whence == os.SEEK_END:
+      offset += self.size
+    self.position = max(0, offset)
+
+  def tell(self):
+    return self.position
+
+  def read(self, size=-1):
+    """Reads size bytes, or up to the end if size is negative."""
+    end = self.size if size < 0 else min(self.size, self.position + size)
+    if end <= self.position:
+      return ''
+
+    buffer_end = self.buffer_start + len(self.buffer)
+    if self.position < self.buffer_start or end > buffer_end:
+      # Reads near the end of the archive are common, so the window is moved
+      # back rather than cut short there.
+      start = max(0, min(self.position,
+                         self.size - max(READ_AHEAD_SIZE, end - self.position)))
+      window_end = max(end, min(self.size, start + READ_AHEAD_SIZE))
+      with open_url(self.url, start, window_end - 1) as stream:
+        self.buffer = StreamReader(stream).read_exactly(window_end - start)
+      self.buffer_start = start
+
+    data = self.buffer[self.position - self.buffer_start:
+                       end - self.buffer_start]
+    self.position = end
+    return data
+
+
+class ParallelInflater(object):
+  """Inflates deflated members on a thread per core while the stream is read.
+
+  zlib releases the GIL while inflating, so the threads run in parallel."""
+
+  def __init__(self, threads=None):
+    self.pool = ThreadPool(threads or multiprocessing.cpu_count())
+    self.pending = collections.deque()
+    self.pending_size = 0
+
+  def submit(self, data, path, crc):
+    """Inflates data into path in the background."""
+    self.wait(MAX_PENDING_SIZE - len(data))
+    self.pending.append(
+        (self.pool.apply_async(inflate_file, (data, path, crc)), len(data)))
+    self.pending_size += len(data)
+
+  def wait(self, max_pending_size=0):
+    """Waits until at most max_pending_size bytes are waiting, and raises the
+      errors of the members inflated in the meantime."""
+    while self.pending and self.pending_size > max_pending_size:
+      result, size = self.pending.popleft()
+      self.pending_size -= size
+      result.get()
+
+  def close(self):
+    self.pool.close()
+    self.pool.join()
+
+
+class StreamReader(object):
+  """Reads exact amounts of bytes from a stream, and allows putting back the
+    bytes that were read too early."""
+
+  def __init__(self, stream):
+    self.stream = stream
+    self.pending = ''
+
+  def read(self, size):
+    """Reads up to size bytes, returning fewer only at the end of the stream."""
+    chunks = [self.pending[:size]]
+    self.pending = self.pending[size:]
+    missing = size - len(chunks[0])
+    while missing > 0:
+      chunk = self.stream.read(missing)
+      if not chunk:
+        break
+      chunks.append(chunk)
+      missing -= len(chunk)
+    return ''.join(chunks)
+
+  def read_exactly(self, size):
+    """Reads exactly size bytes."""
+    data = self.read(size)
+    if len(data) != size:
+      raise BadArchiveError('The archive ended unexpectedly.')
+    return data
+
+  def unread(self, data):
+    """Puts data back at the front of the stream."""
+    self.pending = data + self.pending
+
+
+def get_signature(data):
+  """Returns the signature at the start of a record, or None if the stream
+    ended before it."""
+  if len(data) < 4:
+    return None
+  return struct.unpack('<I', data[:4])[0]
+
+
+def get_gsutil_path(build_url):
+  """Returns the gs:// path of a GCS build URL."""
+  return build_url.replace(GCS_URL_PREFIX, 'gs://')
+
+
+def is_gcs_url(url):
+  """Returns true if url is read with gsutil."""
+  return url.startswith(GCS_URL_PREFIX) or url.startswith('gs://')
+
+
+def is_http_url(url):
+  """Returns true if url is read with requests."""
+  return url.startswith('http://') or url.startswith('https://')
+
+
+def get_local_path(url):
+  """Returns the path of a local file URL."""
+  return url.replace('file://', '', 1)
+
+
+def get_url_size(url):
+  """Returns the size of the content of url."""
+  if is_gcs_url(url):
+    _, output = common.execute(
+        'gsutil', 'stat %s' % get_gsutil_path(url), '.', print_output=False)
+    return int(re.search(r'Content-Length:\s*(\d+)', output).group(1))
+  elif is_http_url(url):
+    response = http_client.head(url)
+    response.raise_for_status()
+    return int(response.headers['Content-Length'])
+  return os.path.getsize(get_local_path(url))
+
+
+@contextlib.contextmanager
+def open_url(url, start=None, end=None):
+  """Yields a stream of the content of url, or only of the bytes from start to
+    end (inclusive) when they are given.
+
+  GCS builds are streamed through `gsutil cat`, which uses the credentials of
+  the user. Other http(s) URLs are fetched directly and anything else is
+  read as a local file."""
+
+  if is_gcs_url(url):
+    args = ['gsutil', 'cat']
+    if start is not None:
+      args += ['-r', '%d-%d' % (start, end)]
+    proc = subprocess.Popen(args + [get_gsutil_path(url)],
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    try:
+      yield proc.stdout
+      # Drain the output so that gsutil doesn't fail on a closed pipe.
+      while proc.stdout.read(CHUNK_SIZE):
+        pass
+      error = proc.stderr.read()
+      if proc.wait() != 0:
+        raise BadArchiveError('gsutil failed to download %s: %s' % (
+            url, error.strip()))
+    finally:
+      if proc.poll() is None:
+        proc.kill()
+        proc.wait()
+  elif is_http_url(url):
+    headers = {}
+    if start is not None:
+      headers['Range'] = 'bytes=%d-%d' % (start, end)
+    response = http_client.get(url, headers=headers, stream=True)
+    response.raise_for_status()
+    response.raw.decode_content = True
+    try:
+      yield response.raw
+    finally:
+      response.close()
+  else:
+    with open(get_local_path(url), 'rb') as f:
+      if start is not None:
+        f.seek(start)
+      yield f
+
+
+def get_target_path(dest_dir, name, prefix=''):
+  """Returns where the member called name is extracted once prefix is removed
+    from it, refusing members that would be written outside of dest_dir."""
+  parts = [p for p in name.split('/') if p and p != '.']
+  if (name.startswith('/') or '..' in parts or
+      not (name + '/').startswith(prefix)):
+    raise BadArchiveError('Refusing to extract %s.' % name)
+  return os.path.join(dest_dir, *parts[len(prefix.split('/')) - 1:])
+
+
+def get_zip64_sizes(extra, compressed_size, uncompressed_size):
+  """Returns the sizes stored in the zip64 extra field when the sizes of the
+    header overflowed."""
+  offset = 0
+  while offset + 4 <= len(extra):
+    field_id, field_size = struct.unpack('<HH', extra[offset:offset + 4])
+    data = extra[offset + 4:offset + 4 + field_size]
+    if field_id == ZIP64_EXTRA_ID:
+      values = list(struct.unpack('<%dQ' % (len(data) // 8),
+                                  data[:len(data) // 8 * 8]))
+      if uncompressed_size == ZIP64_LIMIT:
+        uncompressed_size = values.pop(0)
+      if compressed_size == ZIP64_LIMIT:
+        compressed_size = values.pop(0)
+      return True, compressed_size, uncompressed_size
+    offset += 4 + field_size
+  return False, compressed_size, uncompressed_size
+
+
+def copy_stored(reader, size, output):
+  """Copies size bytes of a stored member. Returns their crc."""
+  crc = 0
+  while size > 0:
+    chunk = reader.read_exactly(min(size, CHUNK_SIZE))
+    crc = zlib.crc32(chunk, crc)
+    output.write(chunk)
+    size -= len(chunk)
+  return crc
+
+
+def copy_deflated(reader, size, output):
+  """Inflates a deflated member into output. size is None when it is only
+    known from the data descriptor, in which case the member ends where the
+    deflate stream ends. Returns the crc of the inflated bytes."""
+  crc = 0
+  decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+  while size is None or size > 0:
+    chunk = reader.read(CHUNK_SIZE if size is None else min(size, CHUNK_SIZE))
+    if not chunk:
+      raise BadArchiveError('The archive ended unexpectedly.')
+    if size is not None:
+      size -= len(chunk)
+
+    data = decompressor.decompress(chunk)
+    crc = zlib.crc32(data, crc)
+    output.write(data)
+    if decompressor.unused_data:
+      reader.unread(decompressor.unused_data)
+      break
+
+  data = decompressor.flush()
+  crc = zlib.crc32(data, crc)
+  output.write(data)
+  return crc
+
+
+def inflate_file(data, path, crc):
+  """Inflates the deflated content of a member into path.
+
+  At most CHUNK_SIZE inflated bytes are held at a time, so that members
+  inflated in parallel don't each need their whole size in memory."""
+  decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+  content_crc = 0
+  try:
+    with open(path + '.tmp', 'wb') as f:
+      for start in range(0, len(data), CHUNK_SIZE):
+        chunk = data[start:start + CHUNK_SIZE]
+        while chunk:
+          content = decompressor.decompress(chunk, CHUNK_SIZE)
+          content_crc = zlib.crc32(content, content_crc)
+          f.write(content)
+          chunk = decompressor.unconsumed_tail
+      content = decompressor.flush()
+      content_crc = zlib.crc32(content, content_crc)
+      f.write(content)
+
+    if content_crc & ZIP64_LIMIT != crc:
+      raise BadArchiveError('%s is corrupted (bad crc).' % path)
+    os.rename(path + '.tmp', path)
+  finally:
+    common.delete_if_exists(path + '.tmp')
+
+
+def read_data_descriptor(reader, is_zip64):
+  """Reads the data descriptor after a member. Returns its crc."""
+  crc = struct.unpack('<I', reader.read_exactly(4))[0]
+  if crc == DATA_DESCRIPTOR_SIGNATURE:
+    # The signature is optional.
+    crc = struct.unpack('<I', reader.read_exactly(4))[0]
+  reader.read_exactly(16 if is_zip64 else 8)
+  return crc
+
+
+def extract_member(reader, dest_dir, header, prefix='', skip_existing=False,
+                   inflater=None):
+  """Extracts the member whose local header was just read. Existing files are
+    left alone when skip_existing is true. Members of known size are
+    inflated by inflater, when there is one."""
+
+  (_, _, flags, method, _, _, crc, compressed_size, uncompressed_size,
+   name_length, extra_length) = header
+  name = reader.read_exactly(name_length)
+  extra = reader.read_exactly(extra_length)
+  is_zip64, compressed_size, uncompressed_size = get_zip64_sizes(
+      extra, compressed_size, uncompressed_size)
+  has_data_descriptor = bool(flags & FLAG_DATA_DESCRIPTOR)
+
+  if flags & FLAG_ENCRYPTED:
+    raise StreamingNotSupportedError('%s is encrypted.' % name)
+  if method not in (METHOD_STORED, METHOD_DEFLATED):
+    raise StreamingNotSupportedError(
+        '%s uses the compression method %d.' % (name, method))
+  if method == METHOD_STORED and has_data_descriptor:
+    raise StreamingNotSupportedError('the size of %s is unknown.' % name)
+
+  path = get_target_path(dest_dir, name, prefix)
+  is_dir = name.endswith('/')
+  dir_path = path if is_dir else os.path.dirname(path)
+  if not os.path.exists(dir_path):
+    os.makedirs(dir_path)
+
+  # Directories have no content, but may still have an empty deflate stream.
+  # Files are written under a temporary name so that a file which exists is
+  # always complete.
+  skip = is_dir or (skip_existing and os.path.lexists(path))
+  if (inflater and not skip and method == METHOD_DEFLATED and
+      not has_data_descriptor and
+      compressed_size <= MAX_PARALLEL_MEMBER_SIZE):
+    inflater.submit(reader.read_exactly(compressed_size), path, crc)
+    return
+
+  temp_path = path + '.tmp'
+  with NullFile() if skip else open(temp_path, 'wb') as output:
+    if method == METHOD_STORED:
+      actual_crc = copy_stored(reader, compressed_size, output)
+    else:
+      actual_crc = copy_deflated(
+          reader, None if has_data_descriptor else compressed_size, output)
+
+  if has_data_descriptor:
+    crc = read_data_descriptor(reader, is_zip64)
+  if actual_crc & ZIP64_LIMIT != crc:
+    raise BadArchiveError('%s is corrupted (bad crc).' % name)
+  if not skip:
+    os.rename(temp_path, path)
+
+
+def apply_mode(path, create_system, external_attr):
+  """Applies the unix permissions of a member to the file extracted at path,
+    and turns it into a symlink if the member is one."""
+
+  mode = external_attr >> 16
+  if create_system != UNIX_SYSTEM or not mode or os.path.islink(path):
+    return
+
+  if stat.S_ISLNK(mode):
+    with open(path) as f:
+      link_target = f.read()
+    os.remove(path)
+    os.symlink(link_target, path)
+  elif stat.S_IMODE(mode):
+    os.chmod(path, stat.S_IMODE(mode))
+
+
+def apply_modes(reader, dest_dir, prefix=''):
+  """Reads the central directory and applies the unix permissions and
+    symlinks of the extracted members."""
+
+  while True:
+    data = reader.read(CENTRAL_HEADER.size)
+    signature = get_signature(data)
+    if signature in END_SIGNATURES:
+      return
+    if (signature != CENTRAL_HEADER_SIGNATURE or
+        len(data) < CENTRAL_HEADER.size):
+      raise BadArchiveError('The archive ended unexpectedly.')
+
+    header = CENTRAL_HEADER.unpack(data)
+    version_made_by, name_length, extra_length, comment_length = (
+        header[1], header[10], header[11], header[12])
+    external_attr = header[15]
+    name = reader.read_exactly(name_length)
+    reader.read_exactly(extra_length + comment_length)
+    apply_mode(get_target_path(dest_dir, name, prefix), version_made_by >> 8,
+               external_attr)
+
+
+def extract_stream(stream, dest_dir, prefix='', skip_existing=False):
+  """Extracts the zip archive read from stream into dest_dir as it arrives.
+    Every member must start with prefix, which is removed from its path.
+
+  Raises StreamingNotSupportedError when a member can't be extracted without
+  the central directory, in which case dest_dir holds a partial extraction."""
+
+  reader = StreamReader(stream)
+  inflater = ParallelInflater()
+  try:
+    while True:
+      data = reader.read(LOCAL_HEADER.size)
+      if get_signature(data) != LOCAL_HEADER_SIGNATURE:
+        reader.unread(data)
+        break
+      if len(data) < LOCAL_HEADER.size:
+        raise BadArchiveError('The archive ended unexpectedly.')
+      extract_member(reader, dest_dir, LOCAL_HEADER.unpack(data), prefix,
+                     skip_existing, inflater)
+    inflater.wait()
+  finally:
+    inflater.close()
+
+  apply_modes(reader, dest_dir, prefix)
+
+
+def extract_url(url, dest_dir, prefix='', skip_existing=False):
+  """Downloads the zip archive at url and extracts it into dest_dir at the
+    same time, without storing the archive."""
+  logger.info('Downloading and extracting %s...', url)
+  with open_url(url) as stream:
+    extract_stream(stream, dest_dir, prefix, skip_existing)
+
+
+def extract_file(path, dest_dir, threads=None):
+  """Extracts the zip archive at path into dest_dir, with the members spread
+    over a thread per core."""
+
+  zip_files = []
+  local = threading.local()
+
+  def extract(member):
+    """Extracts a member with the zip file of the current thread."""
+    if not hasattr(local, 'zip_file'):
+      local.zip_file = zipfile.ZipFile(path)
+      zip_files.append(local.zip_file)
+
+    target_path = get_target_path(dest_dir, member.filename)
+    if member.filename.endswith('/'):
+      if not os.path.exists(target_path):
+        os.makedirs(target_path)
+      return
+    # Another thread may create the same directory at the same time.
+    try:
+      os.makedirs(os.path.dirname(target_path))
+    except OSError:
+      if not os.path.isdir(os.path.dirname(target_path)):
+        raise
+
+    with local.zip_file.open(member) as source:
+      with open(target_path, 'wb') as target:
+        shutil.copyfileobj(source, target, CHUNK_SIZE)
+
+  with contextlib.closing(zipfile.ZipFile(path)) as zip_file:
+    members = zip_file.infolist()
+
+  pool = ThreadPool(threads or multiprocessing.cpu_count())
+  try:
+    pool.map(extract, members)
+  finally:
+    pool.close()
+    pool.join()
+    for zip_file in zip_files:
+      zip_file.close()
+
+  # Symlinks are made once their targets are extracted.
+  for member in members:
+    apply_mode(get_target_path(dest_dir, member.filename),
+               member.create_system, member.external_attr)
+
+
+def get_members(reader):
+  """Returns the zipfile.ZipInfo of every member of the archive read by a
+    RangeReader, from its central directory."""
+  return zipfile.ZipFile(reader).infolist()
+
+
+def extract_members(reader, members, dest_dir, prefix=''):
+  """Extracts only the given members of the archive read by a RangeReader.
+
+  Each member is streamed with its own range request."""
+
+  for member in members:
+    logger.info('Extracting %s...', member.filename)
+    reader.seek(member.header_offset)
+    header = LOCAL_HEADER.unpack(reader.read(LOCAL_HEADER.size))
+    name_length, extra_length = header[9], header[10]
+    # The sizes of the central directory are always right, even when the
+    # local header defers them to a data descriptor.
+    end = (member.header_offset + LOCAL_HEADER.size + name_length +
+           extra_length + member.compress_size)
+    if header[2] & FLAG_DATA_DESCRIPTOR:
+      end += DATA_DESCRIPTOR_MAX_SIZE
+
+    with open_url(reader.url, member.header_offset,
+                  min(end, reader.size) - 1) as stream:
+      stream_reader = StreamReader(stream)
+      stream_reader.read_exactly(LOCAL_HEADER.size)
+      extract_member(stream_reader, dest_dir, header, prefix)
+    apply_mode(get_target_path(dest_dir, member.filename, prefix),
+               member.create_system, member.external_attr)
@@ -14,6 +14,7 @@
 # limitations under the License.
 
 import os
+import re
 import stat
 import multiprocessing
 import urllib
@@ -21,14 +22,49 @@ import json
 import sys
 import base64
 import string
+import hashlib
 import logging
-import urlfetch
+import ConfigParser
+from distutils import spawn
 
 from cmd_editor import editor
+from clusterfuzz import archive
+from clusterfuzz import cache
 from clusterfuzz import common
+from clusterfuzz import downloader
+from clusterfuzz import elf
+from clusterfuzz import http_client
 
 
 logger = logging.getLogger('clusterfuzz')
+# Marks a shared build of which only some files were extracted.
+SELECTIVE_EXTRACTION_MARKER = '.clusterfuzz_selective_extraction'
+# The files extracted with a binary, in addition to its shared libraries.
+SELECTIVE_EXTRACTION_SUFFIXES = ['', '.dict', '.options']
+SELECTIVE_EXTRACTION_FILES = ['args.gn']
+# Stores the revision lookups, which never change once made.
+MEMO_FILE = os.path.join(common.CLUSTERFUZZ_CACHE_DIR, 'revisions.json')
+# Records the fingerprint of every checkout when gclient sync, gclient
+# runhooks and the clang update last completed in it.
+CHECKOUT_STAMPS_FILE = os.path.join(
+    common.CLUSTERFUZZ_CACHE_DIR, 'checkout_stamps.json')
+MASTER_REF = 'origin/master'
+# The number of hex digits of the args hash in the names of out dirs.
+OUT_DIR_KEY_SIZE = 12
+# Records the fingerprint of what the last gn gen in an out dir used.
+GN_STAMP_FILE = '.clusterfuzz_gn_stamp'
+# The gn binary run by the depot_tools wrapper, and the files read first by
+# gn gen. Changes to other build files are picked up by ninja itself.
+GN_SOURCE_FILES = [os.path.join('buildtools', 'linux64', 'gn'), '.gn',
+                   'BUILD.gn']
+COMMIT_POSITION_REGEX = re.compile(
+    r'^Cr-Commit-Position: refs/heads/master@\{#(\d+)\}\s*$', re.MULTILINE)
+# Builds larger than this are downloaded by gsutil in parallel slices.
+GSUTIL_SLICED_DOWNLOAD_THRESHOLD = '64M'
+# Errors printed when a binary misses a file of a selectively extracted build.
+MISSING_FILE_ERRORS = ['error while loading shared libraries',
+                       'cannot open shared object file',
+                       'ParseDictionaryFile']
 
 
 def build_revision_to_sha_url(revision, repo):
@@ -41,25 +77,146 @@ def build_revision_to_sha_url(revision, repo):
               'repo': repo}))
 
 
-def sha_from_revision(revision, repo):
-  """Converts a chrome revision number to it corresponding git sha."""
+def get_memoized(section, key, compute):
+  """Returns the value stored under key in a section of the memo file, or
+    computes, stores and returns it.
 
-  response = urlfetch.fetch(build_revision_to_sha_url(revision, repo))
-  return json.loads(response.body)['git_sha']
+  Only immutable mappings, like revisions to git shas, belong there."""
 
+  key = str(key)
+  value = common.read_json_file(MEMO_FILE, default={}).get(
+      section, {}).get(key)
+  if value is not None:
+    return value
 
-def get_pdfium_sha(chromium_sha):
-  """Gets the correct Pdfium sha using the Chromium sha."""
-  response = urlfetch.fetch(
-      ('https://chromium.googlesource.com/chromium/src.git/+/%s/DEPS?'
-       'format=TEXT' % chromium_sha))
-  body = base64.b64decode(response.body)
-  sha_line = [l for l in body.split('\n') if "'pdfium_revision':" in l][0]
+  value = compute()
+  with common.file_lock(MEMO_FILE + '.lock'):
+    memo = common.read_json_file(MEMO_FILE, default={})
+    memo.setdefault(section, {})[key] = value
+    common.write_json_file(MEMO_FILE, memo)
+  return value
+
+
+def get_git_output(source_dir, args):
+  """Returns the output of a git command in source_dir, or None if there is
+    no such checkout or the command fails."""
+
+  if not source_dir or not os.path.isdir(source_dir):
+    return None
+  returncode, output = common.execute(
+      'git', args, source_dir, print_command=False, print_output=False,
+      exit_on_error=False)
+  if returncode != 0 or not output.strip():
+    return None
+  return output.strip()
+
+
+def get_commit_position(message):
+  """Returns the master commit position in a commit message, or None."""
+  match = COMMIT_POSITION_REGEX.search(message or '')
+  return int(match.group(1)) if match else None
+
+
+def find_local_sha(revision, source_dir):
+  """Returns the sha of the master commit at position revision in the checkout
+    at source_dir, or None if the checkout doesn't have it.
+
+  Positions are consecutive on the first-parent history of master, so the
+  commit is expected <head position - revision> commits before the head and
+  only its footer is checked, instead of searching the whole history."""
+
+  head_position = get_commit_position(get_git_output(
+      source_dir, 'log -1 --format=%%B %s' % MASTER_REF))
+  if head_position is None or head_position < int(revision):
+    return None
+
+  output = get_git_output(
+      source_dir, 'log -1 --first-parent --skip=%d --format=%%H%%n%%B %s' % (
+          head_position - int(revision), MASTER_REF))
+  if not output:
+    return None
+  sha, _, message = output.partition('\n')
+  if get_commit_position(message) != int(revision):
+    return None
+  return sha
+
+
+def sha_from_revision(revision, repo, source_dir=None):
+  """Converts a chrome revision number to it corresponding git sha.
+
+  The commit is first looked up in the checkout of repo at source_dir, if
+  any, and then on cr-rev."""
+
+  def compute():
+    sha = find_local_sha(revision, source_dir)
+    if sha:
+      return sha
+    response = http_client.get(build_revision_to_sha_url(revision, repo))
+    return json.loads(response.content)['git_sha']
+
+  return get_memoized('shas', '%s@%s' % (repo, revision), compute)
+
+
+def parse_pdfium_sha(deps):
+  """Returns the Pdfium sha pinned in the content of a Chromium DEPS file."""
+  sha_line = [l for l in deps.split('\n') if "'pdfium_revision':" in l][0]
   sha_line = sha_line.translate(None, string.punctuation).replace(
       'pdfiumrevision', '')
   return sha_line.strip()
 
 
+def get_pdfium_sha(chromium_sha, chromium_dir=None):
+  """Gets the correct Pdfium sha using the Chromium sha.
+
+  DEPS is read from the Chromium checkout at chromium_dir when it has the
+  commit, and downloaded otherwise."""
+
+  def compute():
+    deps = get_git_output(chromium_dir, 'show %s:DEPS' % chromium_sha)
+    if not deps:
+      response = http_client.get(
+          ('https://chromium.googlesource.com/chromium/src.git/+/%s/DEPS?'
+           'format=TEXT' % chromium_sha))
+      deps = base64.b64decode(response.content)
+    return parse_pdfium_sha(deps)
+
+  return get_memoized('pdfium_shas', chromium_sha, compute)
+
+
+def get_checkout_stamp(source_dir, step):
+  """Returns the fingerprint of the checkout at source_dir when step last
+    completed in it, or None."""
+  return common.read_json_file(CHECKOUT_STAMPS_FILE, default={}).get(
+      source_dir, {}).get(step)
+
+
+def set_checkout_stamp(source_dir, step, fingerprint):
+  """Records that step completed in the checkout at source_dir."""
+  with common.file_lock(CHECKOUT_STAMPS_FILE + '.lock'):
+    stamps = common.read_json_file(CHECKOUT_STAMPS_FILE, default={})
+    stamps.setdefault(source_dir, {})[step] = fingerprint
+    common.write_json_file(CHECKOUT_STAMPS_FILE, stamps)
+
+
+def get_msan_gyp_defines(args_hash):
+  """Returns the GYP_DEFINES of MSan builds, with the origin tracking of
+    their GN args."""
+  msan_track_origins_value = (int(args_hash['msan_track_origins'])
+                              if 'msan_track_origins' in args_hash
+                              else 2)
+  return ('msan=1 msan_track_origins=%d '
+          'use_prebuilt_instrumented_libraries=1') % msan_track_origins_value
+
+
+def get_file_state(path):
+  """Returns the size and modification time of the file at path, or None if
+    there is no such file."""
+  if not path or not os.path.isfile(path):
+    return None
+  stat_result = os.stat(path)
+  return [stat_result.st_size, stat_result.st_mtime]
+
+
 def sha_exists(sha, source_dir):
   """Check if sha exists."""
   returncode, _ = common.execute(
@@ -67,55 +224,254 @@ def sha_exists(sha, source_dir):
   return returncode == 0
 
 
+def is_selective_extraction(build_dir):
+  """Returns true if only some files of the build were extracted."""
+  return os.path.exists(os.path.join(build_dir, SELECTIVE_EXTRACTION_MARKER))
+
+
+def get_dict_names(reproduction_args, options_path):
+  """Returns the names of the dictionaries a libFuzzer target uses, from the
+    -dict argument it's run with or from its .options file. Dictionaries are
+    often shared between targets, so they aren't always <binary>.dict."""
+
+  names = set()
+  match = re.search(r'(?:^|\s)-dict=(\S+)', reproduction_args or '')
+  if match:
+    names.add(os.path.basename(match.group(1)))
+
+  if os.path.isfile(options_path):
+    parser = ConfigParser.RawConfigParser()
+    try:
+      parser.read(options_path)
+      if parser.has_option('libfuzzer', 'dict'):
+        names.add(os.path.basename(parser.get('libfuzzer', 'dict').strip()))
+    except ConfigParser.Error as e:
+      logger.debug('Failed to parse %s: %s', options_path, e)
+  return names
+
+
 class BinaryProvider(object):
   """Downloads/builds and then provides the location of a binary."""
 
-  def __init__(self, testcase_id, build_url, binary_name):
+  def __init__(self, testcase_id, build_url, binary_name,
+               selective_extraction=False, reproduction_args=None):
     self.testcase_id = testcase_id
     self.build_url = build_url
     self.build_directory = None
     self.binary_name = binary_name
+    self.selective_extraction = selective_extraction
+    self.reproduction_args = reproduction_args
 
   def get_build_directory(self):
     """Get build directory. This method must be implemented by a subclass."""
     raise NotImplementedError
 
   def download_build_data(self):
-    """Downloads a build and saves it locally."""
+    """Downloads a build into the shared build cache and links it."""
 
     build_dir = self.build_dir_name()
-    binary_location = os.path.join(build_dir, self.binary_name)
-    if os.path.exists(build_dir):
+    if os.path.exists(build_dir) and not os.path.islink(build_dir):
+      # Builds downloaded by older versions aren't in the shared cache.
       return build_dir
 
+    shared_build_dir = cache.get_build_dir(self.build_url)
+    # Another process or thread may be downloading the same build.
+    with common.file_lock(cache.get_build_lock_file(shared_build_dir)):
+      cache.claim_build(self.build_url)
+      if os.path.exists(shared_build_dir):
+        logger.info('Using the cached build at %s', shared_build_dir)
+        if (is_selective_extraction(shared_build_dir) and
+            not os.path.exists(os.path.join(shared_build_dir,
+                                            self.binary_name))):
+          self.extract_selected_files(shared_build_dir)
+          cache.update_build_size(self.build_url)
+        cache.link_testcase(self.build_url, self.testcase_id, build_dir)
+        return build_dir
+
+      if self.selective_extraction:
+        self.download_selected_files(shared_build_dir)
+      else:
+        self.download_shared_build(shared_build_dir)
+      cache.link_testcase(self.build_url, self.testcase_id, build_dir)
+    cache.evict()
+    return build_dir
+
+  def download_shared_build(self, shared_build_dir):
+    """Downloads and extracts the build into shared_build_dir."""
+
     logger.info('Downloading build data...')
-    if not os.path.exists(common.CLUSTERFUZZ_BUILDS_DIR):
-      os.makedirs(common.CLUSTERFUZZ_BUILDS_DIR)
+    filename = os.path.split(self.build_url)[1]
+    # The build is extracted next to its final location so that an
+    # interrupted download never looks like a cached build.
+    partial_dir = shared_build_dir + '.partial'
+    common.delete_if_exists(partial_dir)
+    try:
+      try:
+        archive.extract_url(self.build_url, partial_dir)
+      except archive.StreamingNotSupportedError as e:
+        logger.info('%s Downloading the whole archive instead.', e)
+        common.delete_if_exists(partial_dir)
+        self.download_and_extract(partial_dir)
+
+      os.rename(os.path.join(partial_dir, os.path.splitext(filename)[0]),
+                shared_build_dir)
+    finally:
+      common.delete_if_exists(partial_dir)
+
+    binary_location = os.path.join(shared_build_dir, self.binary_name)
+    stats = os.stat(binary_location)
+    os.chmod(binary_location, stats.st_mode | stat.S_IEXEC)
 
-    gsutil_path = self.build_url.replace(
-        'https://storage.cloud.google.com/', 'gs://')
-    common.execute(
-        'gsutil', 'cp %s .' % gsutil_path, common.CLUSTERFUZZ_CACHE_DIR)
+  def get_archive_prefix(self):
+    """Returns the directory of the build archive that holds the build."""
+    return os.path.splitext(os.path.split(self.build_url)[1])[0] + '/'
 
-    filename = os.path.split(gsutil_path)[1]
-    saved_file = os.path.join(common.CLUSTERFUZZ_CACHE_DIR, filename)
+  def download_selected_files(self, shared_build_dir):
+    """Extracts only the binary and the files it needs into shared_build_dir,
+      without downloading the rest of the build."""
 
-    common.execute(
-        'unzip', '-q %s -d %s' % (saved_file, common.CLUSTERFUZZ_BUILDS_DIR),
-        cwd=common.CLUSTERFUZZ_DIR)
+    logger.info('Downloading the files needed by %s...', self.binary_name)
+    partial_dir = shared_build_dir + '.partial'
+    common.delete_if_exists(partial_dir)
+    os.makedirs(partial_dir)
+    try:
+      with open(os.path.join(partial_dir, SELECTIVE_EXTRACTION_MARKER), 'w'):
+        pass
+      self.extract_selected_files(partial_dir)
+      os.rename(partial_dir, shared_build_dir)
+    finally:
+      common.delete_if_exists(partial_dir)
+
+  def extract_selected_files(self, build_dir):
+    """Extracts the binary, its dict, options and args.gn files and the shared
+      libraries it loads, as listed in the ELF DT_NEEDED entries."""
+
+    reader = archive.RangeReader(self.build_url)
+    prefix = self.get_archive_prefix()
+    members = {}
+    libraries = {}
+    for member in archive.get_members(reader):
+      if member.filename.startswith(prefix):
+        members[member.filename[len(prefix):]] = member
+        libraries.setdefault(os.path.basename(member.filename), member)
+
+    names = [self.binary_name + suffix
+             for suffix in SELECTIVE_EXTRACTION_SUFFIXES]
+    names += SELECTIVE_EXTRACTION_FILES
+    archive.extract_members(
+        reader, [members[name] for name in names if name in members],
+        build_dir, prefix)
+
+    dict_names = get_dict_names(
+        self.reproduction_args,
+        os.path.join(build_dir, self.binary_name + '.options'))
+    archive.extract_members(
+        reader, [members.get(name) or libraries[name]
+                 for name in sorted(dict_names - set(names))
+                 if name in members or name in libraries],
+        build_dir, prefix)
+
+    # Libraries are looked up by name, wherever they are in the build.
+    binaries = [os.path.join(build_dir, self.binary_name)]
+    extracted = set()
+    while binaries:
+      needed = [libraries[library]
+                for library in elf.get_needed_libraries(binaries.pop())
+                if library in libraries and library not in extracted]
+      archive.extract_members(reader, needed, build_dir, prefix)
+      for member in needed:
+        extracted.add(os.path.basename(member.filename))
+        binaries.append(archive.get_target_path(
+            build_dir, member.filename, prefix))
 
-    logger.info('Cleaning up...')
-    os.remove(saved_file)
-    os.rename(os.path.join(common.CLUSTERFUZZ_BUILDS_DIR,
-                           os.path.splitext(filename)[0]), build_dir)
+    binary_location = os.path.join(build_dir, self.binary_name)
     stats = os.stat(binary_location)
     os.chmod(binary_location, stats.st_mode | stat.S_IEXEC)
 
+  def extract_missing_files(self, output):
+    """Extracts the rest of a selectively extracted build if output shows that
+      the binary missed a file. Returns true if the binary should be run
+      again."""
+
+    if not any(error in output for error in MISSING_FILE_ERRORS):
+      return False
+
+    shared_build_dir = cache.get_build_dir(self.build_url)
+    if not is_selective_extraction(shared_build_dir):
+      return False
+
+    with common.file_lock(cache.get_build_lock_file(shared_build_dir)):
+      # Another process may have extracted the build while we waited.
+      if not is_selective_extraction(shared_build_dir):
+        return True
+
+      logger.info('The binary misses files, extracting the whole build...')
+      try:
+        archive.extract_url(self.build_url, shared_build_dir,
+                            self.get_archive_prefix(), skip_existing=True)
+      except archive.StreamingNotSupportedError as e:
+        logger.info('%s Downloading the whole archive instead.', e)
+        self.add_missing_files(shared_build_dir)
+      os.remove(os.path.join(shared_build_dir, SELECTIVE_EXTRACTION_MARKER))
+    cache.update_build_size(self.build_url)
+    return True
+
+  def add_missing_files(self, shared_build_dir):
+    """Downloads the whole build archive and moves the files which aren't in
+      shared_build_dir yet into it."""
+
+    partial_dir = shared_build_dir + '.partial'
+    common.delete_if_exists(partial_dir)
+    try:
+      self.download_and_extract(partial_dir)
+      extracted_dir = os.path.join(partial_dir, self.get_archive_prefix())
+      for root, dirs, files in os.walk(extracted_dir):
+        dest_root = os.path.join(
+            shared_build_dir, os.path.relpath(root, extracted_dir))
+        if not os.path.exists(dest_root):
+          os.makedirs(dest_root)
+        # Links to directories aren't walked into, so they're moved as is.
+        for name in files + [d for d in dirs
+                             if os.path.islink(os.path.join(root, d))]:
+          if not os.path.lexists(os.path.join(dest_root, name)):
+            os.rename(os.path.join(root, name), os.path.join(dest_root, name))
+    finally:
+      common.delete_if_exists(partial_dir)
+
+  def download_and_extract(self, dest_dir):
+    """Downloads the whole build archive, then extracts it into dest_dir.
+
+    gsutil fetches GCS builds in slices and resumes interrupted downloads
+    from its tracker files, other http(s) builds are fetched the same way by
+    the downloader."""
+
+    if not os.path.exists(common.CLUSTERFUZZ_CACHE_DIR):
+      os.makedirs(common.CLUSTERFUZZ_CACHE_DIR)
+
+    if archive.is_http_url(self.build_url) and not archive.is_gcs_url(
+        self.build_url):
+      saved_file = downloader.download(
+          self.build_url, common.CLUSTERFUZZ_CACHE_DIR)['path']
+    else:
+      gsutil_path = archive.get_gsutil_path(self.build_url)
+      common.execute(
+          'gsutil', '-o GSUtil:sliced_object_download_threshold=%s '
+          '-o GSUtil:sliced_object_download_max_components=%d cp %s .' % (
+              GSUTIL_SLICED_DOWNLOAD_THRESHOLD,
+              downloader.DEFAULT_CONNECTIONS, gsutil_path),
+          common.CLUSTERFUZZ_CACHE_DIR)
+      saved_file = os.path.join(
+          common.CLUSTERFUZZ_CACHE_DIR, os.path.split(gsutil_path)[1])
+
+    logger.info('Extracting %s...', saved_file)
+    archive.extract_file(saved_file, dest_dir)
+    os.remove(saved_file)
+
   def get_binary_path(self):
     return '%s/%s' % (self.get_build_directory(), self.binary_name)
 
   def build_dir_name(self):
-    """Returns a build number's respective directory."""
+    """Returns a testcase's link to its build in the shared build cache."""
     return os.path.join(common.CLUSTERFUZZ_BUILDS_DIR,
                         str(self.testcase_id) + '_build')
 
@@ -178,13 +534,17 @@ class GenericBuilder(BinaryProvider):
   def out_dir_name(self):
     """Returns the correct out dir in which to build the revision.
 
-    Directory name is of the format clusterfuzz_<testcase_id>_<git_sha>,
-    with a possible '_dirty' on the end. Based on the current git sha, and
-    whether changes have been made to the repo."""
+    Directory name is of the format clusterfuzz_<git_sha>_<args_key>, with a
+    possible '_dirty' on the end, where args_key is a hash of the GN args and
+    the target. Testcases building the same target with the same args at the
+    same revision share an out dir, so that ninja only rebuilds what
+    changed."""
 
+    args_key = hashlib.sha1(
+        '%s\n%s' % (self.target, self.gn_args)).hexdigest()[:OUT_DIR_KEY_SIZE]
     dir_name = os.path.join(self.source_directory, 'out',
-                            'clusterfuzz_%s_%s' % (str(self.testcase_id),
-                                                   self.get_current_sha()))
+                            'clusterfuzz_%s_%s' % (self.get_current_sha(),
+                                                   args_key))
     if self.source_dir_is_dirty():
       dir_name += '_dirty'
     return dir_name
@@ -238,17 +598,10 @@ class GenericBuilder(BinaryProvider):
       gn_args['goma_dir'] = '"%s"' % self.goma_dir
     return gn_args
 
-  def setup_gn_args(self):
-    """Ensures that args.gn is set up properly."""
-    # Remove existing gn file from build directory.
-    args_gn_path = os.path.join(self.build_directory, 'args.gn')
-    if os.path.isfile(args_gn_path):
-      os.remove(args_gn_path)
-
-    # Create build directory if it does not already exist.
-    if not os.path.exists(self.build_directory):
-      os.makedirs(self.build_directory)
-
+  def get_gn_args(self):
+    """Returns the content of args.gn: the args of the testcase or of its
+      downloaded build with the options of the builder, as edited by the user
+      in edit mode."""
     # If no args.gn file is found, get it from downloaded build.
     if self.gn_args:
       gn_args = self.gn_args
@@ -272,13 +625,85 @@ class GenericBuilder(BinaryProvider):
           content, prefix='edit-args-gn-',
           comment='Edit args.gn before building.')
 
-    # Write args to file and store.
-    with open(args_gn_path, 'w') as f:
-      f.write(content)
-    self.gn_args = content
+    return content
+
+  def get_gn_fingerprint(self):
+    """Returns a fingerprint of the args, the flags, the gn binary and the
+      root build files used by gn gen."""
+    paths = [spawn.find_executable('gn')] + [
+        os.path.join(self.source_directory, path) for path in GN_SOURCE_FILES]
+    return hashlib.sha1(json.dumps(
+        [self.gn_args, self.gn_flags] +
+        [get_file_state(path) for path in paths])).hexdigest()
+
+  def setup_gn_args(self):
+    """Ensures that args.gn is set up properly.
+
+    Nothing is rewritten and gn gen isn't run when the fingerprint of the
+    last gn gen in the build directory is the same, so that ninja doesn't
+    regenerate anything."""
+    args_gn_path = os.path.join(self.build_directory, 'args.gn')
+    stamp_path = os.path.join(self.build_directory, GN_STAMP_FILE)
+    fingerprint = self.get_gn_fingerprint()
+    if (os.path.isfile(os.path.join(self.build_directory, 'build.ninja')) and
+        common.read_json_file(stamp_path) == fingerprint):
+      logger.info('args.gn is unchanged, skipping gn gen.')
+      return
 
+    # Create build directory if it does not already exist.
+    if not os.path.exists(self.build_directory):
+      os.makedirs(self.build_directory)
+
+    # Rewriting the same args would make ninja regenerate the build files.
+    old_gn_args = None
+    if os.path.isfile(args_gn_path):
+      with open(args_gn_path, 'r') as f:
+        old_gn_args = f.read()
+    if old_gn_args != self.gn_args:
+      with open(args_gn_path, 'w') as f:
+        f.write(self.gn_args)
+
+    # An interrupted gn gen must not be skipped next time.
+    if os.path.isfile(stamp_path):
+      os.remove(stamp_path)
     common.execute('gn', 'gen %s %s' % (self.gn_flags, self.build_directory),
                    self.source_directory)
+    common.write_json_file(stamp_path, fingerprint)
+
+  def get_checkout_fingerprint(self, env=None):
+    """Returns a fingerprint of what gclient and the hooks depend on: the
+      checkout, its HEAD sha, its DEPS and GYP_DEFINES."""
+    deps_path = os.path.join(self.source_directory, 'DEPS')
+    deps_hash = None
+    if os.path.isfile(deps_path):
+      with open(deps_path, 'rb') as f:
+        deps_hash = hashlib.sha1(f.read()).hexdigest()
+    gyp_defines = (env or {}).get(
+        'GYP_DEFINES', os.environ.get('GYP_DEFINES'))
+    return hashlib.sha1(json.dumps(
+        [self.source_directory, self.get_current_sha(), deps_hash,
+         gyp_defines])).hexdigest()
+
+  def execute_checkout_step(self, step, binary, args, **kwargs):
+    """Runs a command in the source directory unless it already completed
+      for the same fingerprint of the checkout."""
+    fingerprint = self.get_checkout_fingerprint(kwargs.get('env'))
+    if get_checkout_stamp(self.source_directory, step) == fingerprint:
+      logger.info('Skipping %s %s, it already ran for this checkout.',
+                  binary, args)
+      return
+
+    common.execute(binary, args, self.source_directory, **kwargs)
+    set_checkout_stamp(self.source_directory, step, fingerprint)
+
+  def run_hooks(self):
+    """Runs gclient runhooks."""
+    self.execute_checkout_step('runhooks', 'gclient', 'runhooks')
+
+  def update_clang(self):
+    """Updates clang to the revision the checkout uses."""
+    self.execute_checkout_step(
+        'clang_update', 'python', 'tools/clang/scripts/update.py')
 
   def pre_build_steps(self):
     """Steps to be run before the target is built."""
@@ -297,7 +722,7 @@ class GenericBuilder(BinaryProvider):
   def build_target(self):
     """Build the correct revision in the source directory."""
     # Note: gclient sync must be run before setting up the gn args.
-    common.execute('gclient', 'sync', self.source_directory)
+    self.execute_checkout_step('sync', 'gclient', 'sync')
 
     self.pre_build_steps()
     self.setup_gn_args()
@@ -325,7 +750,11 @@ class GenericBuilder(BinaryProvider):
     if not self.current:
       self.checkout_source_by_sha()
 
+    self.gn_args = self.get_gn_args()
     self.build_directory = self.out_dir_name()
+    cache.record_out_dir(
+        self.build_directory, self.source_directory, self.testcase_id)
+    cache.evict_out_dirs(self.source_directory)
     self.build_target()
 
     return self.build_directory
@@ -340,9 +769,11 @@ class PdfiumBuilder(GenericBuilder):
         testcase.id, testcase.build_url, testcase.revision, current,
         goma_dir, os.environ.get(binary_definition.source_var), 'pdfium_test',
         None, goma_threads, edit_mode)
-    self.chromium_sha = sha_from_revision(self.revision, 'chromium/src')
+    chromium_dir = os.environ.get('CHROMIUM_SRC')
+    self.chromium_sha = sha_from_revision(
+        self.revision, 'chromium/src', chromium_dir)
     self.name = 'Pdfium'
-    self.git_sha = get_pdfium_sha(self.chromium_sha)
+    self.git_sha = get_pdfium_sha(self.chromium_sha, chromium_dir)
     self.gn_args = testcase.gn_args
     self.gn_args_options = {'pdf_is_standalone': 'true'}
     self.gn_flags = ''
@@ -357,15 +788,15 @@ class V8Builder(GenericBuilder):
         testcase.id, testcase.build_url, testcase.revision, current, goma_dir,
         os.environ.get(binary_definition.source_var), 'd8', None, goma_threads,
         edit_mode)
-    self.git_sha = sha_from_revision(self.revision, 'v8/v8')
+    self.git_sha = sha_from_revision(
+        self.revision, 'v8/v8', self.source_directory)
     self.gn_args = testcase.gn_args
     self.name = 'V8'
 
   def pre_build_steps(self):
-    common.execute('gclient', 'runhooks', self.source_directory)
+    self.run_hooks()
     if not self.current:
-      common.execute('python', 'tools/clang/scripts/update.py',
-                     self.source_directory)
+      self.update_clang()
 
 class ChromiumBuilder(GenericBuilder):
   """Builds a specific target from inside a Chromium source repository."""
@@ -382,15 +813,15 @@ class ChromiumBuilder(GenericBuilder):
         testcase.id, testcase.build_url, testcase.revision, current,
         goma_dir, os.environ.get(binary_definition.source_var), binary_name,
         target_name, goma_threads, edit_mode)
-    self.git_sha = sha_from_revision(self.revision, 'chromium/src')
+    self.git_sha = sha_from_revision(
+        self.revision, 'chromium/src', self.source_directory)
     self.gn_args = testcase.gn_args
     self.name = 'chromium'
 
   def pre_build_steps(self):
-    common.execute('gclient', 'runhooks', self.source_directory)
+    self.run_hooks()
     if not self.current:
-      common.execute('python', 'tools/clang/scripts/update.py',
-                     self.source_directory)
+      self.update_clang()
 
 
 class CfiChromiumBuilder(ChromiumBuilder):
@@ -405,37 +836,23 @@ class CfiChromiumBuilder(ChromiumBuilder):
 class MsanChromiumBuilder(ChromiumBuilder):
   """Build a MSAN chromium build."""
 
-  def setup_gn_args(self):
-    """Run the setup_gn_args and re-run hooks with special GYP_DEFINES."""
-    super(MsanChromiumBuilder, self).setup_gn_args()
-
-    args_hash = self.deserialize_gn_args(self.gn_args)
-    msan_track_origins_value = (int(args_hash['msan_track_origins'])
-                                if 'msan_track_origins' in args_hash
-                                else 2)
-    common.execute('gclient', 'runhooks', self.source_directory,
-                   env={'GYP_DEFINES':
-                        ('msan=1 msan_track_origins=%d '
-                         'use_prebuilt_instrumented_libraries=1') %
-                        msan_track_origins_value})
+  def run_hooks(self):
+    """Runs gclient runhooks with the special GYP_DEFINES of MSan builds."""
+    self.execute_checkout_step(
+        'runhooks', 'gclient', 'runhooks',
+        env={'GYP_DEFINES': get_msan_gyp_defines(
+            self.deserialize_gn_args(self.gn_args))})
 
 
 class MsanV8Builder(V8Builder):
   """Build a MSAN V8 build."""
 
-  def setup_gn_args(self):
-    """Run the setup_gn_args and re-run hooks with special GYP_DEFINES."""
-    super(MsanV8Builder, self).setup_gn_args()
-
-    args_hash = self.deserialize_gn_args(self.gn_args)
-    msan_track_origins_value = (int(args_hash['msan_track_origins'])
-                                if 'msan_track_origins' in args_hash
-                                else 2)
-    common.execute('gclient', 'runhooks', self.source_directory,
-                   env={'GYP_DEFINES':
-                        ('msan=1 msan_track_origins=%d '
-                         'use_prebuilt_instrumented_libraries=1') %
-                        msan_track_origins_value})
+  def run_hooks(self):
+    """Runs gclient runhooks with the special GYP_DEFINES of MSan builds."""
+    self.execute_checkout_step(
+        'runhooks', 'gclient', 'runhooks',
+        env={'GYP_DEFINES': get_msan_gyp_defines(
+            self.deserialize_gn_args(self.gn_args))})
 
 
 class ChromiumBuilder32Bit(ChromiumBuilder):
@@ -0,0 +1,284 @@
+"""Module for the shared build and testcase cache.
+
+Builds are stored once per build URL and every testcase using a build gets a
+symlink to it. The cache is kept under a byte budget by evicting the least
+recently used entries which are not used by a running process.
+
+The out dirs of local builds are shared by the testcases building the same
+target with the same args at the same revision. They live in the source
+checkouts, so they are not part of the byte budget: only the most recently
+used ones of every checkout are kept."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import time
+import atexit
+import hashlib
+import logging
+import contextlib
+import psutil
+
+from clusterfuzz import common
+
+INDEX_FILE = os.path.join(common.CLUSTERFUZZ_CACHE_DIR, 'index.json')
+INDEX_LOCK_FILE = INDEX_FILE + '.lock'
+DEFAULT_MAX_SIZE = '50G'
+DEFAULT_MAX_OUT_DIRS = 3
+SIZE_UNITS = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+# The processes which have registered to release their entries at exit.
+RELEASING_PIDS = set()
+logger = logging.getLogger('clusterfuzz')
+
+
+def get_build_key(build_url):
+  """Returns the key under which the build of build_url is stored."""
+  return hashlib.sha1(build_url).hexdigest()
+
+
+def get_build_dir(build_url):
+  """Returns the shared directory of the build of build_url."""
+  return os.path.join(common.CLUSTERFUZZ_BUILDS_DIR, get_build_key(build_url))
+
+
+def get_build_lock_file(build_dir):
+  """Returns the lock file held while a build is downloaded or extended."""
+  return build_dir + '.lock'
+
+
+def parse_size(size):
+  """Converts a size like 500M or 20G into a number of bytes."""
+  size = str(size).strip().upper()
+  if size and size[-1] in SIZE_UNITS:
+    return int(float(size[:-1]) * SIZE_UNITS[size[-1]])
+  return int(size)
+
+
+def get_max_size():
+  """Returns the byte budget of the cache, configured by CF_CACHE_MAX_SIZE."""
+  return parse_size(os.environ.get('CF_CACHE_MAX_SIZE', DEFAULT_MAX_SIZE))
+
+
+def get_max_out_dirs():
+  """Returns the number of out dirs kept per source checkout, configured by
+    CF_MAX_OUT_DIRS."""
+  return int(os.environ.get('CF_MAX_OUT_DIRS', DEFAULT_MAX_OUT_DIRS))
+
+
+def get_dir_size(path):
+  """Returns the total size of the files under path."""
+  total = 0
+  for root, _, files in os.walk(path):
+    for filename in files:
+      total += os.lstat(os.path.join(root, filename)).st_size
+  return total
+
+
+def get_index():
+  """Returns the cache index.
+
+  The index has a 'builds' section keyed by build key, a 'testcases'
+  section keyed by testcase ID and an 'out_dirs' section keyed by path.
+  Every entry records its path, size, last access time and the pids of the
+  processes using it. Out dirs aren't measured; they record their source
+  checkout and the testcases built in them instead."""
+  index = common.read_json_file(INDEX_FILE, default={})
+  index.setdefault('builds', {})
+  index.setdefault('testcases', {})
+  index.setdefault('out_dirs', {})
+  return index
+
+
+@contextlib.contextmanager
+def locked_index():
+  """Yields the index and stores it back, while holding the index lock."""
+  with common.file_lock(INDEX_LOCK_FILE):
+    index = get_index()
+    yield index
+    common.write_json_file(INDEX_FILE, index)
+
+
+def is_in_use(entry):
+  """Returns true if a running process uses the entry."""
+  return any(psutil.pid_exists(pid) for pid in entry.get('pids', []))
+
+
+def add_pid(entry):
+  """Records the current process as a user of the entry, and makes it release
+    its entries when it exits."""
+  pids = [pid for pid in entry.get('pids', []) if psutil.pid_exists(pid)]
+  if os.getpid() not in pids:
+    pids.append(os.getpid())
+  entry['pids'] = pids
+
+  if os.getpid() not in RELEASING_PIDS:
+    RELEASING_PIDS.add(os.getpid())
+    atexit.register(release)
+
+
+def touch(entry, path):
+  """Marks the entry as used right now by the current process."""
+  entry['path'] = path
+  entry['last_access'] = time.time()
+  add_pid(entry)
+  if 'size' not in entry:
+    entry['size'] = get_dir_size(path)
+
+
+def get_build_entry(index, build_url):
+  """Returns the index entry of the build of build_url, adding it if needed."""
+  return index['builds'].setdefault(
+      get_build_key(build_url), {'build_url': build_url, 'testcases': {}})
+
+
+def claim_build(build_url):
+  """Records the current process as a user of the build of build_url before
+    it's known to be cached, so that it isn't evicted while being used."""
+  with locked_index() as index:
+    entry = get_build_entry(index, build_url)
+    entry['path'] = get_build_dir(build_url)
+    entry['last_access'] = time.time()
+    add_pid(entry)
+
+
+def link_testcase(build_url, testcase_id, link_path):
+  """Points link_path to the shared build and records the testcase as a user
+    of that build in the index."""
+
+  if os.path.lexists(link_path):
+    os.remove(link_path)
+  build_dir = get_build_dir(build_url)
+  os.symlink(build_dir, link_path)
+
+  with locked_index() as index:
+    entry = get_build_entry(index, build_url)
+    entry['testcases'][str(testcase_id)] = link_path
+    touch(entry, build_dir)
+  logger.debug('Linked testcase %s to the build %s', testcase_id, build_url)
+
+
+def update_build_size(build_url):
+  """Recomputes the size of a cached build after files were added to it."""
+  with locked_index() as index:
+    entry = index['builds'].get(get_build_key(build_url))
+    if entry:
+      entry['size'] = get_dir_size(entry['path'])
+
+
+def record_testcase(testcase_id, testcase_dir):
+  """Records the use of a downloaded testcase in the index."""
+  with locked_index() as index:
+    entry = index['testcases'].setdefault(str(testcase_id), {})
+    entry['size'] = get_dir_size(testcase_dir)
+    touch(entry, testcase_dir)
+
+
+def record_out_dir(out_dir, source_dir, testcase_id):
+  """Records the use of an out dir of source_dir to build a testcase."""
+  with locked_index() as index:
+    entry = index['out_dirs'].setdefault(
+        out_dir, {'source_dir': source_dir, 'testcases': []})
+    if str(testcase_id) not in entry['testcases']:
+      entry['testcases'].append(str(testcase_id))
+    entry['path'] = out_dir
+    entry['last_access'] = time.time()
+    add_pid(entry)
+
+
+def evict_out_dirs(source_dir, max_count=None):
+  """Deletes the least recently used out dirs of source_dir until at most
+    max_count are left. Returns the paths of the evicted out dirs."""
+
+  if max_count is None:
+    max_count = get_max_out_dirs()
+
+  evicted = []
+  with locked_index() as index:
+    entries = sorted(
+        [e for e in index['out_dirs'].itervalues()
+         if e['source_dir'] == source_dir],
+        key=lambda e: e['last_access'], reverse=True)
+    for entry in entries[max_count:]:
+      if is_in_use(entry):
+        continue
+      common.delete_if_exists(entry['path'])
+      logger.info('Evicted the out dir %s.', entry['path'])
+      evicted.append(entry['path'])
+      del index['out_dirs'][entry['path']]
+
+  return evicted
+
+
+def release():
+  """Marks all entries as no longer used by the current process."""
+  if not os.path.isfile(INDEX_FILE):
+    return
+
+  with locked_index() as index:
+    for section in index.itervalues():
+      for entry in section.itervalues():
+        if os.getpid() in entry.get('pids', []):
+          entry['pids'].remove(os.getpid())
+
+
+def delete_entry(entry):
+  """Deletes the files of an entry, including the links to a build."""
+  common.delete_if_exists(entry['path'])
+  for link_path in entry.get('testcases', {}).itervalues():
+    if os.path.lexists(link_path):
+      os.remove(link_path)
+
+
+def evict(max_size=None):
+  """Evicts the least recently used entries until the cache fits in max_size
+    bytes. Returns the paths of the evicted entries."""
+
+  if max_size is None:
+    max_size = get_max_size()
+
+  evicted = []
+  with locked_index() as index:
+    entries = []
+    for section_name, section in index.iteritems():
+      # Out dirs are evicted by evict_out_dirs.
+      if section_name == 'out_dirs':
+        continue
+      entries.extend((section_name, key, entry)
+                     for key, entry in section.iteritems())
+    total_size = sum(entry.get('size', 0) for _, _, entry in entries)
+
+    for section_name, key, entry in sorted(
+        entries, key=lambda e: e[2].get('last_access', 0)):
+      if total_size <= max_size:
+        break
+      if is_in_use(entry):
+        continue
+      if section_name == 'builds':
+        # A process downloading or extending the build holds its lock before
+        # it records itself as a user.
+        with common.file_lock(get_build_lock_file(entry['path']),
+                              blocking=False) as locked:
+          if not locked:
+            continue
+          delete_entry(entry)
+      else:
+        delete_entry(entry)
+
+      logger.info('Evicted %s from the cache.', entry['path'])
+      total_size -= entry.get('size', 0)
+      evicted.append(entry['path'])
+      del index[section_name][key]
+
+  return evicted
+
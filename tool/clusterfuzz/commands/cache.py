@@ -0,0 +1,143 @@
+"""Module for the 'cache' command.
+
+Lists, prunes and prewarms the local cache of builds and testcases."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+import logging
+import traceback
+from multiprocessing.pool import ThreadPool
+
+from clusterfuzz import cache
+from clusterfuzz import testcase
+from clusterfuzz.commands import reproduce
+
+logger = logging.getLogger('clusterfuzz')
+
+
+def format_size(size):
+  """Formats a number of bytes for humans, e.g. 1.5G."""
+  for unit in ['', 'K', 'M', 'G']:
+    if size < 1024:
+      return '%.1f%s' % (size, unit)
+    size /= 1024.0
+  return '%.1fT' % size
+
+
+def format_age(timestamp):
+  """Formats the time elapsed since timestamp for humans, e.g. 3.5h."""
+  return '%.1fh' % ((time.time() - timestamp) / 3600)
+
+
+def list_entries():
+  """Prints the cached builds and testcases, and the out dirs of local
+    builds."""
+  index = cache.get_index()
+  total_size = 0
+
+  logger.info('Builds:')
+  for entry in sorted(index['builds'].itervalues(),
+                      key=lambda e: e['last_access'], reverse=True):
+    total_size += entry['size']
+    logger.info(
+        '  %s  %s  %s%s\n    testcases: %s', format_size(entry['size']),
+        format_age(entry['last_access']), entry['build_url'],
+        ' (in use)' if cache.is_in_use(entry) else '',
+        ', '.join(sorted(entry['testcases'])))
+
+  logger.info('Testcases:')
+  for testcase_id, entry in sorted(index['testcases'].iteritems(),
+                                   key=lambda e: e[1]['last_access'],
+                                   reverse=True):
+    total_size += entry['size']
+    logger.info(
+        '  %s  %s  %s%s', format_size(entry['size']),
+        format_age(entry['last_access']), testcase_id,
+        ' (in use)' if cache.is_in_use(entry) else '')
+
+  logger.info('Total: %s (budget: %s)', format_size(total_size),
+              format_size(cache.get_max_size()))
+
+  logger.info('Out dirs (%d kept per checkout):', cache.get_max_out_dirs())
+  for entry in sorted(index['out_dirs'].itervalues(),
+                      key=lambda e: e['last_access'], reverse=True):
+    logger.info(
+        '  %s  %s%s\n    testcases: %s', format_age(entry['last_access']),
+        entry['path'], ' (in use)' if cache.is_in_use(entry) else '',
+        ', '.join(sorted(entry['testcases'])))
+
+
+def prune(size):
+  """Evicts the least recently used entries until the cache fits in size."""
+  max_size = cache.get_max_size() if size is None else cache.parse_size(size)
+  evicted = cache.evict(max_size)
+  logger.info('Evicted %d entries.', len(evicted))
+
+
+def prewarm_testcase(testcase_id, response=None):
+  """Downloads the details, the testcase and the build of a testcase.
+
+  Returns True on success. Failures are logged, not raised, so that one
+  testcase doesn't stop the others."""
+  try:
+    response = response or reproduce.get_testcase_info(testcase_id)
+    current_testcase = testcase.Testcase(response)
+    current_testcase.get_testcase_path()
+
+    definition = reproduce.get_binary_definition(
+        current_testcase.job_type, 'download')
+    reproduce.get_downloaded_binary(
+        current_testcase, definition).download_build_data()
+    logger.info('Prewarmed testcase %s.', testcase_id)
+    return True
+  except (SystemExit, Exception):  # pylint: disable=broad-except
+    logger.info('Failed to prewarm testcase %s:\n%s', testcase_id,
+                traceback.format_exc())
+    return False
+
+
+def prewarm(testcase_ids, j):
+  """Downloads the details, testcases and builds of testcase_ids in
+    parallel without building or running anything."""
+  # The first details are fetched on their own so that the user is asked to
+  # authenticate at most once. If they can't be, prewarm_testcase tries again
+  # and reports the error.
+  try:
+    first_response = reproduce.get_testcase_info(testcase_ids[0])
+  except (SystemExit, Exception):  # pylint: disable=broad-except
+    first_response = None
+
+  pool = ThreadPool(j)
+  try:
+    results = pool.map(
+        lambda args: prewarm_testcase(*args),
+        [(testcase_ids[0], first_response)] +
+        [(testcase_id, None) for testcase_id in testcase_ids[1:]])
+  finally:
+    pool.close()
+    pool.join()
+
+  logger.info('Prewarmed %d of %d testcases.', results.count(True),
+              len(testcase_ids))
+
+
+def execute(action, size, testcase_ids, j):
+  """Execute the cache command."""
+  if action == 'list':
+    list_entries()
+  elif action == 'prune':
+    prune(size)
+  elif action == 'prewarm':
+    prewarm(testcase_ids, j)
@@ -17,14 +17,16 @@ Locally reproduces a testcase given a Clusterfuzz ID."""
 
 import os
 import json
+import time
+import collections
 import urllib
 import webbrowser
 import logging
+from multiprocessing.pool import ThreadPool
 import yaml
 
-import requests
-
 from clusterfuzz import common
+from clusterfuzz import http_client
 from clusterfuzz import stackdriver_logging
 from clusterfuzz import testcase
 from clusterfuzz import binary_providers
@@ -34,6 +36,13 @@ from clusterfuzz import reproducers
 CLUSTERFUZZ_AUTH_HEADER = 'x-clusterfuzz-authorization'
 CLUSTERFUZZ_TESTCASE_INFO_URL = (
     'https://%s/v2/testcase-detail/refresh' % common.DOMAIN_NAME)
+TESTCASE_INFO_CACHE_DIR = os.path.join(
+    common.CLUSTERFUZZ_CACHE_DIR, 'testcase_info')
+DEFAULT_TESTCASE_INFO_TTL = 24 * 60 * 60
+# The supported jobs by build type, parsed by get_supported_jobs.
+SUPPORTED_JOBS = {}
+PREFETCH_THREADS = 3
+PREFETCH_POLL_INTERVAL = 0.5
 GOMA_DIR = os.path.expanduser(os.path.join('~', 'goma'))
 GOOGLE_OAUTH_URL = 'https://accounts.google.com/o/oauth2/v2/auth?%s' % (
     urllib.urlencode({
@@ -89,11 +98,8 @@ def send_request(url, data):
   header = common.get_stored_auth_header() or get_verification_header()
   response = None
   for _ in range(2):
-    response = requests.post(
-        url=url, headers={
-            'Authorization': header,
-            'User-Agent': 'clusterfuzz-tools'},
-        allow_redirects=True, data=data)
+    http_client.set_auth_header(header)
+    response = http_client.post(url, allow_redirects=True, data=data)
 
     if response.status_code == 401:  # The access token expired.
       header = get_verification_header()
@@ -103,18 +109,42 @@ def send_request(url, data):
   if response.status_code != 200:
     raise common.ClusterfuzzAuthError(response.text)
 
-  common.store_auth_header(response.headers[CLUSTERFUZZ_AUTH_HEADER])
+  header = response.headers[CLUSTERFUZZ_AUTH_HEADER]
+  common.store_auth_header(header)
+  http_client.set_auth_header(header)
   return response
 
-def get_testcase_info(testcase_id):
+def get_testcase_info_ttl():
+  """Returns for how many seconds the cached testcase information is used,
+    configured by CF_TESTCASE_INFO_TTL."""
+  return int(os.environ.get('CF_TESTCASE_INFO_TTL', DEFAULT_TESTCASE_INFO_TTL))
+
+
+def get_testcase_info(testcase_id, refresh=False):
   """Pulls testcase information from Clusterfuzz.
 
   Returns a dictionary with the JSON response if the
-  authentication is successful.
+  authentication is successful. Responses are cached on disk and reused
+  until they are older than the TTL, unless refresh is set.
   """
 
+  cache_path = os.path.join(TESTCASE_INFO_CACHE_DIR, '%s.json' % testcase_id)
+  cached = common.read_json_file(cache_path)
+  # A file of another shape, e.g. written by another version, is a miss.
+  if (isinstance(cached, dict) and 'time' in cached and 'response' in cached
+      and not refresh):
+    age = time.time() - cached['time']
+    if age < get_testcase_info_ttl():
+      logger.info('Using the testcase information cached %d minutes ago, '
+                  'use --refresh to download it again.', age / 60)
+      return cached['response']
+
   data = json.dumps({'testcaseId': testcase_id})
-  return json.loads(send_request(CLUSTERFUZZ_TESTCASE_INFO_URL, data).text)
+  response = json.loads(
+      send_request(CLUSTERFUZZ_TESTCASE_INFO_URL, data).text)
+  common.write_json_file(
+      cache_path, {'time': time.time(), 'response': response})
+  return response
 
 def ensure_goma():
   """Ensures GOMA is installed and ready for use, and starts it."""
@@ -167,7 +197,10 @@ def build_binary_definition(job_definition, presets):
 
 
 def get_supported_jobs():
-  """Reads in supported jobs from supported_jobs.yml."""
+  """Reads in supported jobs from supported_jobs.yml, once per process."""
+
+  if SUPPORTED_JOBS:
+    return SUPPORTED_JOBS
 
   to_return = {
       'standalone': {},
@@ -186,7 +219,8 @@ def get_supported_jobs():
         raise common.BadJobTypeDefinitionError(
             '%s %s' % (build_type, job_type))
 
-  return to_return
+  SUPPORTED_JOBS.update(to_return)
+  return SUPPORTED_JOBS
 
 
 def get_binary_definition(job_type, build_param):
@@ -200,6 +234,73 @@ def get_binary_definition(job_type, build_param):
   raise common.JobTypeNotSupportedError(job_type)
 
 
+def get_binary_name(current_testcase, definition):
+  """Returns the name of the binary to run from a downloaded build."""
+  if definition.binary_name:
+    return definition.binary_name
+  return common.get_binary_name(current_testcase.stacktrace_lines)
+
+
+def get_downloaded_binary(current_testcase, definition):
+  """Returns the provider of the downloaded build of a testcase. Only the
+    files needed by libFuzzer targets are extracted from their builds."""
+  return binary_providers.DownloadedBinary(
+      current_testcase.id, current_testcase.build_url,
+      get_binary_name(current_testcase, definition),
+      selective_extraction=(
+          definition.reproducer == reproducers.LibfuzzerJobReproducer),
+      reproduction_args=current_testcase.reproduction_args)
+
+
+def create_binary_provider(current_testcase, definition, build, current, j,
+                           edit_mode):
+  """Returns the provider of the binary of a testcase. Builders resolve the
+    sha to build when they are created, and the build is downloaded if it is
+    run or if its GN args are needed."""
+  if build == 'download':
+    binary_provider = get_downloaded_binary(current_testcase, definition)
+  else:
+    # The Goma directory is only needed by the build, it is set once Goma is
+    # started.
+    binary_provider = definition.builder( # pylint: disable=redefined-variable-type
+        current_testcase, definition, current, None, j, edit_mode)
+  if build == 'download' or not binary_provider.gn_args:
+    binary_provider.download_build_data()
+  return binary_provider
+
+
+def wait_for(result):
+  """Returns the value of an asynchronous result, or raises its error. It is
+    polled so that Ctrl-C still interrupts the wait."""
+  while not result.ready():
+    result.wait(PREFETCH_POLL_INTERVAL)
+  return result.get()
+
+
+def prefetch(current_testcase, definition, build, current, disable_goma, j,
+             edit_mode):
+  """Downloads the testcase and the build, resolves the sha to build and
+    starts Goma concurrently. Returns the binary provider once they are done."""
+  pool = ThreadPool(PREFETCH_THREADS)
+  try:
+    testcase_result = pool.apply_async(current_testcase.get_testcase_path)
+    provider_result = pool.apply_async(
+        create_binary_provider,
+        (current_testcase, definition, build, current, j, edit_mode))
+    goma_result = None
+    if build != 'download' and not disable_goma:
+      goma_result = pool.apply_async(ensure_goma)
+
+    binary_provider = wait_for(provider_result)
+    if goma_result:
+      binary_provider.goma_dir = wait_for(goma_result)
+    wait_for(testcase_result)
+  finally:
+    # When a step fails, the others are left to finish in the background.
+    pool.close()
+  return binary_provider
+
+
 def maybe_warn_unreproducible(current_testcase):
   """Print warning if the testcase is unreproducible."""
   if not current_testcase.reproducible:
@@ -212,10 +313,170 @@ def maybe_warn_unreproducible(current_testcase):
     # print.
     return True
 
+def get_batch_testcase_ids(batch):
+  """Returns the testcase IDs of --batch, where each item is either an ID or
+    a file listing one ID per line."""
+  testcase_ids = []
+  for item in batch:
+    if not os.path.isfile(item):
+      testcase_ids.append(item)
+      continue
+    with open(item) as f:
+      for line in f:
+        line = line.split('#')[0].strip()
+        if line:
+          testcase_ids.append(line)
+  return testcase_ids
+
+
+def fetch_batch_testcases(testcase_ids, refresh, parallel):
+  """Fetches the details of testcase_ids concurrently. Returns a dict of the
+    Testcase, or of the error message, by testcase ID."""
+
+  def fetch(testcase_id):
+    try:
+      return testcase.Testcase(
+          get_testcase_info(testcase_id, refresh=refresh))
+    except (SystemExit, Exception) as e:  # pylint: disable=broad-except
+      return 'Failed to fetch the testcase details: %r' % e
+
+  # The first testcase is fetched on its own so that the user is asked to
+  # authenticate at most once.
+  results = {testcase_ids[0]: fetch(testcase_ids[0])}
+  pool = ThreadPool(parallel)
+  try:
+    results.update(zip(testcase_ids[1:], pool.map(fetch, testcase_ids[1:])))
+  finally:
+    pool.close()
+    pool.join()
+  return results
+
+
+def get_batch_group_key(current_testcase, definition, build):
+  """Returns the key of the testcases sharing a build: the build URL for
+    downloaded builds, the revision and gn args otherwise."""
+  if build == 'download':
+    return (current_testcase.build_url,)
+  return (definition.builder, definition.source_var,
+          current_testcase.revision, current_testcase.gn_args,
+          get_binary_name(current_testcase, definition))
+
+
+def group_batch_testcases(testcases, build, results):
+  """Groups the (testcase_id, Testcase) pairs by get_batch_group_key, in the
+    order of their first testcase. Testcases of unsupported jobs get an
+    error in results."""
+  groups = collections.OrderedDict()
+  for testcase_id, current_testcase in testcases:
+    try:
+      definition = get_binary_definition(current_testcase.job_type, build)
+    except common.JobTypeNotSupportedError as e:
+      results[testcase_id]['error'] = str(e)
+      continue
+    key = get_batch_group_key(current_testcase, definition, build)
+    groups.setdefault(key, []).append(
+        (testcase_id, current_testcase, definition))
+  return groups.values()
+
+
+def get_batch_binary_providers(group, build, current, goma_dir, j):
+  """Returns the binary providers of the testcases of a group, after
+    downloading or building the group's build once."""
+  if build == 'download':
+    providers = [get_downloaded_binary(current_testcase, definition)
+                 for _, current_testcase, definition in group]
+  else:
+    _, current_testcase, definition = group[0]
+    providers = [definition.builder(
+        current_testcase, definition, current, goma_dir, j, False)] * len(group)
+  # Later downloads of the same build are served by the build cache.
+  providers[0].get_build_directory()
+  return providers
+
+
+def run_batch_testcase(current_testcase, definition, binary_provider,
+                       iterations, disable_xvfb, target_args, result):
+  """Reproduces a testcase of a batch, recording the outcome in result."""
+  start_time = time.time()
+  try:
+    reproducer = definition.reproducer(
+        binary_provider, current_testcase, definition.sanitizer,
+        disable_xvfb, target_args, False)
+    result['reproduced'] = reproducer.reproduce(iterations, isolated=True)
+  except SystemExit:
+    result['reproduced'] = False
+  except Exception as e:  # pylint: disable=broad-except
+    result['error'] = '%s: %s' % (e.__class__.__name__, e)
+  result['duration'] = time.time() - start_time
+
+
+def execute_batch(batch, batch_output, current, build, disable_goma, j,
+                  iterations, disable_xvfb, target_args, refresh, parallel):
+  """Reproduces the testcases of batch, building or downloading each build
+    once, and writes the outcome of every testcase to batch_output."""
+
+  testcase_ids = get_batch_testcase_ids(batch)
+  if not testcase_ids:
+    raise common.ExpectedException('The batch has no testcases.')
+  logger.info('Downloading the information of %d testcases...',
+              len(testcase_ids))
+  fetched = fetch_batch_testcases(testcase_ids, refresh, parallel)
+
+  results = collections.OrderedDict()
+  testcases = []
+  for testcase_id in testcase_ids:
+    results[testcase_id] = {'testcaseId': testcase_id, 'reproduced': False,
+                            'error': None, 'duration': None}
+    if isinstance(fetched[testcase_id], basestring):
+      results[testcase_id]['error'] = fetched[testcase_id]
+    else:
+      testcases.append((testcase_id, fetched[testcase_id]))
+
+  groups = group_batch_testcases(testcases, build, results)
+  goma_dir = None
+  if build != 'download' and not disable_goma and groups:
+    goma_dir = ensure_goma()
+
+  pool = ThreadPool(parallel)
+  try:
+    for number, group in enumerate(groups, 1):
+      logger.info('Preparing build %d of %d for %d testcases...', number,
+                  len(groups), len(group))
+      try:
+        providers = get_batch_binary_providers(
+            group, build, current, goma_dir, j)
+      except (SystemExit, Exception) as e:  # pylint: disable=broad-except
+        for testcase_id, _, _ in group:
+          results[testcase_id]['error'] = 'Failed to prepare the build: %r' % e
+        continue
+
+      pool.map(
+          lambda args: run_batch_testcase(*args),
+          [(current_testcase, definition, provider, iterations, disable_xvfb,
+            target_args, results[testcase_id])
+           for (testcase_id, current_testcase, definition), provider
+           in zip(group, providers)])
+  finally:
+    pool.close()
+    pool.join()
+
+  with open(batch_output, 'w') as f:
+    json.dump(results.values(), f, indent=2)
+  logger.info('Reproduced %d of %d testcases. The results are in %s.',
+              len([r for r in results.values() if r['reproduced']]),
+              len(results), batch_output)
+
+
 @stackdriver_logging.log
 def execute(testcase_id, current, build, disable_goma, j, iterations,
-            disable_xvfb, target_args, edit_mode):
+            disable_xvfb, target_args, edit_mode, refresh, parallel,
+            stats, batch, batch_output):
   """Execute the reproduce command."""
+  if batch:
+    execute_batch(batch, batch_output, current, build, disable_goma, j,
+                  iterations, disable_xvfb, target_args, refresh, parallel)
+    return
+
   logger.info('----- START -----')
   logger.info('Reproducing testcase %s', testcase_id)
   logger.debug(
@@ -223,7 +484,7 @@ def execute(testcase_id, current, build, disable_goma, j, iterations,
       testcase_id, current, build, disable_goma)
   logger.info('Downloading testcase information...')
 
-  response = get_testcase_info(testcase_id)
+  response = get_testcase_info(testcase_id, refresh=refresh)
   current_testcase = testcase.Testcase(response)
 
   if 'gestures' in response['testcase']:
@@ -234,22 +495,15 @@ def execute(testcase_id, current, build, disable_goma, j, iterations,
 
   maybe_warn_unreproducible(current_testcase)
 
-  if build == 'download':
-    if definition.binary_name:
-      binary_name = definition.binary_name
-    else:
-      binary_name = common.get_binary_name(current_testcase.stacktrace_lines)
-    binary_provider = binary_providers.DownloadedBinary(
-        current_testcase.id, current_testcase.build_url, binary_name)
-  else:
-    goma_dir = None if disable_goma else ensure_goma()
-    binary_provider = definition.builder( # pylint: disable=redefined-variable-type
-        current_testcase, definition, current, goma_dir, j, edit_mode)
-
+  binary_provider = prefetch(current_testcase, definition, build, current,
+                             disable_goma, j, edit_mode)
   reproducer = definition.reproducer(
       binary_provider, current_testcase, definition.sanitizer, disable_xvfb,
       target_args, edit_mode)
   try:
-    reproducer.reproduce(iterations)
+    if stats:
+      reproducer.reproduce_stats(stats, parallel)
+    else:
+      reproducer.reproduce(iterations, parallel)
   finally:
     maybe_warn_unreproducible(current_testcase)
@@ -0,0 +1,43 @@
+"""Module for the 'serve' command.
+
+Runs the daemon that other clusterfuzz commands are forwarded to."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+
+from clusterfuzz import common
+from clusterfuzz import daemon
+from clusterfuzz import main
+from clusterfuzz import reproducers
+from clusterfuzz.commands import cache  # pylint: disable=unused-import
+from clusterfuzz.commands import reproduce
+
+logger = logging.getLogger('clusterfuzz')
+
+
+def warm_up():
+  """Loads what commands need before the first one arrives: the job
+    definitions and an idle virtual display."""
+  reproduce.get_supported_jobs()
+  try:
+    reproducers.DISPLAY_POOL.release(reproducers.DISPLAY_POOL.acquire())
+  except (EnvironmentError, common.ExpectedException) as e:
+    logger.info('No virtual display is kept ready: %s', e)
+
+
+def execute():
+  """Runs the daemon until interrupted."""
+  warm_up()
+  daemon.serve(main.run)
@@ -22,8 +22,14 @@ import subprocess
 import logging
 import time
 import re
+import errno
+import select
 import signal
 import shutil
+import json
+import fcntl
+import thread
+import contextlib
 
 from backports.shutil_get_terminal_size import get_terminal_size
 from clusterfuzz import local_logging
@@ -36,6 +42,11 @@ AUTH_HEADER_FILE = os.path.join(CLUSTERFUZZ_CACHE_DIR, 'auth_header')
 DOMAIN_NAME = 'clusterfuzz.com'
 DEBUG_PRINT = os.environ.get('CF_DEBUG')
 TERMINAL_WIDTH = get_terminal_size().columns
+# The seconds a timed out process gets to exit after SIGTERM.
+KILL_GRACE_PERIOD = 3
+# The seconds a process keeps running after its output is complete.
+COMPLETE_GRACE_PERIOD = 1
+READ_SIZE = 4096
 logger = logging.getLogger('clusterfuzz')
 
 
@@ -184,23 +195,56 @@ def get_stored_auth_header():
     return f.read()
 
 
-def wait_timeout(proc, timeout):
-  """If proc runs longer than <timeout> seconds, kill it."""
-  if not timeout:
-    return
-  for _ in range(0, timeout * 2):
-    time.sleep(0.5)
-    if proc.poll():
-      break
-  else:
+def kill_process_group(proc, sig):
+  """Sends sig to the process group of proc, unless it has exited."""
+  try:
+    os.killpg(os.getpgid(proc.pid), sig)
+  except OSError as e:
+    if e.errno != errno.ESRCH:
+      raise
+
+
+def read_output(proc, timeout=None, is_complete=None):
+  """Yields the output of proc as soon as it's written, until every process in
+    its group has closed stdout.
+
+  If proc runs longer than <timeout> seconds, its process group gets SIGTERM,
+  and SIGKILL if it's still writing after KILL_GRACE_PERIOD seconds more.
+  is_complete is called with every chunk, and once it returns true the
+  process group is stopped the same way after COMPLETE_GRACE_PERIOD
+  seconds."""
+
+  fd = proc.stdout.fileno()
+  deadline = time.time() + timeout if timeout else None
+  terminated = False
+  while True:
+    remaining = None if deadline is None else max(0, deadline - time.time())
     try:
-      os.killpg(os.getpgid(proc.pid), signal.SIGTERM)
-
-      # Wait for any shutdown stacktrace to be dumped.
-      time.sleep(3)
-    except OSError as e:
-      if e.errno != 3:  # No such process.
-        raise
+      readable, _, _ = select.select([fd], [], [], remaining)
+    except select.error as e:
+      if e.args[0] == errno.EINTR:
+        continue
+      raise
+
+    if readable:
+      chunk = os.read(fd, READ_SIZE)
+      if not chunk:
+        return
+      if is_complete and not terminated and is_complete(chunk):
+        logger.debug('The output is complete, stopping the process.')
+        is_complete = None
+        complete_deadline = time.time() + COMPLETE_GRACE_PERIOD
+        if deadline is None or complete_deadline < deadline:
+          deadline = complete_deadline
+      yield chunk
+    elif not terminated:
+      # Keep reading, so that any shutdown stacktrace is dumped.
+      kill_process_group(proc, signal.SIGTERM)
+      deadline = time.time() + KILL_GRACE_PERIOD
+      terminated = True
+    else:
+      kill_process_group(proc, signal.SIGKILL)
+      return
 
 
 def print_progress_bar(iteration, total, prefix='', suffix='', decimals=1,
@@ -292,8 +336,9 @@ def start_execute(binary, args, cwd, env=None, print_command=True):
 
 
 def wait_execute(proc, exit_on_error, capture_output=True, print_output=True,
-                 timeout=None, ninja_command=False):
-  """Looks after a command as it runs, and prints/returns its output after."""
+                 timeout=None, ninja_command=False, is_complete=None):
+  """Looks after a command as it runs, and prints/returns its output after.
+    See read_output for timeout and is_complete."""
 
   def _print(s):
     if print_output:
@@ -302,8 +347,7 @@ def wait_execute(proc, exit_on_error, capture_output=True, print_output=True,
   _print('---------------------------------------')
   output_chunks = []
   current_line = []
-  wait_timeout(proc, timeout)
-  for chunk in iter(lambda: proc.stdout.read(100), b''):
+  for chunk in read_output(proc, timeout, is_complete):
     if print_output:
       local_logging.send_output(chunk)
       if ninja_command and not DEBUG_PRINT:
@@ -402,6 +446,55 @@ def delete_if_exists(path):
     shutil.rmtree(path)
 
 
+@contextlib.contextmanager
+def file_lock(path, blocking=True):
+  """Holds an exclusive lock on <path> for the duration of the block.
+
+  The lock is advisory and shared between all clusterfuzz processes. Unless
+  blocking, the block gets False instead of waiting if the lock is held."""
+  if not os.path.exists(os.path.dirname(path)):
+    os.makedirs(os.path.dirname(path))
+
+  with open(path, 'a') as f:
+    try:
+      fcntl.flock(f.fileno(),
+                  fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except IOError as e:
+      if blocking or e.errno not in [errno.EAGAIN, errno.EACCES]:
+        raise
+      yield False
+      return
+
+    try:
+      yield True
+    finally:
+      fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def read_json_file(path, default=None):
+  """Returns the parsed content of a JSON file, or default if it's unusable."""
+  if not os.path.isfile(path):
+    return default
+
+  try:
+    with open(path, 'r') as f:
+      return json.load(f)
+  except ValueError:
+    logger.debug('Ignoring the malformed JSON file: %s', path)
+    return default
+
+
+def write_json_file(path, content):
+  """Atomically replaces the content of a JSON file."""
+  if not os.path.exists(os.path.dirname(path)):
+    os.makedirs(os.path.dirname(path))
+
+  tmp_path = '%s.%d-%d.tmp' % (path, os.getpid(), thread.get_ident())
+  with open(tmp_path, 'w') as f:
+    json.dump(content, f, sort_keys=True)
+  os.rename(tmp_path, path)
+
+
 def get_valid_abs_dir(path):
   """Return true if path is a valid dir."""
   if not path:
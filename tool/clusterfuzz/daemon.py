@@ -0,0 +1,231 @@
+"""Runs commands in a long-lived process, and forwards commands to it.
+
+Commands run by the daemon reuse what earlier commands loaded: imported
+modules, parsed job definitions, HTTP connections and virtual displays."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import sys
+import json
+import socket
+import logging
+import threading
+import traceback
+
+from clusterfuzz import common
+
+SOCKET_PATH = os.path.join(common.CLUSTERFUZZ_DIR, 'daemon.sock')
+# Every frame the daemon sends is a type, the length of the data in 8 hex
+# digits, and the data.
+OUTPUT_FRAME = 'o'
+EXIT_FRAME = 'x'
+FRAME_HEADER_SIZE = 9
+logger = logging.getLogger('clusterfuzz')
+
+
+class FrameWriter(object):
+  """A file-like object sending what's written as output frames."""
+
+  def __init__(self, connection):
+    self.connection = connection
+    self.lock = threading.Lock()
+
+  def send(self, frame_type, data):
+    """Sends a frame."""
+    with self.lock:
+      self.connection.sendall('%s%08x%s' % (frame_type, len(data), data))
+
+  def write(self, data):
+    if isinstance(data, unicode):
+      data = data.encode('utf-8')
+    if data:
+      self.send(OUTPUT_FRAME, data)
+
+  def flush(self):
+    pass
+
+  def isatty(self):
+    return False
+
+
+def read_exactly(connection, size):
+  """Reads size bytes, or returns None if the connection is closed first."""
+  chunks = []
+  while size:
+    chunk = connection.recv(size)
+    if not chunk:
+      return None
+    chunks.append(chunk)
+    size -= len(chunk)
+  return ''.join(chunks)
+
+
+def read_frame(connection):
+  """Returns the (type, data) of the next frame, or (None, None) if the
+    connection is closed."""
+  header = read_exactly(connection, FRAME_HEADER_SIZE)
+  if not header:
+    return None, None
+  data = read_exactly(connection, int(header[1:], 16))
+  if data is None:
+    return None, None
+  return header[0], data
+
+
+def should_forward(argv):
+  """Returns true if the command should be forwarded to a running daemon."""
+  return bool(argv) and argv[0] != 'serve' and not os.environ.get(
+      'CF_NO_DAEMON')
+
+
+def connect():
+  """Returns a connection to the daemon, or None if it isn't running."""
+  connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  try:
+    connection.connect(SOCKET_PATH)
+    return connection
+  except socket.error:
+    connection.close()
+    return None
+
+
+def relay_stdin(connection):
+  """Sends the standard input to the daemon, e.g. to answer prompts."""
+  try:
+    while True:
+      data = os.read(sys.stdin.fileno(), common.READ_SIZE)
+      if not data:
+        connection.shutdown(socket.SHUT_WR)
+        return
+      connection.sendall(data)
+  except (OSError, socket.error):
+    return
+
+
+def forward(connection, argv):
+  """Runs the command in the daemon, printing its output as it comes.
+    Returns the exit code of the command."""
+  try:
+    connection.sendall(json.dumps({
+        'argv': argv, 'cwd': os.getcwd(), 'env': dict(os.environ)}) + '\n')
+
+    relay = threading.Thread(target=relay_stdin, args=(connection,))
+    relay.daemon = True
+    relay.start()
+
+    while True:
+      frame_type, data = read_frame(connection)
+      if frame_type == OUTPUT_FRAME:
+        sys.stdout.write(data)
+        sys.stdout.flush()
+      elif frame_type == EXIT_FRAME:
+        return int(data)
+      else:
+        break
+  except socket.error:
+    pass
+  finally:
+    connection.close()
+
+  sys.stderr.write('The daemon closed the connection.\n')
+  return 1
+
+
+def get_exit_code(exit_error):
+  """Returns the exit code of a SystemExit."""
+  if exit_error.code is None:
+    return 0
+  if isinstance(exit_error.code, int):
+    return exit_error.code
+  return 1
+
+
+def get_console_handlers():
+  """Returns the handlers logging to the console."""
+  return [handler for handler in logger.handlers
+          if isinstance(handler, logging.StreamHandler) and
+          not isinstance(handler, logging.FileHandler)]
+
+
+def handle_connection(connection, run):
+  """Runs the command of a client with its working directory, environment,
+    input and output."""
+  reader = connection.makefile('rb', 0)
+  request = json.loads(reader.readline())
+  writer = FrameWriter(connection)
+
+  saved_stdout, saved_stdin = sys.stdout, sys.stdin
+  saved_environ, saved_cwd = dict(os.environ), os.getcwd()
+  handlers = get_console_handlers()
+  saved_streams = [handler.stream for handler in handlers]
+
+  sys.stdout, sys.stdin = writer, reader
+  for handler in handlers:
+    handler.stream = writer
+  os.environ.clear()
+  os.environ.update(request['env'])
+  try:
+    os.chdir(request['cwd'])
+    run(request['argv'])
+    exit_code = 0
+  except SystemExit as e:
+    exit_code = get_exit_code(e)
+  except Exception:  # pylint: disable=broad-except
+    writer.write(traceback.format_exc())
+    exit_code = 1
+  finally:
+    sys.stdout, sys.stdin = saved_stdout, saved_stdin
+    for handler, stream in zip(handlers, saved_streams):
+      handler.stream = stream
+    os.environ.clear()
+    os.environ.update(saved_environ)
+    os.chdir(saved_cwd)
+
+  writer.send(EXIT_FRAME, str(exit_code))
+
+
+def remove_socket():
+  """Removes the socket left by an earlier daemon."""
+  if os.path.exists(SOCKET_PATH):
+    os.remove(SOCKET_PATH)
+
+
+def serve(run):
+  """Runs the commands sent to SOCKET_PATH one at a time, until interrupted."""
+  existing = connect()
+  if existing:
+    existing.close()
+    raise common.ExpectedException(
+        'The daemon is already running at %s.' % SOCKET_PATH)
+
+  remove_socket()
+  server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  server.bind(SOCKET_PATH)
+  os.chmod(SOCKET_PATH, 0600)
+  server.listen(5)
+  logger.info('Listening on %s.', SOCKET_PATH)
+
+  try:
+    while True:
+      connection, _ = server.accept()
+      try:
+        handle_connection(connection, run)
+      except (socket.error, IOError, ValueError):
+        logger.debug('The client went away:\n%s', traceback.format_exc())
+      finally:
+        connection.close()
+  finally:
+    server.close()
+    remove_socket()
@@ -0,0 +1,260 @@
+"""Module for resumable, parallel downloads over http(s).
+
+A file is fetched with several concurrent range requests into a partial file.
+A journal next to it records the ranges already written, so that an
+interrupted download resumes where it stopped instead of starting over."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import re
+import base64
+import shutil
+import hashlib
+import logging
+import threading
+import urlparse
+from multiprocessing.pool import ThreadPool
+import requests
+
+from clusterfuzz import common
+from clusterfuzz import http_client
+
+DOWNLOADS_DIR = os.path.join(common.CLUSTERFUZZ_CACHE_DIR, 'downloads')
+DEFAULT_CONNECTIONS = 8
+RANGE_SIZE = 8 * 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+logger = logging.getLogger('clusterfuzz')
+
+
+class DownloadError(common.ExpectedException):
+  """An exception raised when a file can't be downloaded."""
+
+  def __init__(self, url, reason):
+    message = ('Failed to download %s: %s\nRun the command again to resume '
+               'the download.' % (url, reason))
+    super(DownloadError, self).__init__(message)
+
+
+def get_filename(url, response):
+  """Returns the name of the downloaded file, from the Content-Disposition
+    header like `wget --content-disposition` or else from the URL."""
+  match = re.search(r'filename="?([^";]+)"?',
+                    response.headers.get('Content-Disposition', ''))
+  if match:
+    filename = match.group(1)
+  else:
+    filename = urlparse.urlparse(url).path
+  return os.path.basename(filename.strip()) or 'download'
+
+
+def get_md5(response):
+  """Returns the hex MD5 of the whole file advertised by the server, or None.
+
+  GCS sends it in x-goog-hash, other servers may send Content-MD5."""
+  match = re.search(r'md5=([^,\s]+)', response.headers.get('x-goog-hash', ''))
+  md5 = match.group(1) if match else response.headers.get('Content-MD5')
+  if not md5:
+    return None
+  return base64.b64decode(md5).encode('hex')
+
+
+def get_file_md5(path):
+  """Returns the hex MD5 of the file at path."""
+  md5 = hashlib.md5()
+  with open(path, 'rb') as f:
+    for data in iter(lambda: f.read(CHUNK_SIZE), ''):
+      md5.update(data)
+  return md5.hexdigest()
+
+
+def request(url, headers, start=None, end=None):
+  """Sends a streamed GET request for url, or only for the bytes from start to
+    end (inclusive) when they are given."""
+  headers = dict(headers)
+  if start is not None:
+    headers['Range'] = 'bytes=%d-%d' % (start, end)
+  try:
+    response = http_client.get(url, headers=headers, stream=True)
+  except requests.RequestException as e:
+    raise DownloadError(url, e)
+  if response.status_code >= 400:
+    response.close()
+    raise DownloadError(url, 'HTTP status %d' % response.status_code)
+  return response
+
+
+def probe(url, headers):
+  """Requests the first byte of url. Returns the response and a dict with the
+    filename, size, ETag and MD5 of the file and whether the server can send
+    ranges of it."""
+  response = request(url, headers, 0, 0)
+  info = {
+      'url': url,
+      'filename': get_filename(url, response),
+      'etag': response.headers.get('ETag'),
+      'last_modified': response.headers.get('Last-Modified'),
+      'md5': get_md5(response),
+      'ranges': False,
+      'size': None}
+
+  match = re.match(r'bytes 0-0/(\d+)$',
+                   response.headers.get('Content-Range', ''))
+  if response.status_code == 206 and match:
+    info['ranges'] = True
+    info['size'] = int(match.group(1))
+  elif 'Content-Length' in response.headers:
+    info['size'] = int(response.headers['Content-Length'])
+  return response, info
+
+
+def write_response(url, response, path, offset=None, expected_size=None):
+  """Writes the body of response into path, or into the existing file at
+    offset when it is given."""
+  written = 0
+  try:
+    with open(path, 'wb' if offset is None else 'r+b') as f:
+      f.seek(offset or 0)
+      for data in response.iter_content(CHUNK_SIZE):
+        f.write(data)
+        written += len(data)
+  except requests.RequestException as e:
+    raise DownloadError(url, e)
+  finally:
+    response.close()
+
+  if expected_size is not None and written != expected_size:
+    raise DownloadError(url, 'received %d of %d bytes at offset %d' % (
+        written, expected_size, offset))
+
+
+def load_journal(journal_path, data_path, info):
+  """Returns the journal of a previous download of the same file, or starts a
+    new one and preallocates the partial file."""
+  journal = common.read_json_file(journal_path)
+  if (journal and os.path.isfile(data_path) and
+      os.path.getsize(data_path) == info['size'] and
+      all(journal.get(key) == info[key] for key in ['url', 'size', 'etag'])):
+    logger.info('Resuming the download of %s (%d of %d ranges done).',
+                info['url'], len(journal['done']),
+                len(range(0, info['size'], journal['range_size'])))
+    return journal
+
+  journal = {'url': info['url'], 'size': info['size'], 'etag': info['etag'],
+             'range_size': RANGE_SIZE, 'done': []}
+  with open(data_path, 'wb') as f:
+    f.truncate(info['size'])
+  common.write_json_file(journal_path, journal)
+  return journal
+
+
+def download_ranges(info, headers, data_path, journal_path, connections):
+  """Fetches the ranges of the file which aren't in the journal yet, on
+    several connections at once."""
+  journal = load_journal(journal_path, data_path, info)
+  size, range_size = info['size'], journal['range_size']
+  starts = [start for start in range(0, size, range_size)
+            if start not in journal['done']]
+
+  headers = dict(headers)
+  if info['etag']:
+    # Fails the ranges instead of mixing two versions of a changed file.
+    headers['If-Range'] = info['etag']
+  lock = threading.Lock()
+
+  def fetch(start):
+    end = min(start + range_size, size) - 1
+    response = request(info['url'], headers, start, end)
+    if response.status_code != 206:
+      response.close()
+      raise DownloadError(info['url'], 'the file changed on the server')
+    write_response(info['url'], response, data_path, start, end - start + 1)
+    with lock:
+      journal['done'].append(start)
+      common.write_json_file(journal_path, journal)
+
+  pool = ThreadPool(min(connections, len(starts)) or 1)
+  try:
+    # One range per task, so that a failed range doesn't skip others.
+    pool.map(fetch, starts, chunksize=1)
+  finally:
+    pool.close()
+    pool.join()
+
+
+def verify(info, path):
+  """Checks the size and, when the server sent it, the MD5 of the download."""
+  size = os.path.getsize(path)
+  if info['size'] is not None and size != info['size']:
+    raise DownloadError(info['url'], 'expected %d bytes but got %d' % (
+        info['size'], size))
+  if info['md5'] and get_file_md5(path) != info['md5']:
+    raise DownloadError(info['url'], 'the MD5 checksum does not match')
+
+
+def is_unchanged(url, validators, headers=None):
+  """Returns true if the server answers a conditional request for url with
+    304 Not Modified, given the etag and last_modified of an earlier
+    download."""
+  conditions = {}
+  if validators.get('etag'):
+    conditions['If-None-Match'] = validators['etag']
+  if validators.get('last_modified'):
+    conditions['If-Modified-Since'] = validators['last_modified']
+  if not conditions:
+    return False
+
+  conditions.update(headers or {})
+  response = request(url, conditions, 0, 0)
+  response.close()
+  return response.status_code == 304
+
+
+def download(url, dest_dir, headers=None, connections=DEFAULT_CONNECTIONS):
+  """Downloads url into dest_dir. Returns a dict with the path of the file
+    and the filename, size, etag, last_modified and md5 sent by the server.
+
+  Servers which don't support range requests are read on one connection,
+  and such downloads can't be resumed."""
+
+  headers = dict(headers or {})
+  # The size and checksum are those of the file, not of a compressed body.
+  headers['Accept-Encoding'] = 'identity'
+  if not os.path.exists(DOWNLOADS_DIR):
+    os.makedirs(DOWNLOADS_DIR)
+  key = hashlib.sha1(url).hexdigest()
+  data_path = os.path.join(DOWNLOADS_DIR, key + '.partial')
+  journal_path = os.path.join(DOWNLOADS_DIR, key + '.journal')
+
+  with common.file_lock(os.path.join(DOWNLOADS_DIR, key + '.lock')):
+    response, info = probe(url, headers)
+    if info['ranges']:
+      response.close()
+      download_ranges(info, headers, data_path, journal_path, connections)
+    else:
+      logger.debug('%s does not support range requests.', url)
+      write_response(url, response, data_path)
+
+    try:
+      verify(info, data_path)
+    except DownloadError:
+      os.remove(data_path)
+      raise
+    finally:
+      if os.path.exists(journal_path):
+        os.remove(journal_path)
+
+    info['path'] = os.path.join(dest_dir, info['filename'])
+    shutil.move(data_path, info['path'])
+  return info
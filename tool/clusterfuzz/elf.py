@@ -0,0 +1,93 @@
+"""Module for reading the shared libraries needed by ELF binaries."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import struct
+
+ELF_MAGIC = '\x7fELF'
+ELF_CLASS_64 = 2
+ELF_DATA_BIG_ENDIAN = 2
+SHT_DYNAMIC = 6
+DT_NULL = 0
+DT_NEEDED = 1
+
+# The formats of the header fields after e_ident, of the section headers and
+# of the dynamic entries, for 32 and 64 bit binaries.
+FORMATS = {
+    False: ('HHIIIIIHHHHHH', 'IIIIIIIIII', 'iI'),
+    True: ('HHIQQQIHHHHHH', 'IIQQQQIIQQ', 'qQ')}
+
+
+def read_struct(f, fmt, offset):
+  """Reads and unpacks the struct fmt at offset."""
+  f.seek(offset)
+  size = struct.calcsize(fmt)
+  data = f.read(size)
+  if len(data) != size:
+    return None
+  return struct.unpack(fmt, data)
+
+
+def get_needed_libraries(path):
+  """Returns the names in the DT_NEEDED entries of the ELF binary at path, or
+    an empty list if it isn't an ELF binary or has no section headers."""
+
+  with open(path, 'rb') as f:
+    ident = f.read(16)
+    if len(ident) != 16 or not ident.startswith(ELF_MAGIC):
+      return []
+
+    is_64 = ord(ident[4]) == ELF_CLASS_64
+    endian = '>' if ord(ident[5]) == ELF_DATA_BIG_ENDIAN else '<'
+    header_fmt, section_fmt, dynamic_fmt = [
+        endian + fmt for fmt in FORMATS[is_64]]
+
+    header = read_struct(f, header_fmt, 16)
+    if not header:
+      return []
+    section_offset, section_size, section_count = (
+        header[5], header[10], header[11])
+
+    sections = []
+    for i in range(section_count):
+      section = read_struct(f, section_fmt, section_offset + i * section_size)
+      if not section:
+        return []
+      sections.append(section)
+
+    needed = []
+    for section in sections:
+      # sh_type, sh_offset, sh_size and sh_link.
+      if section[1] != SHT_DYNAMIC or section[6] >= len(sections):
+        continue
+      strings_offset = sections[section[6]][4]
+      entry_size = struct.calcsize(dynamic_fmt)
+      for offset in range(section[4], section[4] + section[5], entry_size):
+        entry = read_struct(f, dynamic_fmt, offset)
+        if not entry or entry[0] == DT_NULL:
+          break
+        if entry[0] == DT_NEEDED:
+          f.seek(strings_offset + entry[1])
+          needed.append(read_string(f))
+    return needed
+
+
+def read_string(f):
+  """Reads a NUL terminated string from the current position."""
+  chars = []
+  for char in iter(lambda: f.read(1), ''):
+    if char == '\x00':
+      break
+    chars.append(char)
+  return ''.join(chars)
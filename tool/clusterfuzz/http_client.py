@@ -0,0 +1,104 @@
+"""Module for the HTTP session every network call goes through.
+
+Connections are kept alive and reused by later requests to the same host,
+failed requests are retried with an exponential backoff and the ClusterFuzz
+authorization header is attached to the requests sent to ClusterFuzz."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import urlparse
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+
+from clusterfuzz import common
+
+USER_AGENT = 'clusterfuzz-tools'
+# The number of hosts whose connections are kept, and the number of
+# connections kept per host, which is enough for the parallel downloads.
+POOL_CONNECTIONS = 10
+POOL_MAXSIZE = 16
+MAX_RETRIES = 3
+BACKOFF_FACTOR = 0.5
+RETRY_STATUSES = (500, 502, 503, 504)
+DEFAULT_TIMEOUT = 60
+SESSION = None
+SESSION_LOCK = threading.Lock()
+
+
+class ClusterfuzzAuth(requests.auth.AuthBase):
+  """Adds the authorization header to the requests sent to ClusterFuzz only,
+    so that it isn't leaked to the other hosts."""
+
+  def __init__(self, header):
+    self.header = header
+
+  def __call__(self, request):
+    host = urlparse.urlparse(request.url).hostname
+    if self.header and host == common.DOMAIN_NAME:
+      request.headers['Authorization'] = self.header
+    return request
+
+
+def create_session():
+  """Returns a new session with pooled, retried connections."""
+  session = requests.Session()
+  # Only idempotent requests are retried when the server fails, a POST is
+  # only retried when the connection couldn't be made.
+  retries = Retry(total=MAX_RETRIES, backoff_factor=BACKOFF_FACTOR,
+                  status_forcelist=RETRY_STATUSES, raise_on_status=False)
+  adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS,
+                        pool_maxsize=POOL_MAXSIZE, max_retries=retries)
+  session.mount('http://', adapter)
+  session.mount('https://', adapter)
+  session.headers['User-Agent'] = USER_AGENT
+  session.auth = ClusterfuzzAuth(common.get_stored_auth_header())
+  return session
+
+
+def get_session():
+  """Returns the session shared by the whole process."""
+  global SESSION
+  with SESSION_LOCK:
+    if SESSION is None:
+      SESSION = create_session()
+    return SESSION
+
+
+def set_auth_header(header):
+  """Sets the authorization header sent with the requests to ClusterFuzz."""
+  get_session().auth.header = header
+
+
+def request(method, url, **kwargs):
+  """Sends a request through the shared session, with a default timeout."""
+  kwargs.setdefault('timeout', DEFAULT_TIMEOUT)
+  return get_session().request(method, url, **kwargs)
+
+
+def get(url, **kwargs):
+  """Sends a GET request."""
+  return request('GET', url, **kwargs)
+
+
+def head(url, **kwargs):
+  """Sends a HEAD request, following redirects."""
+  kwargs.setdefault('allow_redirects', True)
+  return request('HEAD', url, **kwargs)
+
+
+def post(url, **kwargs):
+  """Sends a POST request."""
+  return request('POST', url, **kwargs)
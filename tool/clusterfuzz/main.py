@@ -16,16 +16,30 @@
 import argparse
 import importlib
 import logging
+import sys
 
 from clusterfuzz import common
+from clusterfuzz import daemon
 from clusterfuzz import local_logging
 
 logger = logging.getLogger('clusterfuzz')
 
 
 def execute(argv=None):
-  """The main entry point."""
+  """The main entry point. Commands are forwarded to the daemon started by
+    'clusterfuzz serve' when it's running."""
+  argv = sys.argv[1:] if argv is None else argv
+  if daemon.should_forward(argv):
+    connection = daemon.connect()
+    if connection:
+      sys.exit(daemon.forward(connection, argv))
+
   local_logging.start_loggers()
+  run(argv)
+
+
+def run(argv):
+  """Parses and runs a command."""
   logger.info('Version: %s', common.get_version())
   logger.info('Path: %s', __file__)
 
@@ -35,7 +49,9 @@ def execute(argv=None):
   subparsers.add_parser('supported_job_types',
                         help='List all supported job types')
   reproduce = subparsers.add_parser('reproduce', help='Reproduce a crash.')
-  reproduce.add_argument('testcase_id', help='The testcase ID.')
+  reproduce.add_argument(
+      'testcase_id', nargs='?', default=None,
+      help='The testcase ID. Not needed with --batch.')
   reproduce.add_argument(
       '-c', '--current', action='store_true', default=False,
       help=('Use the current tree; "gclient sync" and "gclient runhooks" will '
@@ -55,6 +71,24 @@ def execute(argv=None):
   reproduce.add_argument(
       '-i', '--iterations', action='store', default=10, type=int,
       help='Specify the number of times to attempt reproduction.')
+  reproduce.add_argument(
+      '-p', '--parallel', action='store', default=1, type=int,
+      help=('Run this many attempts at once, each with its own profile, '
+            'display and temporary directory, and stop the others when one '
+            'reproduces the crash.'))
+  reproduce.add_argument(
+      '--stats', action='store', default=None, type=int, metavar='N',
+      help=('Run N attempts, --parallel at a time, and print the match rate, '
+            'the crash signatures seen and the run times as JSON instead of '
+            'stopping at the first match.'))
+  reproduce.add_argument(
+      '--batch', nargs='+', default=None, metavar='FILE|ID',
+      help=('Reproduce many testcases, given by ID or by files listing one ID '
+            'per line. Testcases sharing a build reuse it, and --parallel '
+            'testcases run at a time.'))
+  reproduce.add_argument(
+      '--batch-output', action='store', default='batch_results.json',
+      help='The file to write the JSON results of --batch to.')
   reproduce.add_argument(
       '-dx', '--disable-xvfb', action='store_true', default=False,
       help='Disable running testcases in a virtual frame buffer.')
@@ -64,8 +98,39 @@ def execute(argv=None):
   reproduce.add_argument(
       '--edit-mode', action='store_true', default=False,
       help='Edit args.gn before building and target arguments before running.')
+  reproduce.add_argument(
+      '--refresh', action='store_true', default=False,
+      help=('Download the testcase information again instead of using the '
+            'copy cached by an earlier run.'))
+
+  subparsers.add_parser(
+      'serve', help=('Run commands in a background process that keeps caches '
+                     'and connections warm. Other clusterfuzz commands are '
+                     'forwarded to it while it runs.'))
+
+  cache = subparsers.add_parser(
+      'cache', help='Inspect, prune and prewarm the local cache.')
+  cache.set_defaults(size=None, testcase_ids=None, j=4)
+  cache_subparsers = cache.add_subparsers(dest='action')
+  cache_subparsers.add_parser(
+      'list', help='List the cached builds, testcases and out dirs.')
+  prune = cache_subparsers.add_parser(
+      'prune', help='Evict the least recently used entries.')
+  prune.add_argument(
+      '--size', action='store', default=None,
+      help=('The size to prune the cache down to (e.g. 20G). Defaults to '
+            '$CF_CACHE_MAX_SIZE.'))
+  prewarm = cache_subparsers.add_parser(
+      'prewarm', help='Download testcases and their builds for later use.')
+  prewarm.add_argument('testcase_ids', nargs='+', help='The testcase IDs.')
+  prewarm.add_argument(
+      '-j', action='store', default=4, type=int,
+      help='The number of testcases to download concurrently.')
 
   args = parser.parse_args(argv)
+  if (args.command == 'reproduce' and not args.testcase_id and
+      not args.batch):
+    reproduce.error('either a testcase ID or --batch is required')
   command = importlib.import_module('clusterfuzz.commands.%s' % args.command)
 
   arg_dict = {k: v for k, v in vars(args).items()}
@@ -15,22 +15,44 @@
 
 import os
 import re
+import atexit
+import shutil
+import shlex
+import signal
+import socket
+import tempfile
+import threading
 import time
 import subprocess
 import logging
 import json
+import math
 import HTMLParser
 import sys
 import requests
 import xvfbwrapper
 import psutil
+from multiprocessing.pool import ThreadPool
 
 from cmd_editor import editor
 from clusterfuzz import common
+from clusterfuzz import http_client
+from clusterfuzz import stack_analyzer
 
 DISABLE_GL_DRAW_ARG = '--disable-gl-drawing-for-tests'
 DEFAULT_GESTURE_TIME = 5
 TEST_TIMEOUT = 30
+DISPLAY_READY_TIMEOUT = 10
+WINDOW_POLL_INTERVAL = 0.5
+WINDOW_SETTLE_TIME = 2
+WINDOW_WAIT_TIMEOUT = 20
+# Prints a line starting with 'x:' after every gesture of an xdotool script.
+GESTURE_MARKER = 'getmouselocation'
+DISPLAY_POLL_INTERVAL = 0.05
+X_SOCKET_DIR = '/tmp/.X11-unix'
+USER_PROFILE_DIR = '/tmp/clusterfuzz-user-profile-data'
+PARSE_STACKTRACE_URL = 'https://clusterfuzz.com/v2/parse_stacktrace'
+PARSE_STACKTRACE_TIMEOUT = 10
 logger = logging.getLogger('clusterfuzz')
 
 
@@ -103,6 +125,73 @@ def is_similar(new_type, new_state_lines, original_type, original_state_lines):
   return count >= len(original_state_lines)
 
 
+def get_percentile(sorted_values, percent):
+  """Returns the nearest-rank percentile of a sorted, non-empty list."""
+  index = int(math.ceil(percent / 100.0 * len(sorted_values))) - 1
+  return sorted_values[max(0, index)]
+
+
+def summarize_attempts(results):
+  """Summarizes the results of reproduce_stats: the match rate, the distinct
+    crash signatures with their counts and the wall time percentiles."""
+
+  signatures = {}
+  for result in results:
+    key = (result['crashType'], tuple(result['crashState']))
+    if key not in signatures:
+      signatures[key] = {'crashType': result['crashType'],
+                         'crashState': result['crashState'],
+                         'matches': result['matches'],
+                         'count': 0}
+    signatures[key]['count'] += 1
+
+  matches = len([result for result in results if result['matches']])
+  wall_times = sorted(result['wallTime'] for result in results)
+  return {
+      'attempts': len(results),
+      'matches': matches,
+      'matchRate': float(matches) / len(results),
+      'signatures': sorted(
+          signatures.values(),
+          key=lambda s: (-s['count'], not s['matches'], s['crashType'])),
+      'wallTime': {'min': wall_times[0],
+                   'p50': get_percentile(wall_times, 50),
+                   'p90': get_percentile(wall_times, 90),
+                   'p99': get_percentile(wall_times, 99),
+                   'max': wall_times[-1]}}
+
+
+class Attempt(object):
+  """One of several reproduction attempts run at once. It has a directory of
+    its own and can be cancelled while it runs."""
+
+  def __init__(self, number):
+    self.number = number
+    self.directory = tempfile.mkdtemp(prefix='clusterfuzz-attempt-%d-' % number)
+    self.process = None
+    self.cancelled = False
+    self.lock = threading.Lock()
+
+  def set_process(self, process):
+    """Records the process of the attempt, and kills it if the attempt is
+      already cancelled."""
+    with self.lock:
+      self.process = process
+      if self.cancelled:
+        common.kill_process_group(process, signal.SIGKILL)
+
+  def cancel(self):
+    """Cancels the attempt, killing its process if it's running."""
+    with self.lock:
+      self.cancelled = True
+      if self.process:
+        common.kill_process_group(self.process, signal.SIGKILL)
+
+  def cleanup(self):
+    """Deletes the directory of the attempt."""
+    common.delete_if_exists(self.directory)
+
+
 class BaseReproducer(object):
   """The basic reproducer class that all other ones are built on."""
 
@@ -124,6 +213,7 @@ class BaseReproducer(object):
     self.environment = testcase.environment
     self.args = testcase.reproduction_args
     self.target_args = target_args
+    self.binary_provider = binary_provider
     self.binary_path = binary_provider.get_binary_path()
     self.build_directory = binary_provider.get_build_directory()
     self.source_directory = binary_provider.source_directory
@@ -193,19 +283,45 @@ class BaseReproducer(object):
     self.set_up_symbolizers_suppressions()
     self.setup_args()
 
-  def reproduce_crash(self):
+  def get_attempt_settings(self, attempt):
+    """Returns the args and environment to run the binary with. An attempt
+      keeps its temporary files in its own directory."""
+    if not attempt:
+      return self.args, self.environment
+
+    environment = dict(self.environment)
+    environment['TMPDIR'] = attempt.directory
+    return self.args, environment
+
+  def reproduce_crash(self, attempt=None):
     """Reproduce the crash."""
-    return common.execute(
-        self.binary_path, self.args,
-        os.path.dirname(self.binary_path), env=self.environment,
-        exit_on_error=False)
+    args, environment = self.get_attempt_settings(attempt)
+    process = common.start_execute(
+        self.binary_path, args, os.path.dirname(self.binary_path),
+        env=environment)
+    if attempt:
+      attempt.set_process(process)
+    return common.wait_execute(process, exit_on_error=False)
 
   def get_stacktrace_info(self, trace):
-    """Post a stacktrace, return (crash_state, crash_type)."""
+    """Parse a stacktrace, return (crash_state, crash_type).
+
+    When CF_REMOTE_STACKTRACE_PARSING is set, stacktraces which the local
+    parser doesn't recognize are posted to ClusterFuzz, if it can be
+    reached."""
 
-    response = requests.post(
-        url=('https://clusterfuzz.com/v2/parse_stacktrace'),
-        data=json.dumps({'job': self.job_type, 'stacktrace': trace}))
+    crash_state, crash_type = stack_analyzer.get_crash_info(trace)
+    if crash_type or not os.environ.get('CF_REMOTE_STACKTRACE_PARSING'):
+      return crash_state, crash_type
+
+    try:
+      response = http_client.post(
+          PARSE_STACKTRACE_URL,
+          data=json.dumps({'job': self.job_type, 'stacktrace': trace}),
+          timeout=PARSE_STACKTRACE_TIMEOUT)
+    except requests.RequestException as e:
+      logger.debug('Could not parse the stacktrace remotely: %s', e)
+      return crash_state, crash_type
     response = json.loads(response.text)
     crash_state = [x for x in response['crash_state'].split('\n') if x]
     crash_type = response['crash_type'].replace('\n', ' ')
@@ -239,13 +355,35 @@ class BaseReproducer(object):
           self.args, prefix='edit-args-',
           comment='Edit arguments before running %s' % self.binary_path)
 
-  def reproduce(self, iteration_max):
-    """Reproduces the crash and prints the stacktrace."""
+  def is_reproduced(self, output):
+    """Returns true if the crash in output is similar to the original one."""
+    new_crash_state, new_crash_type = self.get_stacktrace_info(output)
+
+    logger.info(
+        'New crash type: %s\n'
+        'New crash state:\n  %s\n\n'
+        'Original crash type: %s\n'
+        'Original crash state:\n  %s\n',
+        new_crash_type, '\n  '.join(new_crash_state), self.crash_type,
+        '\n  '.join(self.crash_state))
+
+    # The crash signature validation is intentionally forgiving.
+    return is_similar(
+        new_crash_type, new_crash_state, self.crash_type, self.crash_state)
+
+  def reproduce(self, iteration_max, parallel=1, isolated=False):
+    """Reproduces the crash and prints the stacktrace. With parallel > 1,
+      that many attempts run at once. Attempts have their own directories
+      when parallel > 1 or isolated is set, e.g. because other testcases
+      run at the same time."""
 
     logger.info('Reproducing...')
 
     self.pre_build_steps()
 
+    if parallel > 1 or isolated:
+      return self.reproduce_in_parallel(iteration_max, parallel)
+
     iterations = 1
     while iterations <= iteration_max:
       _, output = self.reproduce_crash()
@@ -253,19 +391,11 @@ class BaseReproducer(object):
       print
       logger.info(output)
 
-      new_crash_state, new_crash_type = self.get_stacktrace_info(output)
-
-      logger.info(
-          'New crash type: %s\n'
-          'New crash state:\n  %s\n\n'
-          'Original crash type: %s\n'
-          'Original crash state:\n  %s\n',
-          new_crash_type, '\n  '.join(new_crash_state), self.crash_type,
-          '\n  '.join(self.crash_state))
+      if self.binary_provider.extract_missing_files(output):
+        logger.info('Trying again with the whole build.')
+        continue
 
-      # The crash signature validation is intentionally forgiving.
-      if is_similar(
-          new_crash_type, new_crash_state, self.crash_type, self.crash_state):
+      if self.is_reproduced(output):
         logger.info('The stacktrace seems similar to the original stacktrace.')
         return True
       else:
@@ -276,6 +406,111 @@ class BaseReproducer(object):
       time.sleep(3)
     sys.exit(1)
 
+  def run_attempt(self, number, attempts):
+    """Runs an attempt unless the crash was already reproduced. Returns its
+      output if it reproduced the crash, and cancels the other attempts."""
+
+    with attempts['lock']:
+      if attempts['reproduced']:
+        return None
+      attempt = Attempt(number)
+      attempts['running'].append(attempt)
+
+    try:
+      while True:
+        _, output = self.reproduce_crash(attempt)
+        if attempt.cancelled:
+          return None
+        if not self.binary_provider.extract_missing_files(output):
+          break
+        logger.info('Trying attempt %d again with the whole build.', number)
+
+      logger.info('Attempt %d finished.', number)
+      if not self.is_reproduced(output):
+        return None
+
+      with attempts['lock']:
+        attempts['reproduced'] = True
+        for other in attempts['running']:
+          if other is not attempt:
+            other.cancel()
+      return output
+    finally:
+      with attempts['lock']:
+        attempts['running'].remove(attempt)
+      attempt.cleanup()
+
+  def run_stats_attempt(self, number):
+    """Runs one attempt to completion and returns its crash signature,
+      whether it matches the original one and how long it took."""
+
+    attempt = Attempt(number)
+    start_time = time.time()
+    try:
+      while True:
+        _, output = self.reproduce_crash(attempt)
+        if not self.binary_provider.extract_missing_files(output):
+          break
+      wall_time = time.time() - start_time
+
+      crash_state, crash_type = self.get_stacktrace_info(output)
+      matches = is_similar(
+          crash_type, crash_state, self.crash_type, self.crash_state)
+      logger.info('Attempt %d finished in %.1fs: %s.', number, wall_time,
+                  'match' if matches else 'no match')
+      return {'crashType': crash_type, 'crashState': list(crash_state),
+              'matches': matches, 'wallTime': wall_time}
+    finally:
+      attempt.cleanup()
+
+  def reproduce_stats(self, attempt_count, parallel=1):
+    """Runs attempt_count attempts, parallel at a time, without stopping at
+      the first match, and prints statistics about them as JSON."""
+
+    logger.info('Reproducing...')
+
+    self.pre_build_steps()
+
+    logger.info('Running %d attempts, %d at a time.', attempt_count, parallel)
+    pool = ThreadPool(parallel)
+    try:
+      results = pool.map(self.run_stats_attempt, range(1, attempt_count + 1))
+    finally:
+      pool.close()
+      pool.join()
+
+    stats = summarize_attempts(results)
+    print
+    logger.info(json.dumps(stats, indent=2, sort_keys=True))
+    return stats
+
+  def reproduce_in_parallel(self, iteration_max, parallel):
+    """Runs up to iteration_max attempts, parallel at a time, until one of
+      them reproduces the crash."""
+
+    attempts = {'lock': threading.Lock(), 'running': [], 'reproduced': False}
+    logger.info('Running %d attempts, %d at a time.', iteration_max, parallel)
+    pool = ThreadPool(parallel)
+    try:
+      results = pool.imap_unordered(
+          lambda number: (number, self.run_attempt(number, attempts)),
+          range(1, iteration_max + 1))
+      for number, output in results:
+        if output is not None:
+          print
+          logger.info(output)
+          logger.info('Attempt %d of %d reproduced the crash. The stacktrace '
+                      'seems similar to the original stacktrace.', number,
+                      iteration_max)
+          return True
+    finally:
+      pool.close()
+      pool.join()
+
+    logger.info("None of the %d attempts matched the original stacktrace.",
+                iteration_max)
+    sys.exit(1)
+
 
 class LibfuzzerJobReproducer(BaseReproducer):
   """A reproducer for libfuzzer job types."""
@@ -289,38 +524,142 @@ class LibfuzzerJobReproducer(BaseReproducer):
     super(LibfuzzerJobReproducer, self).pre_build_steps()
 
 
-class Xvfb(object):
-  """Run commands within a virtual display using blackbox window manager."""
+def wait_for_display(display_name):
+  """Waits until the X server of display_name accepts connections."""
 
-  def __init__(self, disable=False):
-    self.disable_xvfb = disable
+  socket_path = os.path.join(X_SOCKET_DIR, 'X%s' % display_name.lstrip(':'))
+  deadline = time.time() + DISPLAY_READY_TIMEOUT
+  while True:
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+      connection.connect(socket_path)
+      return
+    except socket.error:
+      if time.time() > deadline:
+        raise common.ExpectedException(
+            'The virtual display %s did not start within %d seconds.' %
+            (display_name, DISPLAY_READY_TIMEOUT))
+      time.sleep(DISPLAY_POLL_INTERVAL)
+    finally:
+      connection.close()
+
+
+class Display(object):
+  """A virtual display running the blackbox window manager."""
+
+  def __init__(self):
+    self.xvfb = None
+    self.blackbox = None
+    self.name = None
+
+  def start(self):
+    """Starts Xvfb, waits for it to accept connections and starts blackbox.
+      xvfbwrapper holds a flock on the display number, so processes sharing
+      the host get distinct displays."""
+    self.xvfb = xvfbwrapper.Xvfb(width=1280, height=1024)
+    self.xvfb.start()
+    try:
+      for i in self.xvfb.xvfb_cmd:
+        if i.startswith(':'):
+          self.name = i
+          break
+      wait_for_display(self.name)
+      self.start_window_manager()
+    except Exception:
+      self.xvfb.stop()
+      raise
 
-  def __enter__(self):
-    if self.disable_xvfb:
-      return None
-    self.display = xvfbwrapper.Xvfb(width=1280, height=1024)
-    self.display.start()
-    for i in self.display.xvfb_cmd:
-      if i.startswith(':'):
-        display_name = i
-        break
+  def start_window_manager(self):
+    """Starts blackbox within the display."""
     logger.info('Starting the blackbox window manager in a virtual display.')
     try:
       self.blackbox = subprocess.Popen(['blackbox'],
-                                       env={'DISPLAY': display_name})
+                                       env={'DISPLAY': self.name})
     except OSError, e:
       if str(e) == '[Errno 2] No such file or directory':
         raise common.NotInstalledError('blackbox')
       raise
 
-    time.sleep(3)
-    return display_name
+  def reset(self):
+    """Prepares the display for its next use, restarting whatever died."""
+    if self.xvfb.proc is None or self.xvfb.proc.poll() is not None:
+      logger.debug('The virtual display %s died, restarting it.', self.name)
+      self.stop()
+      self.start()
+    elif self.blackbox.poll() is not None:
+      self.start_window_manager()
+
+  def stop(self):
+    """Stops blackbox and Xvfb."""
+    if self.blackbox and self.blackbox.poll() is None:
+      self.blackbox.kill()
+    self.xvfb.stop()
+
+
+class DisplayPool(object):
+  """Hands out virtual displays to reproduction attempts. Displays are started
+    when no free one is left, reused by later attempts and stopped at exit."""
+
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.displays = []
+    self.free = []
+    self.stopping_at_exit = False
+
+  def acquire(self):
+    """Returns a free display, starting a new one if needed."""
+    with self.lock:
+      if self.free:
+        return self.free.pop()
+
+    display = Display()
+    display.start()
+    with self.lock:
+      if not self.stopping_at_exit:
+        self.stopping_at_exit = True
+        atexit.register(self.stop)
+      self.displays.append(display)
+    return display
+
+  def release(self, display):
+    """Resets the display and makes it available to the next attempt."""
+    try:
+      display.reset()
+    except Exception:
+      with self.lock:
+        self.displays.remove(display)
+      raise
+    with self.lock:
+      self.free.append(display)
+
+  def stop(self):
+    """Stops every display of the pool."""
+    with self.lock:
+      displays, self.displays, self.free = self.displays, [], []
+    for display in displays:
+      display.stop()
+
+
+DISPLAY_POOL = DisplayPool()
+
+
+class Xvfb(object):
+  """Run commands within a virtual display of DISPLAY_POOL."""
+
+  def __init__(self, disable=False):
+    self.disable_xvfb = disable
+    self.display = None
+
+  def __enter__(self):
+    if self.disable_xvfb:
+      return None
+    self.display = DISPLAY_POOL.acquire()
+    return self.display.name
 
   def __exit__(self, unused_type, unused_value, unused_traceback):
     if self.disable_xvfb:
       return
-    self.blackbox.kill()
-    self.display.stop()
+    DISPLAY_POOL.release(self.display)
 
 
 class LinuxChromeJobReproducer(BaseReproducer):
@@ -345,21 +684,8 @@ class LinuxChromeJobReproducer(BaseReproducer):
 
     return pids
 
-  def xdotool_command(self, command, display_name):
-    """Run a command, returning its output."""
-    common.execute('xdotool', command, '.', env={'DISPLAY': display_name})
-
-  def find_windows_for_process(self, process_id, display_name):
-    """Return visible windows belonging to a process."""
-    pids = self.get_process_ids(process_id)
-    if not pids:
-      return []
-
-    logger.info(
-        'Waiting for 20 seconds to ensure all windows appear: '
-        'pid=%s, display=%s', pids, display_name)
-    time.sleep(20)
-
+  def list_visible_windows(self, pids, display_name):
+    """Return the visible windows of the given processes."""
     visible_windows = set()
     for pid in pids:
       _, windows = common.execute(
@@ -370,20 +696,93 @@ class LinuxChromeJobReproducer(BaseReproducer):
         if not line.isdigit():
           continue
         visible_windows.add(line)
+    return visible_windows
+
+  def find_windows_for_process(self, process_id, display_name,
+                               settle_time=WINDOW_SETTLE_TIME,
+                               timeout=WINDOW_WAIT_TIMEOUT):
+    """Return visible windows belonging to a process and its descendants,
+      once the set of windows hasn't changed for settle_time seconds or
+      after timeout seconds."""
+    pids = self.get_process_ids(process_id)
+    if not pids:
+      return []
+
+    logger.info(
+        'Waiting for the windows to appear: pid=%s, display=%s',
+        pids, display_name)
+    start_time = time.time()
+    visible_windows = set()
+    changed_time = start_time
+    while True:
+      windows = self.list_visible_windows(pids, display_name)
+      now = time.time()
+      if windows != visible_windows:
+        visible_windows = windows
+        changed_time = now
+      elif visible_windows and now - changed_time >= settle_time:
+        break
+
+      if now - start_time >= timeout:
+        logger.info('The windows did not settle within %d seconds.', timeout)
+        break
+      time.sleep(WINDOW_POLL_INTERVAL)
+      pids = self.get_process_ids(process_id) or pids
 
     logger.info('Found windows: %s', ', '.join(list(visible_windows)))
     return visible_windows
 
-  def execute_gesture(self, gesture, window, display_name):
-    """Executes a specific gesture."""
+  def compile_gesture(self, gesture, window):
+    """Returns the xdotool script line of a gesture."""
 
-    gesture_type, gesture_cmd = gesture.split(',')
+    gesture_type, gesture_cmd = gesture.split(',', 1)
+    # Script lines aren't run by a shell, so the shell quoting is removed.
+    try:
+      gesture_cmd = ' '.join(shlex.split(gesture_cmd))
+    except ValueError:
+      pass
     if gesture_type == 'windowsize':
-      self.xdotool_command('%s %s %s' % (gesture_type, window, gesture_cmd),
-                           display_name)
-    else:
-      self.xdotool_command('%s -- %s' % (gesture_type, gesture_cmd),
-                           display_name)
+      return '%s %s %s' % (gesture_type, window, gesture_cmd)
+    return '%s -- %s' % (gesture_type, gesture_cmd)
+
+  def compile_gestures(self, windows):
+    """Returns the (name, xdotool script line) steps running all gestures on
+      every window."""
+
+    steps = []
+    for window in windows:
+      steps.append(('windowactivate %s' % window,
+                    'windowactivate --sync %s' % window))
+      for gesture in self.gestures:
+        steps.append((gesture, self.compile_gesture(gesture, window)))
+    return steps
+
+  def execute_gesture_script(self, steps, display_name):
+    """Runs all steps in a single xdotool process, and returns how long each
+      step took. Every step is followed by GESTURE_MARKER, whose output
+      tells when the step is done."""
+
+    script = ''.join('%s\n%s\n' % (line, GESTURE_MARKER)
+                     for _, line in steps)
+    process = common.start_execute(
+        'xdotool', '-', '.', env={'DISPLAY': display_name},
+        print_command=False)
+    process.stdin.write(script)
+    process.stdin.close()
+
+    durations = []
+    last_time = time.time()
+    pending = ''
+    for chunk in common.read_output(process, timeout=TEST_TIMEOUT):
+      lines = (pending + chunk).split('\n')
+      pending = lines.pop()
+      for line in lines:
+        if line.startswith('x:'):
+          now = time.time()
+          durations.append(now - last_time)
+          last_time = now
+    process.wait()
+    return durations
 
   def run_gestures(self, proc, display_name):
     """Executes all required gestures."""
@@ -391,36 +790,51 @@ class LinuxChromeJobReproducer(BaseReproducer):
     time.sleep(self.gesture_start_time)
     logger.info('Running gestures...')
     windows = self.find_windows_for_process(proc.pid, display_name)
-    for _, window in enumerate(windows):
-      logger.info('Run gestures on window %s', window)
-      self.xdotool_command('windowactivate --sync %s' % window, display_name)
+    steps = self.compile_gestures(windows)
+    if not steps:
+      return
 
-      for gesture in self.gestures:
-        self.execute_gesture(gesture, window, display_name)
+    durations = self.execute_gesture_script(steps, display_name)
+    for (name, _), duration in zip(steps, durations):
+      logger.info('Gesture %s took %.2fs.', name, duration)
+    if len(durations) < len(steps):
+      logger.info('Only %d of %d gestures completed.', len(durations),
+                  len(steps))
 
   def pre_build_steps(self):
     """Steps to run before building."""
     # Add argument for user profile directory.
-    user_profile_dir = '/tmp/clusterfuzz-user-profile-data'
-    common.delete_if_exists(user_profile_dir)
-    user_data_str = ' --user-data-dir=%s' % user_profile_dir
+    common.delete_if_exists(USER_PROFILE_DIR)
+    user_data_str = ' --user-data-dir=%s' % USER_PROFILE_DIR
     if user_data_str not in self.args:
       self.args += user_data_str
 
-    # Move testcase to LayoutTests directory if needed.
+    # Copy testcase to LayoutTests directory if needed, leaving the cached
+    # testcase in place.
     search_string = '%sLayoutTests%s' % (os.sep, os.sep)
     if search_string in self.original_testcase_path:
       search_index = self.original_testcase_path.find(search_string)
       new_testcase_path = os.path.join(
           self.source_directory, 'third_party', 'WebKit', 'LayoutTests',
           self.original_testcase_path[search_index + len(search_string):])
-      os.rename(self.testcase_path, new_testcase_path)
+      shutil.copy(self.testcase_path, new_testcase_path)
       self.testcase_path = new_testcase_path
 
     self.environment.pop('ASAN_SYMBOLIZER_PATH', None)
     super(LinuxChromeJobReproducer, self).pre_build_steps()
 
 
+  def get_attempt_settings(self, attempt):
+    """Returns the args and environment to run Chrome with. An attempt has
+      its own user profile."""
+    args, environment = super(
+        LinuxChromeJobReproducer, self).get_attempt_settings(attempt)
+    if attempt:
+      args = args.replace(
+          '--user-data-dir=%s' % USER_PROFILE_DIR, '--user-data-dir=%s' %
+          os.path.join(attempt.directory, 'user-profile'))
+    return args, environment
+
   def post_run_symbolize(self, output):
     """Symbolizes non-libfuzzer chrome jobs."""
     if not output.strip():
@@ -442,19 +856,28 @@ class LinuxChromeJobReproducer(BaseReproducer):
     return out
 
 
-  def reproduce_crash(self):
+  def reproduce_crash(self, attempt=None):
     """Reproduce the crash, running gestures if necessary."""
 
+    args, environment = self.get_attempt_settings(attempt)
     with Xvfb(self.disable_xvfb) as display_name:
-      self.environment['DISPLAY'] = display_name
+      environment = dict(environment)
+      environment['DISPLAY'] = display_name
 
       process = common.start_execute(
-          self.binary_path, self.args,
-          os.path.dirname(self.binary_path), env=self.environment)
+          self.binary_path, args,
+          os.path.dirname(self.binary_path), env=environment)
+      if attempt:
+        attempt.set_process(process)
 
       if self.gestures:
         self.run_gestures(process, display_name)
 
-      err, out = common.wait_execute(process, exit_on_error=False,
-                                     timeout=TEST_TIMEOUT)
+      # Only the first report is compared, so Chrome is stopped once it's
+      # complete instead of running until the timeout.
+      err, out = common.wait_execute(
+          process, exit_on_error=False, timeout=TEST_TIMEOUT,
+          is_complete=stack_analyzer.ReportDetector().is_report_complete)
+      if attempt and attempt.cancelled:
+        return err, out
       return err, self.post_run_symbolize(out)
@@ -0,0 +1,311 @@
+"""Module for finding the crash type and state of sanitizer output.
+
+It follows the rules of the ClusterFuzz stack analyzer for ASan, MSan,
+UBSan, TSan, LSan, CFI and CHECK failures, so that stacktraces can be
+compared without a round trip to the server."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import re
+
+# The number of frames in a crash state.
+STATE_FRAME_COUNT = 3
+# Faults below this address are null dereferences.
+NULL_DEREFERENCE_BOUNDARY = 4096
+
+ASAN_REGEX = re.compile(
+    r'ERROR: AddressSanitizer: ([\w-]+)(?: on (?:unknown )?address '
+    r'(?:0x)?([0-9a-fA-F]+))?')
+ASAN_ACCESS_REGEX = re.compile(r'^(READ|WRITE) of size (\d+)')
+SIGNAL_ACCESS_REGEX = re.compile(
+    r'The signal is caused by a (READ|WRITE) memory access')
+MSAN_REGEX = re.compile(r'WARNING: MemorySanitizer: ([\w-]+)')
+TSAN_REGEX = re.compile(r'WARNING: ThreadSanitizer: ([\w -]+?)\s*(?:\(|$)')
+LSAN_REGEX = re.compile(r'ERROR: LeakSanitizer: detected memory leaks')
+LSAN_LEAK_REGEX = re.compile(r'^(Direct|Indirect) leak of')
+UBSAN_REGEX = re.compile(r':\d+(?::\d+)?: runtime error: (.*)$')
+CFI_NODIAG_REGEX = re.compile(
+    r'CFI: Most likely a control flow integrity violation')
+CHECK_REGEX = re.compile(
+    r'FATAL:([^\s(:]+)\(\d+\)\] (?:Check|Debug check) failed: (.*?)\.?\s*$')
+V8_FATAL_REGEX = re.compile(r'^#\s*Fatal error in (.*), line \d+')
+V8_CHECK_REGEX = re.compile(r'^#\s*(?:Check|Debug check) failed: (.*?)\.?\s*$')
+LIBFUZZER_REGEX = re.compile(r'ERROR: libFuzzer: (timeout|out-of-memory)')
+
+# The first and last lines of a sanitizer report.
+REPORT_START_REGEX = re.compile(
+    r'==\d+==\s*(?:ERROR|WARNING): \w+Sanitizer|:\d+: runtime error: ')
+REPORT_END_REGEX = re.compile(r'^SUMMARY: \w+Sanitizer')
+
+# TSan frames have no address, and the module offset follows the location.
+FRAME_REGEX = re.compile(r'^\s*#(\d+)\s+(?:0x[0-9a-fA-F]+\s+)?(.*)$')
+FRAME_FUNCTION_REGEX = re.compile(
+    r'^(?:in )?(.+?)(?: (\S+:\d+(?::\d+)?(?: \(\S+\+0x[0-9a-fA-F]+\))?|'
+    r'\(\S+\+0x[0-9a-fA-F]+\)))?$')
+UNSYMBOLIZED_REGEX = re.compile(r'^(?:\(\S+\+0x[0-9a-fA-F]+\)|<unknown)')
+
+# The ASan error names which don't follow the capitalized-name rule.
+ASAN_TYPES = {
+    'unknown-crash': 'UNKNOWN',
+    'stack-overflow': 'Stack-overflow',
+    'FPE': 'Floating-point-exception',
+    'ILL': 'Ill',
+    'ABRT': 'Abrt',
+    'requested': 'Out-of-memory',
+    'allocator': 'Out-of-memory',
+    'out': 'Out-of-memory'}
+ASAN_ATTEMPTING_TYPES = [
+    (re.compile(r'attempting double-free'), 'Heap-double-free'),
+    (re.compile(r'attempting free on address which was not malloc'),
+     'Bad-free')]
+
+UBSAN_TYPES = [
+    (re.compile(r'control flow integrity check for type .* failed'),
+     'Bad-cast'),
+    (re.compile(r'(?:signed|unsigned) integer overflow|negation of .* '
+                r'cannot be represented'), 'Integer-overflow'),
+    (re.compile(r'index .* out of bounds'), 'Index-out-of-bounds'),
+    (re.compile(r'division by zero'), 'Divide-by-zero'),
+    (re.compile(r'(?:member access within|load of|store to|reference binding '
+                r'to|member call on) null pointer'), 'Null-dereference'),
+    (re.compile(r'misaligned address'), 'Misaligned-address'),
+    (re.compile(r'downcast of|which does not point to an object of type'),
+     'Bad-cast'),
+    (re.compile(r'through pointer to incorrect function type'),
+     'Incorrect-function-pointer-type'),
+    (re.compile(r'is not a valid value for type \'bool\''),
+     'Invalid-bool-value'),
+    (re.compile(r'is not a valid value for type'), 'Invalid-enum-value'),
+    (re.compile(r'shift exponent|left shift of'), 'Undefined-shift'),
+    (re.compile(r'outside the range of representable values'),
+     'Float-cast-overflow'),
+    (re.compile(r'pointer index expression with base'), 'Pointer-overflow'),
+    (re.compile(r'variable length array bound'),
+     'Non-positive-vla-bound-value'),
+    (re.compile(r'execution reached (?:a __builtin_)?unreachable'),
+     'Unreachable code'),
+    (re.compile(r'null pointer passed as argument|returned from function '
+                r'declared to never return null'), 'Invalid-null-argument')]
+
+# Frames of the sanitizer runtimes, allocators, libc and crash reporting
+# which never make a crash state.
+IGNORED_FUNCTION_REGEX = re.compile('|'.join([
+    r'^(?:abort|exit|raise|tgkill|pthread_kill|pthread_create|_start|clone|'
+    r'start_thread|main)$',
+    r'^__(?:asan|msan|tsan|ubsan|lsan|sanitizer|interception|cfi)[_:]',
+    r'^__interceptor_', r'^__(?:libc|GI|chk|fortify|cxa|dynamic_cast)',
+    r'^(?:malloc|calloc|realloc|free|memalign|posix_memalign|valloc)$',
+    r'^operator (?:new|delete)',
+    r'^(?:mem|str|wcs)(?:cpy|move|set|cmp|len|ncmp|ncpy|cat|chr)$',
+    r'^bcmp$',
+    r'^base::debug::', r'^logging::', r'^std::__', r'^__gnu_cxx::',
+    r'^(?:WTF::)?CrashOnOverflow', r'^V8_Fatal', r'^v8::base::OS::Abort',
+    r'^fuzzer::']))
+IGNORED_LOCATION_REGEX = re.compile(
+    r'compiler-rt/lib|sanitizer_common|/libc[.-]|/libpthread|/libstdc\+\+|'
+    r'/libc\+\+')
+
+
+class ReportDetector(object):
+  """Finds the end of the first sanitizer report in output as it's read."""
+
+  def __init__(self):
+    self.partial_line = ''
+    self.report_started = False
+
+  def is_report_complete(self, chunk):
+    """Returns true once the chunks read so far hold a whole report."""
+    lines = (self.partial_line + chunk).split('\n')
+    self.partial_line = lines.pop()
+    for line in lines:
+      if REPORT_START_REGEX.search(line):
+        self.report_started = True
+      elif self.report_started and REPORT_END_REGEX.search(line):
+        return True
+    return False
+
+
+def get_asan_type(match, following_lines):
+  """Returns the crash type of an ASan error."""
+  name, address = match.group(1), match.group(2)
+  if name == 'attempting':
+    for regex, crash_type in ASAN_ATTEMPTING_TYPES:
+      if regex.search(match.string):
+        return crash_type
+    return 'UNKNOWN'
+
+  if name in ['SEGV', 'BUS']:
+    if address is not None and int(address, 16) < NULL_DEREFERENCE_BOUNDARY:
+      crash_type = 'Null-dereference'
+    else:
+      crash_type = 'UNKNOWN'
+  elif name in ASAN_TYPES:
+    crash_type = ASAN_TYPES[name]
+  else:
+    crash_type = name[0].upper() + name[1:]
+
+  for line in following_lines:
+    if FRAME_REGEX.match(line):
+      break
+    access = ASAN_ACCESS_REGEX.match(line)
+    if access:
+      return '%s\n%s %s' % (crash_type, access.group(1), access.group(2))
+    access = SIGNAL_ACCESS_REGEX.search(line)
+    if access:
+      return '%s\n%s' % (crash_type, access.group(1))
+  return crash_type
+
+
+def get_crash_type(lines, index):
+  """Returns the crash type and the lines preceding the frames in the crash
+    state if lines[index] starts a crash, or else (None, None)."""
+  line = lines[index]
+  following_lines = lines[index + 1:]
+
+  match = ASAN_REGEX.search(line)
+  if match:
+    return get_asan_type(match, following_lines), []
+
+  match = MSAN_REGEX.search(line)
+  if match:
+    name = match.group(1)
+    return name[0].upper() + name[1:], []
+
+  match = TSAN_REGEX.search(line)
+  if match:
+    name = match.group(1)
+    return name[0].upper() + name[1:], []
+
+  if LSAN_REGEX.search(line):
+    for following_line in following_lines:
+      leak = LSAN_LEAK_REGEX.match(following_line)
+      if leak:
+        return '%s-leak' % leak.group(1), []
+    return 'Direct-leak', []
+
+  match = UBSAN_REGEX.search(line)
+  if match:
+    for regex, crash_type in UBSAN_TYPES:
+      if regex.search(match.group(1)):
+        return crash_type, []
+    return 'Undefined-behavior', []
+
+  if CFI_NODIAG_REGEX.search(line):
+    return 'Bad-cast', []
+
+  match = CHECK_REGEX.search(line)
+  if match:
+    return 'CHECK failure', ['%s in %s' % (
+        match.group(2), os.path.basename(match.group(1)))]
+
+  match = V8_FATAL_REGEX.match(line)
+  if match:
+    for following_line in following_lines[:3]:
+      check = V8_CHECK_REGEX.match(following_line)
+      if check:
+        return 'CHECK failure', ['%s in %s' % (
+            check.group(1), os.path.basename(match.group(1)))]
+    return 'Fatal error', []
+
+  match = LIBFUZZER_REGEX.search(line)
+  if match:
+    return match.group(1)[0].upper() + match.group(1)[1:], []
+
+  return None, None
+
+
+def strip_arguments(function):
+  """Removes the parameter list, and qualifiers after it, from a function."""
+  depth = 0
+  for index in range(len(function) - 1, -1, -1):
+    char = function[index]
+    if char == ')':
+      depth += 1
+    elif char == '(':
+      depth -= 1
+      if depth == 0:
+        # Keeps names like `(anonymous namespace)::Foo`.
+        if index > 0 and function[index - 1] != ' ':
+          return function[:index]
+        return function
+  return function
+
+
+def strip_return_type(function):
+  """Removes the return type which demangled template functions start with,
+    e.g. `void std::vector<int>::push_back` becomes
+    `std::vector<int>::push_back`."""
+  depth = 0
+  for index in range(len(function) - 1, -1, -1):
+    char = function[index]
+    if char in ')>]':
+      depth += 1
+    elif char in '(<[':
+      depth -= 1
+    elif (char == ' ' and depth == 0 and
+          not function[:index].endswith('operator')):
+      return function[index + 1:]
+  return function
+
+
+def get_frame_function(frame):
+  """Returns the function of a frame's text after its address, or None if it
+    is unsymbolized or ignored."""
+  match = FRAME_FUNCTION_REGEX.match(frame.strip())
+  if not match:
+    return None
+
+  function, location = match.group(1), match.group(2) or ''
+  if UNSYMBOLIZED_REGEX.match(function):
+    return None
+  if IGNORED_LOCATION_REGEX.search(location):
+    return None
+  function = strip_return_type(strip_arguments(function.strip()))
+  if IGNORED_FUNCTION_REGEX.search(function):
+    return None
+  return function
+
+
+def get_crash_info(output):
+  """Returns (crash_state, crash_type) of the first crash in output, where
+    crash_state is a list of lines. crash_type is empty if no crash is
+    recognized."""
+
+  lines = output.splitlines()
+  crash_type, state = None, []
+  frame_count = 0
+  for index, line in enumerate(lines):
+    if crash_type is None:
+      crash_type, state = get_crash_type(lines, index)
+      continue
+
+    frame = FRAME_REGEX.match(line)
+    if not frame:
+      if frame_count:
+        break
+      continue
+    if frame_count and frame.group(1) == '0':
+      break
+
+    frame_count += 1
+    function = get_frame_function(frame.group(2))
+    if function:
+      state.append(function)
+    if len(state) >= STATE_FRAME_COUNT:
+      break
+
+  if crash_type is None:
+    return [], ''
+  return state[:STATE_FRAME_COUNT], crash_type.replace('\n', ' ')
@@ -84,7 +84,8 @@ def send_log(params, stacktrace=None):
 
 
 def make_basic_params(command, testcase_id, build, current, disable_goma, j,
-                      iterations, disable_xvfb, target_args, edit_mode):
+                      iterations, disable_xvfb, target_args, edit_mode,
+                      refresh, parallel, stats, batch, batch_output):
   """Creates the basic paramater dict."""
 
   return {'testcaseId': testcase_id,
@@ -96,7 +97,12 @@ def make_basic_params(command, testcase_id, build, current, disable_goma, j,
           'iterations': iterations,
           'disableXvfb': disable_xvfb,
           'targetArgs': target_args,
-          'editMode': edit_mode}
+          'editMode': edit_mode,
+          'refresh': refresh,
+          'parallel': parallel,
+          'stats': stats,
+          'batch': batch,
+          'batchOutput': batch_output}
 
 
 def send_start(**kwargs):
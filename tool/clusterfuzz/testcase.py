@@ -17,11 +17,15 @@ import os
 import zipfile
 import logging
 
+from clusterfuzz import cache
 from clusterfuzz import common
+from clusterfuzz import downloader
 
 CLUSTERFUZZ_TESTCASE_URL = (
     'https://%s/v2/testcase-detail/download-testcase?id=%s' %
     (common.DOMAIN_NAME, '%s'))
+# Records how a downloaded testcase can be revalidated and where it is.
+TESTCASE_METADATA_FILE = '.clusterfuzz_testcase.json'
 logger = logging.getLogger('clusterfuzz')
 
 class Testcase(object):
@@ -93,6 +97,7 @@ class Testcase(object):
     self.gn_args = testcase_json['metadata'].get('gn_args')
     if self.gn_args:
       self.gn_args = self.gn_args.rstrip('\n')
+    self.testcase_path = None
 
   def testcase_dir_name(self):
     """Returns a testcases' respective directory."""
@@ -116,25 +121,56 @@ class Testcase(object):
       os.rename(current_testcase_path, true_testcase_path)
       return true_testcase_path
 
+  def get_cached_testcase_path(self, url):
+    """Returns the path of the testcase downloaded by an earlier run if the
+      server confirms that it hasn't changed since, or else None."""
+
+    metadata = common.read_json_file(
+        os.path.join(self.testcase_dir_name(), TESTCASE_METADATA_FILE))
+    if not metadata or not os.path.exists(metadata['testcase_path']):
+      return None
+
+    try:
+      if not downloader.is_unchanged(url, metadata):
+        return None
+    except downloader.DownloadError as e:
+      logger.info('Could not check whether testcase %s changed, using the '
+                  'cached copy.\n%s', self.id, e)
+    return metadata['testcase_path']
+
   def get_testcase_path(self):
-    """Downloads & returns the location of the testcase file."""
+    """Downloads & returns the location of the testcase file.
+
+    The testcase, unzipped if needed, is kept between runs and only
+    downloaded again when the server reports that it changed."""
+
+    if self.testcase_path:
+      return self.testcase_path
 
     testcase_dir = self.testcase_dir_name()
-    filename = os.path.join(testcase_dir, 'testcase%s' % self.file_extension)
-    common.delete_if_exists(testcase_dir)
+    url = CLUSTERFUZZ_TESTCASE_URL % self.id
 
-    logger.info('Downloading testcase data...')
+    filename = self.get_cached_testcase_path(url)
+    if filename:
+      logger.info('Using the cached testcase %s.', self.id)
+    else:
+      common.delete_if_exists(testcase_dir)
+      logger.info('Downloading testcase data...')
 
-    if not os.path.exists(common.CLUSTERFUZZ_TESTCASES_DIR):
-      os.makedirs(common.CLUSTERFUZZ_TESTCASES_DIR)
-    os.makedirs(testcase_dir)
+      if not os.path.exists(common.CLUSTERFUZZ_TESTCASES_DIR):
+        os.makedirs(common.CLUSTERFUZZ_TESTCASES_DIR)
+      os.makedirs(testcase_dir)
 
-    auth_header = common.get_stored_auth_header()
-    args = '--content-disposition --header="Authorization: %s" "%s"' % (
-        auth_header, CLUSTERFUZZ_TESTCASE_URL % self.id)
-    common.execute('wget', args, testcase_dir)
-    downloaded_filename = os.listdir(testcase_dir)[0]
+      info = downloader.download(url, testcase_dir)
+      filename = self.get_true_testcase_path(info['filename'])
+      # Written last, so that an interrupted download isn't reused.
+      common.write_json_file(
+          os.path.join(testcase_dir, TESTCASE_METADATA_FILE),
+          {'etag': info['etag'], 'last_modified': info['last_modified'],
+           'md5': info['md5'], 'testcase_path': filename})
 
-    filename = self.get_true_testcase_path(downloaded_filename)
+    cache.record_testcase(self.id, testcase_dir)
+    cache.evict()
 
+    self.testcase_path = filename
     return filename
@@ -0,0 +1,361 @@
+"""Tests the module for extracting archives while they are downloaded."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import stat
+import struct
+import zipfile
+import zlib
+import StringIO
+import mock
+
+from clusterfuzz import archive
+import helpers
+
+open_url = archive.open_url
+
+
+def make_zip(members):
+  """Returns a zip archive of members, a list of (name, content, mode)."""
+  output = StringIO.StringIO()
+  with zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+    for name, content, mode in members:
+      info = zipfile.ZipInfo(name)
+      info.create_system = archive.UNIX_SYSTEM
+      info.external_attr = mode << 16
+      info.compress_type = zipfile.ZIP_DEFLATED
+      zip_file.writestr(info, content)
+  return output.getvalue()
+
+
+def make_streamed_zip(name, content, method=archive.METHOD_DEFLATED,
+                      crc=None):
+  """Returns an archive of one member whose sizes and crc come after its
+    data, like the archives written to a pipe. The central directory is left
+    empty."""
+  if method == archive.METHOD_DEFLATED:
+    compressor = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS)
+    data = compressor.compress(content) + compressor.flush()
+  else:
+    data = content
+  if crc is None:
+    crc = zlib.crc32(content) & archive.ZIP64_LIMIT
+  return (archive.LOCAL_HEADER.pack(
+      archive.LOCAL_HEADER_SIGNATURE, 20, archive.FLAG_DATA_DESCRIPTOR,
+      method, 0, 0, 0, 0, 0, len(name), 0) + name + data +
+          struct.pack('<IIII', archive.DATA_DESCRIPTOR_SIGNATURE, crc,
+                      len(data), len(content)) +
+          struct.pack('<IHHHHIIH', archive.END_SIGNATURES[0], 0, 0, 0, 0, 0,
+                      0, 0))
+
+
+class ExtractStreamTest(helpers.ExtendedTestCase):
+  """Tests the extract_stream method."""
+
+  def setUp(self):
+    self.setup_fake_filesystem()
+
+  def test_extract(self):
+    """Tests extracting files, directories, modes and symlinks."""
+    content = make_zip([
+        ('abc/', '', stat.S_IFDIR | 0755),
+        ('abc/d8', 'binary', stat.S_IFREG | 0755),
+        ('abc/sub/data', 'data' * 1000, stat.S_IFREG | 0644),
+        ('abc/link', 'sub/data', stat.S_IFLNK | 0777)])
+
+    archive.extract_stream(StringIO.StringIO(content), '/dest')
+
+    with open('/dest/abc/d8') as f:
+      self.assertEqual('binary', f.read())
+    with open('/dest/abc/sub/data') as f:
+      self.assertEqual('data' * 1000, f.read())
+    self.assert_file_permissions('/dest/abc/d8', 755)
+    self.assert_file_permissions('/dest/abc/sub/data', 644)
+    self.assertEqual('sub/data', os.readlink('/dest/abc/link'))
+
+  def test_data_descriptor(self):
+    """Tests extracting a member whose size follows its data."""
+    content = make_streamed_zip('abc/d8', 'binary' * 1000)
+
+    archive.extract_stream(StringIO.StringIO(content), '/dest')
+
+    with open('/dest/abc/d8') as f:
+      self.assertEqual('binary' * 1000, f.read())
+
+  def test_stored_data_descriptor(self):
+    """Tests that a stored member of unknown size can't be streamed."""
+    content = make_streamed_zip('abc/d8', 'binary', archive.METHOD_STORED)
+
+    with self.assertRaises(archive.StreamingNotSupportedError):
+      archive.extract_stream(StringIO.StringIO(content), '/dest')
+
+  def test_bad_crc(self):
+    """Tests that a corrupted member is detected."""
+    content = make_streamed_zip('abc/d8', 'binary', crc=1234)
+
+    with self.assertRaises(archive.BadArchiveError):
+      archive.extract_stream(StringIO.StringIO(content), '/dest')
+
+  def test_truncated(self):
+    """Tests that a truncated archive is detected."""
+    content = make_zip([('abc/d8', 'binary' * 1000, stat.S_IFREG | 0755)])
+
+    with self.assertRaises(archive.BadArchiveError):
+      archive.extract_stream(StringIO.StringIO(content[:100]), '/dest')
+
+  def test_unsafe_path(self):
+    """Tests that members outside of the destination are refused."""
+    content = make_zip([('../evil', 'evil', stat.S_IFREG | 0644)])
+
+    with self.assertRaises(archive.BadArchiveError):
+      archive.extract_stream(StringIO.StringIO(content), '/dest')
+    self.assertFalse(os.path.exists('/evil'))
+
+
+class ParallelInflaterTest(helpers.ExtendedTestCase):
+  """Tests inflating members on a thread pool."""
+
+  def setUp(self):
+    self.setup_fake_filesystem()
+    os.makedirs('/dest')
+    self.inflater = archive.ParallelInflater(2)
+    self.addCleanup(self.inflater.close)
+
+  def submit(self, path, content, crc=None):
+    """Submits the deflated content of a member."""
+    compressor = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS)
+    if crc is None:
+      crc = zlib.crc32(content) & archive.ZIP64_LIMIT
+    self.inflater.submit(
+        compressor.compress(content) + compressor.flush(), path, crc)
+
+  def test_inflate(self):
+    """Tests inflating several members."""
+    self.submit('/dest/a', 'a' * 1000)
+    self.submit('/dest/b', 'b' * 1000)
+    self.inflater.wait()
+
+    self.assertEqual(0, self.inflater.pending_size)
+    for name in ['a', 'b']:
+      with open('/dest/' + name) as f:
+        self.assertEqual(name * 1000, f.read())
+    self.assertFalse(os.path.exists('/dest/a.tmp'))
+
+  def test_bad_crc(self):
+    """Tests that the errors of the threads are raised."""
+    self.submit('/dest/a', 'a' * 1000, crc=1234)
+
+    with self.assertRaises(archive.BadArchiveError):
+      self.inflater.wait()
+    self.assertEqual([], os.listdir('/dest'))
+
+  def test_inflate_in_chunks(self):
+    """Tests inflating a member larger than a chunk."""
+    content = ''.join(chr(i % 256) for i in range(5000)) * 10
+    with mock.patch('clusterfuzz.archive.CHUNK_SIZE', 100):
+      self.submit('/dest/a', content)
+      self.inflater.wait()
+
+    with open('/dest/a') as f:
+      self.assertEqual(content, f.read())
+
+  def test_max_pending_size(self):
+    """Tests waiting for members when too much data is pending."""
+    with mock.patch('clusterfuzz.archive.MAX_PENDING_SIZE', 1):
+      self.submit('/dest/a', 'a' * 1000)
+      self.submit('/dest/b', 'b' * 1000)
+      self.assertEqual(1, len(self.inflater.pending))
+
+
+class ExtractFileTest(helpers.ExtendedTestCase):
+  """Tests the extract_file method."""
+
+  def test_extract(self):
+    """Tests extracting files, modes and symlinks on several threads."""
+    self.setup_fake_filesystem()
+    self.fs.CreateFile('/build.zip', contents=make_zip([
+        ('abc/', '', stat.S_IFDIR | 0755),
+        ('abc/d8', 'binary', stat.S_IFREG | 0755),
+        ('abc/sub/data', 'data' * 1000, stat.S_IFREG | 0644),
+        ('abc/sub/more', 'more', stat.S_IFREG | 0644),
+        ('abc/link', 'sub/data', stat.S_IFLNK | 0777)]))
+
+    archive.extract_file('/build.zip', '/dest', threads=3)
+
+    with open('/dest/abc/sub/data') as f:
+      self.assertEqual('data' * 1000, f.read())
+    with open('/dest/abc/sub/more') as f:
+      self.assertEqual('more', f.read())
+    self.assert_file_permissions('/dest/abc/d8', 755)
+    self.assertEqual('sub/data', os.readlink('/dest/abc/link'))
+
+
+class ExtractPrefixTest(helpers.ExtendedTestCase):
+  """Tests extracting the members under a prefix."""
+
+  def setUp(self):
+    self.setup_fake_filesystem()
+    self.content = make_zip([
+        ('abc/', '', stat.S_IFDIR | 0755),
+        ('abc/d8', 'binary', stat.S_IFREG | 0755),
+        ('abc/sub/data', 'data', stat.S_IFREG | 0644)])
+
+  def test_prefix(self):
+    """Tests that the prefix is removed from the paths."""
+    archive.extract_stream(StringIO.StringIO(self.content), '/dest', 'abc/')
+
+    with open('/dest/d8') as f:
+      self.assertEqual('binary', f.read())
+    self.assertTrue(os.path.exists('/dest/sub/data'))
+    self.assertFalse(os.path.exists('/dest/abc'))
+
+  def test_outside_prefix(self):
+    """Tests that members outside of the prefix are refused."""
+    with self.assertRaises(archive.BadArchiveError):
+      archive.extract_stream(StringIO.StringIO(self.content), '/dest', 'ab/')
+
+  def test_skip_existing(self):
+    """Tests that existing files are kept."""
+    self.fs.CreateFile('/dest/d8', contents='running')
+
+    archive.extract_stream(
+        StringIO.StringIO(self.content), '/dest', 'abc/', skip_existing=True)
+
+    with open('/dest/d8') as f:
+      self.assertEqual('running', f.read())
+    with open('/dest/sub/data') as f:
+      self.assertEqual('data', f.read())
+
+
+class RangeReaderTest(helpers.ExtendedTestCase):
+  """Tests the RangeReader class."""
+
+  def setUp(self):
+    self.setup_fake_filesystem()
+    self.fs.CreateFile('/build.zip', contents='0123456789')
+    helpers.patch(self, ['clusterfuzz.archive.open_url'])
+    self.mock.open_url.side_effect = lambda url, start, end: (
+        open_url(url, start, end))
+    self.reader = archive.RangeReader('/build.zip')
+
+  def test_read(self):
+    """Tests seeking and reading from a read ahead window."""
+    self.reader.seek(2)
+    self.assertEqual('23', self.reader.read(2))
+    self.assertEqual(4, self.reader.tell())
+    self.assertEqual('456789', self.reader.read())
+    self.assertEqual('', self.reader.read(1))
+    self.reader.seek(-3, os.SEEK_END)
+    self.assertEqual('789', self.reader.read(5))
+    self.assert_exact_calls(self.mock.open_url, [
+        mock.call('/build.zip', 0, 9)])
+
+  def test_read_ahead(self):
+    """Tests that reads outside of the window make new requests."""
+    self.reader.seek(2)
+    with mock.patch('clusterfuzz.archive.READ_AHEAD_SIZE', 4):
+      self.assertEqual('2', self.reader.read(1))
+      self.assertEqual('3456', self.reader.read(4))
+      self.reader.seek(-1, os.SEEK_END)
+      self.assertEqual('9', self.reader.read(1))
+    self.assert_exact_calls(self.mock.open_url, [
+        mock.call('/build.zip', 2, 5), mock.call('/build.zip', 3, 6),
+        mock.call('/build.zip', 6, 9)])
+
+
+class ExtractMembersTest(helpers.ExtendedTestCase):
+  """Tests extracting single members with range requests."""
+
+  def setUp(self):
+    self.setup_fake_filesystem()
+    self.fs.CreateFile('/build.zip', contents=make_zip([
+        ('abc/d8', 'binary' * 1000, stat.S_IFREG | 0755),
+        ('abc/other', 'other', stat.S_IFREG | 0644),
+        ('abc/lib/libfoo.so', 'library', stat.S_IFREG | 0644)]))
+
+  def test_extract(self):
+    """Tests extracting some of the members."""
+    reader = archive.RangeReader('file:///build.zip')
+    members = archive.get_members(reader)
+    self.assertEqual(['abc/d8', 'abc/other', 'abc/lib/libfoo.so'],
+                     [member.filename for member in members])
+
+    archive.extract_members(
+        reader, [members[0], members[2]], '/dest', 'abc/')
+
+    with open('/dest/d8') as f:
+      self.assertEqual('binary' * 1000, f.read())
+    with open('/dest/lib/libfoo.so') as f:
+      self.assertEqual('library', f.read())
+    self.assert_file_permissions('/dest/d8', 755)
+    self.assertFalse(os.path.exists('/dest/other'))
+
+
+class OpenUrlTest(helpers.ExtendedTestCase):
+  """Tests the open_url method."""
+
+  def setUp(self):
+    helpers.patch(self, ['subprocess.Popen'])
+    self.proc = mock.Mock(stdout=StringIO.StringIO('content'),
+                          stderr=StringIO.StringIO('error'))
+    self.proc.poll.return_value = 0
+    self.mock.Popen.return_value = self.proc
+
+  def test_local_file(self):
+    """Tests reading a local file."""
+    self.setup_fake_filesystem()
+    with open('/build.zip', 'w') as f:
+      f.write('content')
+
+    with archive.open_url('file:///build.zip') as stream:
+      self.assertEqual('content', stream.read())
+    self.assert_n_calls(0, [self.mock.Popen])
+
+  def test_gsutil(self):
+    """Tests streaming a GCS build through gsutil."""
+    self.proc.wait.return_value = 0
+
+    with archive.open_url(
+        'https://storage.cloud.google.com/abc.zip') as stream:
+      self.assertEqual('content', stream.read())
+    self.assert_exact_calls(self.mock.Popen, [
+        mock.call(['gsutil', 'cat', 'gs://abc.zip'], stdout=mock.ANY,
+                  stderr=mock.ANY)])
+
+  def test_gsutil_range(self):
+    """Tests streaming a range of a GCS build through gsutil."""
+    self.proc.wait.return_value = 0
+
+    with archive.open_url('gs://abc.zip', 10, 19) as stream:
+      self.assertEqual('content', stream.read())
+    self.assert_exact_calls(self.mock.Popen, [
+        mock.call(['gsutil', 'cat', '-r', '10-19', 'gs://abc.zip'],
+                  stdout=mock.ANY, stderr=mock.ANY)])
+
+  def test_local_file_range(self):
+    """Tests reading a range of a local file."""
+    self.setup_fake_filesystem()
+    self.fs.CreateFile('/build.zip', contents='0123456789')
+
+    with archive.open_url('/build.zip', 4, 6) as stream:
+      self.assertEqual('456', stream.read(3))
+
+  def test_gsutil_error(self):
+    """Tests that a failed download raises an error."""
+    self.proc.wait.return_value = 1
+
+    with self.assertRaises(archive.BadArchiveError):
+      with archive.open_url('gs://abc.zip') as stream:
+        stream.read()
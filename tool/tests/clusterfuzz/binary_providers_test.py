@@ -15,10 +15,14 @@
 
 import os
 import json
+import stat
 import mock
 
 import helpers
+import archive_test
+from clusterfuzz import archive
 from clusterfuzz import binary_providers
+from clusterfuzz import cache
 from clusterfuzz import common
 
 
@@ -27,7 +31,7 @@ class BuildRevisionToShaUrlTest(helpers.ExtendedTestCase):
 
   def setUp(self):
     helpers.patch(self, [
-        'urlfetch.fetch'])
+        'clusterfuzz.http_client.get'])
 
   def test_correct_url_building(self):
     """Tests if the SHA url is built correctly"""
@@ -44,27 +48,94 @@ class ShaFromRevisionTest(helpers.ExtendedTestCase):
   """Tests the sha_from_revision method."""
 
   def setUp(self):
-    helpers.patch(self, ['urlfetch.fetch'])
-
-  def test_get_sha_from_response_body(self):
-    """Tests to ensure that the sha is grabbed from the response correctly"""
-
-    self.mock.fetch.return_value = mock.Mock(body=json.dumps({
+    self.setup_fake_filesystem()
+    helpers.patch(self, ['clusterfuzz.http_client.get',
+                         'clusterfuzz.common.execute',
+                         'fcntl.flock'])
+    self.mock.get.return_value = mock.Mock(content=json.dumps({
         'id': 12345,
         'git_sha': '1a2s3d4f',
         'crash_type': 'Bad Crash'}))
 
+  def test_get_sha_from_response_body(self):
+    """Tests to ensure that the sha is grabbed from the response correctly"""
+
     result = binary_providers.sha_from_revision(123456, 'v8/v8')
     self.assertEqual(result, '1a2s3d4f')
+    self.assert_n_calls(0, [self.mock.execute])
+
+  def test_memoized(self):
+    """Tests that a revision is only looked up once."""
+
+    binary_providers.sha_from_revision(123456, 'v8/v8')
+    self.assertEqual(
+        binary_providers.sha_from_revision(123456, 'v8/v8'), '1a2s3d4f')
+    self.assertEqual(len(self.mock.get.call_args_list), 1)
+
+    binary_providers.sha_from_revision(123456, 'chromium/src')
+    self.assertEqual(len(self.mock.get.call_args_list), 2)
+
+  def set_git_output(self, head_position, skipped_output):
+    """Makes git report the position of the head of master, and the output of
+      looking up the skipped commit."""
+    self.mock.execute.side_effect = [
+        (0, 'Fix.\n\nCr-Commit-Position: refs/heads/master@{#%d}\n' % (
+            head_position)),
+        (0, skipped_output)]
+
+  def test_local_checkout(self):
+    """Tests finding the commit in a local checkout."""
+    os.makedirs('/v8')
+    self.set_git_output(
+        123460, 'local_sha\nFix.\n\nCr-Commit-Position: '
+        'refs/heads/master@{#123456}\n')
+
+    result = binary_providers.sha_from_revision(123456, 'v8/v8', '/v8')
+
+    self.assertEqual(result, 'local_sha')
+    self.assert_n_calls(0, [self.mock.get])
+    self.assert_exact_calls(self.mock.execute, [
+        mock.call('git', 'log -1 --format=%B origin/master', '/v8',
+                  print_command=False, print_output=False,
+                  exit_on_error=False),
+        mock.call('git', 'log -1 --first-parent --skip=4 --format=%H%n%B '
+                  'origin/master', '/v8', print_command=False,
+                  print_output=False, exit_on_error=False)])
+
+  def test_local_checkout_behind(self):
+    """Tests that a checkout older than the revision isn't searched."""
+    os.makedirs('/v8')
+    self.set_git_output(123000, '')
+
+    result = binary_providers.sha_from_revision(123456, 'v8/v8', '/v8')
+
+    self.assertEqual(result, '1a2s3d4f')
+    self.assertEqual(len(self.mock.get.call_args_list), 1)
+    self.assertEqual(len(self.mock.execute.call_args_list), 1)
+
+  def test_local_checkout_missing_commit(self):
+    """Tests falling back to cr-rev when the footer doesn't match."""
+    os.makedirs('/v8')
+    self.set_git_output(
+        123460, 'other_sha\nFix.\n\nCr-Commit-Position: '
+        'refs/heads/master@{#123455}\n')
+
+    result = binary_providers.sha_from_revision(123456, 'v8/v8', '/v8')
+
+    self.assertEqual(result, '1a2s3d4f')
+    self.assertEqual(len(self.mock.get.call_args_list), 1)
 
 
 class GetPdfiumShaTest(helpers.ExtendedTestCase):
   """Tests the get_pdfium_sha method."""
 
   def setUp(self):
-    helpers.patch(self, ['urlfetch.fetch'])
-    self.mock.fetch.return_value = mock.Mock(
-        body=('dmFycyA9IHsNCiAgJ3BkZml1bV9naXQnOiAnaHR0cHM6Ly9wZGZpdW0uZ29vZ'
+    self.setup_fake_filesystem()
+    helpers.patch(self, ['clusterfuzz.http_client.get',
+                         'clusterfuzz.common.execute',
+                         'fcntl.flock'])
+    self.mock.get.return_value = mock.Mock(
+        content=('dmFycyA9IHsNCiAgJ3BkZml1bV9naXQnOiAnaHR0cHM6Ly9wZGZpdW0uZ29vZ'
               '2xlc291cmNlLmNvbScsDQogICdwZGZpdW1fcmV2aXNpb24nOiAnNDA5MzAzOW'
               'QxOWY4MzIxNzNlYzU4Y2ZkOWYyZThhYzM5M2E3NjA5MScsDQp9DQo='))
 
@@ -72,58 +143,266 @@ class GetPdfiumShaTest(helpers.ExtendedTestCase):
     """Tests if the method correctly grabs the sha from the b64 download."""
 
     result = binary_providers.get_pdfium_sha('chrome_sha')
-    self.assert_exact_calls(self.mock.fetch, [mock.call(
+    self.assert_exact_calls(self.mock.get, [mock.call(
         ('https://chromium.googlesource.com/chromium/src.git/+/chrome_sha'
          '/DEPS?format=TEXT'))])
     self.assertEqual(result, '4093039d19f832173ec58cfd9f2e8ac393a76091')
 
+    self.assertEqual(binary_providers.get_pdfium_sha('chrome_sha'), result)
+    self.assertEqual(len(self.mock.get.call_args_list), 1)
+
+  def test_local_checkout(self):
+    """Tests reading DEPS from a local Chromium checkout."""
+    os.makedirs('/chromium')
+    self.mock.execute.return_value = (
+        0, "vars = {\n  'pdfium_revision': 'abcdef',\n}\n")
+
+    result = binary_providers.get_pdfium_sha('chrome_sha', '/chromium')
+
+    self.assertEqual(result, 'abcdef')
+    self.assert_n_calls(0, [self.mock.get])
+    self.assert_exact_calls(self.mock.execute, [mock.call(
+        'git', 'show chrome_sha:DEPS', '/chromium', print_command=False,
+        print_output=False, exit_on_error=False)])
+
+
 class DownloadBuildDataTest(helpers.ExtendedTestCase):
   """Tests the download_build_data test."""
 
   def setUp(self):
     helpers.patch(self, ['clusterfuzz.common.execute',
                          'clusterfuzz.common.get_source_directory',
+                         'clusterfuzz.common.file_lock',
+                         'clusterfuzz.cache.claim_build',
+                         'clusterfuzz.cache.link_testcase',
+                         'clusterfuzz.cache.evict',
                          'os.remove',
                          'os.rename'])
 
     self.build_url = 'https://storage.cloud.google.com/abc.zip'
     self.provider = binary_providers.BinaryProvider(1234, self.build_url, 'd8')
+    self.shared_build_dir = os.path.join(
+        common.CLUSTERFUZZ_BUILDS_DIR, cache.get_build_key(self.build_url))
+    self.build_dir = os.path.join(common.CLUSTERFUZZ_BUILDS_DIR, '1234_build')
 
   def test_build_data_already_downloaded(self):
     """Tests the exit when build data is already returned."""
 
     self.setup_fake_filesystem()
-    build_dir = os.path.join(common.CLUSTERFUZZ_BUILDS_DIR, '1234_build')
-    os.makedirs(build_dir)
-    self.provider.build_dir = build_dir
+    os.makedirs(self.build_dir)
     result = self.provider.download_build_data()
-    self.assert_n_calls(0, [self.mock.execute])
-    self.assertEqual(result, build_dir)
+    self.assert_n_calls(0, [self.mock.execute, self.mock.link_testcase])
+    self.assertEqual(result, self.build_dir)
+
+  def test_shared_build_already_downloaded(self):
+    """Tests linking a build that another testcase already downloaded."""
+
+    self.setup_fake_filesystem()
+    os.makedirs(self.shared_build_dir)
+    result = self.provider.download_build_data()
+    self.assert_n_calls(0, [self.mock.execute, self.mock.evict])
+    self.assert_exact_calls(self.mock.file_lock, [
+        mock.call(self.shared_build_dir + '.lock')])
+    self.assert_exact_calls(self.mock.claim_build, [
+        mock.call(self.build_url)])
+    self.assert_exact_calls(self.mock.link_testcase, [
+        mock.call(self.build_url, 1234, self.build_dir)])
+    self.assertEqual(result, self.build_dir)
 
   def test_get_build_data(self):
-    """Tests extracting, moving and renaming the build data.."""
+    """Tests extracting the build while it is downloaded."""
+
+    self.patch_download()
+
+    result = self.provider.download_build_data()
+
+    self.assertEqual(result, self.build_dir)
+    self.assert_exact_calls(self.mock.extract_url, [
+        mock.call(self.build_url, self.partial_dir)])
+    self.assert_n_calls(0, [self.mock.execute])
+    self.assert_exact_calls(self.mock.rename, [
+        mock.call(os.path.join(self.partial_dir, 'abc'),
+                  self.shared_build_dir)])
+    self.assert_exact_calls(self.mock.delete_if_exists, [
+        mock.call(self.partial_dir), mock.call(self.partial_dir)])
+    self.assert_exact_calls(self.mock.chmod, [
+        mock.call(os.path.join(self.shared_build_dir, 'd8'), 64)
+    ])
+    self.assert_exact_calls(self.mock.link_testcase, [
+        mock.call(self.build_url, 1234, self.build_dir)])
+    self.assert_exact_calls(self.mock.evict, [mock.call()])
+
+  def test_get_build_data_unzip(self):
+    """Tests downloading the whole archive when it can't be streamed."""
+
+    self.patch_download()
+    helpers.patch(self, ['clusterfuzz.archive.extract_file'])
+    self.mock.extract_url.side_effect = archive.StreamingNotSupportedError(
+        'reason')
 
-    helpers.patch(self, ['os.path.exists',
+    result = self.provider.download_build_data()
+
+    self.assertEqual(result, self.build_dir)
+    self.assert_exact_calls(self.mock.execute, [
+        mock.call('gsutil', '-o GSUtil:sliced_object_download_threshold=64M '
+                  '-o GSUtil:sliced_object_download_max_components=8 '
+                  'cp gs://abc.zip .', common.CLUSTERFUZZ_CACHE_DIR)])
+    self.assert_exact_calls(self.mock.extract_file, [
+        mock.call(os.path.join(common.CLUSTERFUZZ_CACHE_DIR, 'abc.zip'),
+                  self.partial_dir)])
+    self.assert_exact_calls(self.mock.rename, [
+        mock.call(os.path.join(self.partial_dir, 'abc'),
+                  self.shared_build_dir)])
+    self.assert_exact_calls(self.mock.delete_if_exists, [
+        mock.call(self.partial_dir), mock.call(self.partial_dir),
+        mock.call(self.partial_dir)])
+
+  def test_get_build_data_http(self):
+    """Tests downloading a build which isn't stored on GCS."""
+
+    self.patch_download()
+    helpers.patch(self, ['clusterfuzz.archive.extract_file',
+                         'clusterfuzz.downloader.download'])
+    self.mock.extract_url.side_effect = archive.StreamingNotSupportedError(
+        'reason')
+    self.mock.download.return_value = {
+        'path': os.path.join(common.CLUSTERFUZZ_CACHE_DIR, 'abc.zip')}
+    self.provider.build_url = 'https://builds.example.com/abc.zip'
+
+    self.provider.download_build_data()
+
+    self.assert_n_calls(0, [self.mock.execute])
+    self.assert_exact_calls(self.mock.download, [
+        mock.call('https://builds.example.com/abc.zip',
+                  common.CLUSTERFUZZ_CACHE_DIR)])
+    self.assert_exact_calls(self.mock.extract_file, [
+        mock.call(os.path.join(common.CLUSTERFUZZ_CACHE_DIR, 'abc.zip'),
+                  cache.get_build_dir(self.provider.build_url) + '.partial')])
+
+  def patch_download(self):
+    """Patches the file system calls made by a download."""
+    helpers.patch(self, ['clusterfuzz.archive.extract_url',
+                         'clusterfuzz.common.delete_if_exists',
+                         'os.path.exists',
+                         'os.path.islink',
                          'os.makedirs',
                          'os.chmod',
-                         'os.stat',
-                         'clusterfuzz.binary_providers.os.remove'])
+                         'os.stat'])
     self.mock.stat.return_value = mock.Mock(st_mode=0000)
-    self.mock.exists.side_effect = [False, False]
+    self.mock.exists.return_value = False
+    self.partial_dir = self.shared_build_dir + '.partial'
 
+
+class SelectiveExtractionTest(helpers.ExtendedTestCase):
+  """Tests extracting only the files needed by a binary."""
+
+  def setUp(self):
+    self.setup_fake_filesystem()
+    helpers.patch(self, ['clusterfuzz.elf.get_needed_libraries',
+                         'clusterfuzz.cache.claim_build',
+                         'clusterfuzz.cache.link_testcase',
+                         'clusterfuzz.cache.evict',
+                         'clusterfuzz.cache.update_build_size',
+                         'fcntl.flock'])
+    self.fs.CreateFile('/abc.zip', contents=archive_test.make_zip([
+        ('abc/fuzzer', 'fuzzer', stat.S_IFREG | 0644),
+        ('abc/fuzzer.dict', 'dict', stat.S_IFREG | 0644),
+        ('abc/fuzzer.options', '[libfuzzer]\ndict = shared.dict\n',
+         stat.S_IFREG | 0644),
+        ('abc/shared.dict', 'shared', stat.S_IFREG | 0644),
+        ('abc/dicts/args.dict', 'args', stat.S_IFREG | 0644),
+        ('abc/unused.dict', 'unused', stat.S_IFREG | 0644),
+        ('abc/args.gn', 'args', stat.S_IFREG | 0644),
+        ('abc/lib/libfoo.so', 'foo', stat.S_IFREG | 0755),
+        ('abc/libbar.so', 'bar', stat.S_IFREG | 0755),
+        ('abc/other_fuzzer', 'other', stat.S_IFREG | 0755)]))
+    self.build_url = 'file:///abc.zip'
+    self.shared_build_dir = cache.get_build_dir(self.build_url)
+
+    needed = {
+        os.path.join(self.shared_build_dir, 'fuzzer'): ['libfoo.so',
+                                                        'libc.so.6'],
+        os.path.join(self.shared_build_dir, 'lib', 'libfoo.so'): [
+            'libbar.so'],
+        os.path.join(self.shared_build_dir, 'libbar.so'): ['libfoo.so']}
+    self.mock.get_needed_libraries.side_effect = (
+        lambda path: needed.get(path.replace('.partial', ''), []))
+    self.provider = binary_providers.BinaryProvider(
+        1234, self.build_url, 'fuzzer', selective_extraction=True,
+        reproduction_args='-runs=100 -dict=/mnt/scratch0/args.dict')
+
+    self.all_files = [
+        'args.gn', 'dicts/args.dict', 'fuzzer', 'fuzzer.dict',
+        'fuzzer.options', 'lib/libfoo.so', 'libbar.so', 'other_fuzzer',
+        'shared.dict', 'unused.dict']
+
+  def get_files(self):
+    """Returns the files of the shared build."""
+    files = []
+    for root, _, filenames in os.walk(self.shared_build_dir):
+      files.extend(os.path.relpath(os.path.join(root, filename),
+                                   self.shared_build_dir)
+                   for filename in filenames)
+    return sorted(files)
+
+  def test_download(self):
+    """Tests extracting the binary and the files it needs."""
     self.provider.download_build_data()
 
-    self.assert_exact_calls(self.mock.execute, [
-        mock.call('gsutil', 'cp gs://abc.zip .',
-                  common.CLUSTERFUZZ_CACHE_DIR),
-        mock.call('unzip', '-q %s -d %s' %
-                  (os.path.join(common.CLUSTERFUZZ_CACHE_DIR, 'abc.zip'),
-                   common.CLUSTERFUZZ_BUILDS_DIR),
-                  cwd=common.CLUSTERFUZZ_DIR)])
-    self.assert_exact_calls(self.mock.chmod, [
-        mock.call(os.path.join(
-            common.CLUSTERFUZZ_BUILDS_DIR, '1234_build', 'd8'), 64)
-    ])
+    self.assertEqual(
+        [binary_providers.SELECTIVE_EXTRACTION_MARKER, 'args.gn',
+         'dicts/args.dict', 'fuzzer', 'fuzzer.dict', 'fuzzer.options',
+         'lib/libfoo.so', 'libbar.so', 'shared.dict'],
+        self.get_files())
+    self.assert_file_permissions(
+        os.path.join(self.shared_build_dir, 'fuzzer'), 744)
+    self.assertFalse(os.path.exists(self.shared_build_dir + '.partial'))
+
+  def test_other_binary(self):
+    """Tests extracting another binary into a selectively extracted build."""
+    self.provider.download_build_data()
+    binary_providers.BinaryProvider(
+        1235, self.build_url, 'other_fuzzer').download_build_data()
+
+    self.assertIn('other_fuzzer', self.get_files())
+    self.assert_exact_calls(self.mock.update_build_size, [
+        mock.call(self.build_url)])
+
+  def test_extract_missing_files(self):
+    """Tests extracting the rest of the build when the binary misses files."""
+    self.provider.download_build_data()
+
+    self.assertFalse(self.provider.extract_missing_files('Crashed.'))
+    self.assertTrue(self.provider.extract_missing_files(
+        'error while loading shared libraries: libbaz.so'))
+    self.assertFalse(self.provider.extract_missing_files(
+        'error while loading shared libraries: libbaz.so'))
+
+    self.assertEqual(self.all_files, self.get_files())
+    self.assert_exact_calls(self.mock.update_build_size, [
+        mock.call(self.build_url)])
+
+  def test_extract_missing_files_without_streaming(self):
+    """Tests downloading the whole archive when it can't be streamed."""
+    self.provider.download_build_data()
+    self.fs.CreateFile(os.path.join(self.shared_build_dir, 'libfoo.so'),
+                       contents='kept')
+    extract_url = archive.extract_url
+    helpers.patch(self, [
+        'clusterfuzz.archive.extract_url',
+        'clusterfuzz.binary_providers.BinaryProvider.download_and_extract'])
+    self.mock.extract_url.side_effect = archive.StreamingNotSupportedError(
+        'the size of abc/other_fuzzer is unknown.')
+    self.mock.download_and_extract.side_effect = (
+        lambda _, dest_dir: extract_url(self.build_url, dest_dir))
+
+    self.assertTrue(self.provider.extract_missing_files(
+        'error while loading shared libraries: libbaz.so'))
+
+    self.assertEqual(sorted(self.all_files + ['libfoo.so']), self.get_files())
+    with open(os.path.join(self.shared_build_dir, 'libfoo.so')) as f:
+      self.assertEqual('kept', f.read())
+    self.assertFalse(os.path.exists(self.shared_build_dir + '.partial'))
 
 
 class GetBinaryPathTest(helpers.ExtendedTestCase):
@@ -154,16 +433,22 @@ class V8BuilderGetBuildDirectoryTest(helpers.ExtendedTestCase):
         'clusterfuzz.binary_providers.sha_from_revision',
         'clusterfuzz.binary_providers.V8Builder.checkout_source_by_sha',
         'clusterfuzz.binary_providers.V8Builder.build_target',
+        'clusterfuzz.binary_providers.V8Builder.get_gn_args',
         'clusterfuzz.common.ask',
         'clusterfuzz.binary_providers.V8Builder.get_current_sha',
         'clusterfuzz.common.execute',
-        'clusterfuzz.common.get_source_directory'])
+        'clusterfuzz.common.get_source_directory',
+        'clusterfuzz.cache.record_out_dir',
+        'clusterfuzz.cache.evict_out_dirs'])
 
     self.setup_fake_filesystem()
     self.build_url = 'https://storage.cloud.google.com/abc.zip'
     self.mock.get_current_sha.return_value = '1a2s3d4f5g6h'
+    self.mock.get_gn_args.return_value = 'use_goma = true'
     self.mock.execute.return_value = [0, '']
     self.chrome_source = os.path.join('chrome', 'src', 'dir')
+    self.out_dir = os.path.join(self.chrome_source, 'out',
+                                'clusterfuzz_1a2s3d4f5g6h_571a0c4a0c67')
 
   def test_parameter_not_set_valid_source(self):
     """Tests functionality when build has never been downloaded."""
@@ -176,13 +461,17 @@ class V8BuilderGetBuildDirectoryTest(helpers.ExtendedTestCase):
         testcase, binary_definition, False, '/goma/dir', None, False)
 
     result = provider.get_build_directory()
-    self.assertEqual(result, os.path.join(self.chrome_source, 'out',
-                                          'clusterfuzz_12345_1a2s3d4f5g6h'))
+    self.assertEqual(result, self.out_dir)
+    self.assertEqual(provider.gn_args, 'use_goma = true')
     self.assert_exact_calls(self.mock.download_build_data,
                             [mock.call(provider)])
     self.assert_exact_calls(self.mock.build_target, [mock.call(provider)])
     self.assert_exact_calls(self.mock.checkout_source_by_sha,
                             [mock.call(provider)])
+    self.assert_exact_calls(self.mock.record_out_dir, [
+        mock.call(self.out_dir, self.chrome_source, 12345)])
+    self.assert_exact_calls(self.mock.evict_out_dirs, [
+        mock.call(self.chrome_source)])
     self.assert_n_calls(0, [self.mock.ask])
 
   def test_parameter_not_set_invalid_source(self):
@@ -198,8 +487,7 @@ class V8BuilderGetBuildDirectoryTest(helpers.ExtendedTestCase):
     self.mock.get_source_directory.return_value = self.chrome_source
 
     result = provider.get_build_directory()
-    self.assertEqual(result, os.path.join(self.chrome_source, 'out',
-                                          'clusterfuzz_12345_1a2s3d4f5g6h'))
+    self.assertEqual(result, self.out_dir)
     self.assert_exact_calls(self.mock.download_build_data,
                             [mock.call(provider)])
     self.assert_exact_calls(self.mock.build_target, [mock.call(provider)])
@@ -261,7 +549,11 @@ class BuildTargetTest(helpers.ExtendedTestCase):
         'clusterfuzz.binary_providers.V8Builder.get_goma_cores',
         'clusterfuzz.binary_providers.V8Builder.setup_gn_args',
         'clusterfuzz.binary_providers.sha_from_revision',
+        'clusterfuzz.binary_providers.GenericBuilder.get_checkout_fingerprint',
+        'clusterfuzz.binary_providers.get_checkout_stamp',
+        'clusterfuzz.binary_providers.set_checkout_stamp',
         'clusterfuzz.common.execute'])
+    self.mock.get_checkout_stamp.return_value = None
     self.mock.get_goma_cores.return_value = 120
 
   def test_correct_calls(self):
@@ -293,17 +585,15 @@ class BuildTargetTest(helpers.ExtendedTestCase):
     self.assert_exact_calls(self.mock.setup_gn_args, [mock.call(builder)])
 
 
-class SetupGnArgsTest(helpers.ExtendedTestCase):
-  """Tests the setup_gn_args method."""
+class GetGnArgsTest(helpers.ExtendedTestCase):
+  """Tests the get_gn_args method."""
 
   def setUp(self):
     self.setup_fake_filesystem()
     helpers.patch(self, [
-        'clusterfuzz.common.execute',
         'clusterfuzz.binary_providers.sha_from_revision',
         'cmd_editor.editor.edit'
     ])
-    self.testcase_dir = os.path.expanduser(os.path.join('~', 'test_dir'))
     testcase = mock.Mock(id=1234, build_url='', revision=54321, gn_args=None)
     self.mock_os_environment({'V8_SRC': '/chrome/source/dir'})
     binary_definition = mock.Mock(source_var='V8_SRC')
@@ -314,15 +604,50 @@ class SetupGnArgsTest(helpers.ExtendedTestCase):
       return content + '\nedited'
     self.mock.edit.side_effect = edit
 
-  def test_create_build_dir(self):
-    """Tests setting up the args when the build dir does not exist."""
-
+  def test_downloaded_build_args(self):
+    """Tests reading the args of the downloaded build."""
     build_dir = os.path.join(common.CLUSTERFUZZ_BUILDS_DIR, '1234_build')
     os.makedirs(build_dir)
     with open(os.path.join(build_dir, 'args.gn'), 'w') as f:
       f.write('goma_dir = /not/correct/dir\n')
       f.write('use_goma = true')
 
+    self.assertEqual(self.builder.get_gn_args(),
+                     'goma_dir = "/goma/dir"\nuse_goma = true\nedited')
+
+  def test_testcase_args(self):
+    """Tests using the args of the testcase."""
+    self.builder.gn_args = 'is_asan = true'
+    self.builder.goma_dir = None
+
+    self.assertEqual(self.builder.get_gn_args(),
+                     'is_asan = true\nuse_goma = false\nedited')
+
+
+class SetupGnArgsTest(helpers.ExtendedTestCase):
+  """Tests the setup_gn_args method."""
+
+  def setUp(self):
+    self.setup_fake_filesystem()
+    helpers.patch(self, [
+        'clusterfuzz.common.execute',
+        'clusterfuzz.binary_providers.sha_from_revision',
+        'distutils.spawn.find_executable'])
+    self.mock.find_executable.return_value = '/depot_tools/gn'
+    self.fs.CreateFile('/depot_tools/gn', contents='gn')
+    self.testcase_dir = os.path.expanduser(os.path.join('~', 'test_dir'))
+    testcase = mock.Mock(id=1234, build_url='', revision=54321, gn_args=None)
+    self.mock_os_environment({'V8_SRC': '/chrome/source/dir'})
+    binary_definition = mock.Mock(source_var='V8_SRC')
+    self.builder = binary_providers.V8Builder(
+        testcase, binary_definition, False, '/goma/dir', None, True)
+    self.builder.gn_args = 'goma_dir = "/goma/dir"\nuse_goma = true'
+    self.args_gn_path = os.path.join(self.testcase_dir, 'args.gn')
+    self.gn_gen_call = mock.call(
+        'gn', 'gen --check %s' % self.testcase_dir, '/chrome/source/dir')
+
+  def test_create_build_dir(self):
+    """Tests setting up the args when the build dir does not exist."""
     self.builder.build_directory = self.testcase_dir
     self.builder.setup_gn_args()
 
@@ -330,19 +655,13 @@ class SetupGnArgsTest(helpers.ExtendedTestCase):
         mock.call('gn', 'gen --check %s' % self.testcase_dir,
                   '/chrome/source/dir')])
     with open(os.path.join(self.testcase_dir, 'args.gn'), 'r') as f:
-      self.assertEqual(
-          f.read(), 'goma_dir = "/goma/dir"\nuse_goma = true\nedited')
+      self.assertEqual(f.read(), 'goma_dir = "/goma/dir"\nuse_goma = true')
 
   def test_args_setup(self):
     """Tests to ensure that the args.gn is setup correctly."""
-
     os.makedirs(self.testcase_dir)
     with open(os.path.join(self.testcase_dir, 'args.gn'), 'w') as f:
       f.write('Not correct args.gn')
-    build_dir = os.path.join(common.CLUSTERFUZZ_BUILDS_DIR, '1234_build')
-    os.makedirs(build_dir)
-    with open(os.path.join(build_dir, 'args.gn'), 'w') as f:
-      f.write('goma_dir = /not/correct/dir')
 
     self.builder.build_directory = self.testcase_dir
     self.builder.setup_gn_args()
@@ -351,9 +670,60 @@ class SetupGnArgsTest(helpers.ExtendedTestCase):
         mock.call('gn', 'gen --check %s' % self.testcase_dir,
                   '/chrome/source/dir')])
     with open(os.path.join(self.testcase_dir, 'args.gn'), 'r') as f:
-      self.assertEqual(
-          f.read(), 'goma_dir = "/goma/dir"\nuse_goma = true\nedited')
+      self.assertEqual(f.read(), 'goma_dir = "/goma/dir"\nuse_goma = true')
 
+  def run_gn_gen(self):
+    """Sets up the args once, as gn gen would."""
+    self.builder.build_directory = self.testcase_dir
+    self.builder.setup_gn_args()
+    self.fs.CreateFile(os.path.join(self.testcase_dir, 'build.ninja'))
+    os.utime(self.args_gn_path, (0, 0))
+
+  def test_unchanged(self):
+    """Tests that gn gen is skipped when nothing changed."""
+    self.run_gn_gen()
+
+    self.builder.setup_gn_args()
+
+    self.assert_exact_calls(self.mock.execute, [self.gn_gen_call])
+    self.assertEqual(os.stat(self.args_gn_path).st_mtime, 0)
+
+  def test_build_files_changed(self):
+    """Tests that gn gen is run again, without rewriting the same args, when
+      the root build files changed."""
+    self.run_gn_gen()
+    self.fs.CreateFile('/chrome/source/dir/BUILD.gn', contents='group()')
+
+    self.builder.setup_gn_args()
+
+    self.assert_exact_calls(self.mock.execute, [self.gn_gen_call] * 2)
+    self.assertEqual(os.stat(self.args_gn_path).st_mtime, 0)
+
+  def test_args_changed(self):
+    """Tests that the args are rewritten and gn gen is run again when they
+      changed."""
+    self.run_gn_gen()
+    self.builder.gn_args = 'use_goma = false'
+
+    self.builder.setup_gn_args()
+
+    self.assert_exact_calls(self.mock.execute, [self.gn_gen_call] * 2)
+    with open(self.args_gn_path, 'r') as f:
+      self.assertEqual(f.read(), 'use_goma = false')
+
+  def test_failed_gn_gen(self):
+    """Tests that gn gen is run again when it failed the last time."""
+    self.run_gn_gen()
+    self.mock.execute.side_effect = SystemExit
+    self.builder.gn_args = 'use_goma = false'
+    with self.assertRaises(SystemExit):
+      self.builder.setup_gn_args()
+    self.mock.execute.side_effect = None
+    self.builder.gn_args = 'goma_dir = "/goma/dir"\nuse_goma = true'
+
+    self.builder.setup_gn_args()
+
+    self.assert_n_calls(3, [self.mock.execute])
 
 
 class CheckoutSourceByShaTest(helpers.ExtendedTestCase):
@@ -441,87 +811,72 @@ class V8BuilderOutDirNameTest(helpers.ExtendedTestCase):
     binary_definition = mock.Mock(source_var='V8_SRC')
     self.builder = binary_providers.V8Builder(
         testcase, binary_definition, False, '/goma/dir', None, False)
+    self.builder.gn_args = 'use_goma = true'
 
   def test_clean_dir(self):
     """Tests when no changes have been made to the dir."""
 
     self.mock.execute.side_effect = [[0, self.sha], [0, '']]
     result = self.builder.out_dir_name()
-    self.assertEqual(result, '/source/dir/out/clusterfuzz_1234_1a2s3d4f5g6h')
+    self.assertEqual(
+        result, '/source/dir/out/clusterfuzz_1a2s3d4f5g6h_571a0c4a0c67')
 
   def test_dirty_dir(self):
     """Tests when changes have been made to the dir."""
 
     self.mock.execute.side_effect = [[0, self.sha], [0, 'changes']]
     result = self.builder.out_dir_name()
-    self.assertEqual(result,
-                     '/source/dir/out/clusterfuzz_1234_1a2s3d4f5g6h_dirty')
+    self.assertEqual(
+        result, '/source/dir/out/clusterfuzz_1a2s3d4f5g6h_571a0c4a0c67_dirty')
+
+  def test_args_and_target(self):
+    """Tests that other args or another target use another dir, and that
+      other testcases share it."""
+    self.builder.testcase_id = 5678
+    self.mock.execute.side_effect = [[0, self.sha], [0, '']] * 3
+    self.assertEqual(
+        self.builder.out_dir_name(),
+        '/source/dir/out/clusterfuzz_1a2s3d4f5g6h_571a0c4a0c67')
 
+    self.builder.gn_args = 'use_goma = false'
+    self.assertEqual(
+        self.builder.out_dir_name(),
+        '/source/dir/out/clusterfuzz_1a2s3d4f5g6h_da6a49a25060')
 
-class PdfiumSetupGnArgsTest(helpers.ExtendedTestCase):
-  """Tests the setup_gn_args method inside PdfiumBuilder."""
+    self.builder.gn_args = 'use_goma = true'
+    self.builder.target = 'other'
+    self.assertEqual(
+        self.builder.out_dir_name(),
+        '/source/dir/out/clusterfuzz_1a2s3d4f5g6h_8b03cdf9aa94')
+
+
+class PdfiumGetGnArgsTest(helpers.ExtendedTestCase):
+  """Tests the get_gn_args method inside PdfiumBuilder."""
 
   def setUp(self):
-    self.setup_fake_filesystem()
-    helpers.patch(self, ['clusterfuzz.common.execute',
-                         'clusterfuzz.binary_providers.sha_from_revision',
+    helpers.patch(self, ['clusterfuzz.binary_providers.sha_from_revision',
                          'clusterfuzz.binary_providers.get_pdfium_sha'])
-    self.sha = '1a2s3d4f5g'
     self.mock.sha_from_revision.return_value = 'chrome_sha'
-    self.mock.get_pdfium_sha = self.sha
     testcase = mock.Mock(id=1234, build_url='', revision=54321,
                          gn_args='use_goma = true')
     self.mock_os_environment({'V8_SRC': '/chrome/source/dir'})
     binary_definition = mock.Mock(source_var='V8_SRC')
     self.builder = binary_providers.PdfiumBuilder(
         testcase, binary_definition, False, '/goma/dir', None, False)
-    self.testcase_dir = os.path.expanduser(os.path.join('~', 'test_dir'))
-    self.mock.execute.return_value = (0, '12345')
 
   def test_gn_args(self):
     """Tests the args.gn parsing of extra values."""
-
-    os.makedirs(self.testcase_dir)
-    with open(os.path.join(self.testcase_dir, 'args.gn'), 'w') as f:
-      f.write('Not correct args.gn')
-    build_dir = os.path.join(common.CLUSTERFUZZ_BUILDS_DIR, '1234_build')
-    os.makedirs(build_dir)
-    with open(os.path.join(build_dir, 'args.gn'), 'w') as f:
-      f.write('goma_dir = /not/correct/dir')
-
-    self.builder.build_directory = self.testcase_dir
-    self.builder.setup_gn_args()
-
-    self.assert_exact_calls(self.mock.execute, [mock.call(
-        'gn', 'gen  %s' % self.testcase_dir, '/chrome/source/dir')])
-    with open(os.path.join(self.testcase_dir, 'args.gn'), 'r') as f:
-      self.assertEqual(
-          f.read(),
-          ('goma_dir = "/goma/dir"\n'
-           'pdf_is_standalone = true\n'
-           'use_goma = true'))
+    self.assertEqual(
+        self.builder.get_gn_args(),
+        ('goma_dir = "/goma/dir"\n'
+         'pdf_is_standalone = true\n'
+         'use_goma = true'))
 
   def test_gn_args_no_goma(self):
     """Tests the args.gn parsing of extra values when not using goma."""
-
-    os.makedirs(self.testcase_dir)
-    with open(os.path.join(self.testcase_dir, 'args.gn'), 'w') as f:
-      f.write('Not correct args.gn')
-    build_dir = os.path.join(common.CLUSTERFUZZ_BUILDS_DIR, '1234_build')
-    os.makedirs(build_dir)
-    with open(os.path.join(build_dir, 'args.gn'), 'w') as f:
-      f.write('goma_dir = /not/correct/dir\n')
-      f.write('use_goma = true')
-
-    self.builder.build_directory = self.testcase_dir
     self.builder.goma_dir = None
-    self.builder.setup_gn_args()
-
-    self.assert_exact_calls(self.mock.execute, [mock.call(
-        'gn', 'gen  %s' % self.testcase_dir, '/chrome/source/dir')])
-    with open(os.path.join(self.testcase_dir, 'args.gn'), 'r') as f:
-      self.assertEqual(
-          f.read(), 'pdf_is_standalone = true\nuse_goma = false')
+    self.assertEqual(self.builder.get_gn_args(),
+                     'pdf_is_standalone = true\nuse_goma = false')
 
 
 class PdfiumBuildTargetTest(helpers.ExtendedTestCase):
@@ -531,11 +886,15 @@ class PdfiumBuildTargetTest(helpers.ExtendedTestCase):
     helpers.patch(self, [
         'clusterfuzz.binary_providers.PdfiumBuilder.setup_gn_args',
         'clusterfuzz.common.execute',
+        'clusterfuzz.binary_providers.GenericBuilder.get_checkout_fingerprint',
+        'clusterfuzz.binary_providers.get_checkout_stamp',
+        'clusterfuzz.binary_providers.set_checkout_stamp',
         'clusterfuzz.binary_providers.PdfiumBuilder.get_goma_cores',
         'clusterfuzz.binary_providers.sha_from_revision',
         'clusterfuzz.binary_providers.get_pdfium_sha'])
     self.mock.get_goma_cores.return_value = 120
     self.mock.sha_from_revision.return_value = 'chrome_sha'
+    self.mock.get_checkout_stamp.return_value = None
     testcase = mock.Mock(id=1234, build_url='', revision=54321)
     self.mock_os_environment({'V8_SRC': '/chrome/source/dir'})
     binary_definition = mock.Mock(source_var='V8_SRC')
@@ -564,8 +923,12 @@ class ChromiumBuilderTest(helpers.ExtendedTestCase):
         'clusterfuzz.binary_providers.sha_from_revision',
         'clusterfuzz.common.execute',
         'clusterfuzz.binary_providers.ChromiumBuilder.setup_gn_args',
+        'clusterfuzz.binary_providers.GenericBuilder.get_checkout_fingerprint',
+        'clusterfuzz.binary_providers.get_checkout_stamp',
+        'clusterfuzz.binary_providers.set_checkout_stamp',
         'clusterfuzz.binary_providers.ChromiumBuilder.get_build_directory'])
     self.mock.sha_from_revision.return_value = '1a2s3d4f5g'
+    self.mock.get_checkout_stamp.return_value = None
     self.mock.get_build_directory.return_value = '/chromium/build/dir'
     self.testcase = mock.Mock(id=12345, build_url='', revision=4567)
     self.mock_os_environment({'V8_SRC': '/chrome/src'})
@@ -670,22 +1033,26 @@ class MsanChromiumBuilderTest(helpers.ExtendedTestCase):
     helpers.patch(self, [
         'clusterfuzz.common.execute',
         'clusterfuzz.binary_providers.sha_from_revision',
-        'clusterfuzz.binary_providers.ChromiumBuilder.setup_gn_args'])
+        'clusterfuzz.binary_providers.GenericBuilder.get_checkout_fingerprint',
+        'clusterfuzz.binary_providers.get_checkout_stamp',
+        'clusterfuzz.binary_providers.set_checkout_stamp'])
+    self.mock.get_checkout_stamp.return_value = None
 
     testcase = mock.Mock(id=12345, build_url='', revision=4567,
-                         gn_args='msan_track_origins=2\n')
+                         gn_args='msan_track_origins=1\n')
     self.mock_os_environment({'V8_SRC': '/chrome/src'})
     binary_definition = mock.Mock(source_var='V8_SRC', binary_name='binary')
     self.builder = binary_providers.MsanChromiumBuilder(
         testcase, binary_definition, False, '/goma/dir', None, False)
 
-  def test_setup_gn_args(self):
-    """Test the pre_build_steps method."""
-    self.builder.setup_gn_args()
+  def test_run_hooks(self):
+    """Test that the hooks run once, with the GYP_DEFINES of MSan."""
+    self.builder.current = True
+    self.builder.pre_build_steps()
     self.assert_exact_calls(self.mock.execute, [
         mock.call('gclient', 'runhooks', '/chrome/src',
                   env={'GYP_DEFINES':
-                       'msan=1 msan_track_origins=2 '
+                       'msan=1 msan_track_origins=1 '
                        'use_prebuilt_instrumented_libraries=1'})])
 
 
@@ -696,22 +1063,26 @@ class MsanV8BuilderTest(helpers.ExtendedTestCase):
     helpers.patch(self, [
         'clusterfuzz.common.execute',
         'clusterfuzz.binary_providers.sha_from_revision',
-        'clusterfuzz.binary_providers.V8Builder.setup_gn_args'])
+        'clusterfuzz.binary_providers.GenericBuilder.get_checkout_fingerprint',
+        'clusterfuzz.binary_providers.get_checkout_stamp',
+        'clusterfuzz.binary_providers.set_checkout_stamp'])
+    self.mock.get_checkout_stamp.return_value = None
 
     testcase = mock.Mock(id=12345, build_url='', revision=4567,
-                         gn_args='msan_track_origins=2\n')
+                         gn_args='msan_track_origins=1\n')
     self.mock_os_environment({'V8_SRC': '/chrome/src'})
     binary_definition = mock.Mock(source_var='V8_SRC', binary_name='binary')
     self.builder = binary_providers.MsanV8Builder(
         testcase, binary_definition, False, '/goma/dir', None, False)
 
-  def test_setup_gn_args(self):
-    """Test the pre_build_steps method."""
-    self.builder.setup_gn_args()
+  def test_run_hooks(self):
+    """Test that the hooks run once, with the GYP_DEFINES of MSan."""
+    self.builder.current = True
+    self.builder.pre_build_steps()
     self.assert_exact_calls(self.mock.execute, [
         mock.call('gclient', 'runhooks', '/chrome/src',
                   env={'GYP_DEFINES':
-                       'msan=1 msan_track_origins=2 '
+                       'msan=1 msan_track_origins=1 '
                        'use_prebuilt_instrumented_libraries=1'})])
 
 
@@ -836,3 +1207,78 @@ class ShaExistsTest(helpers.ExtendedTestCase):
 
     self.mock.execute.assert_called_once_with(
         'git', 'cat-file -e SHA', cwd='/dir', exit_on_error=False)
+
+
+class GetMsanGypDefinesTest(helpers.ExtendedTestCase):
+  """Tests get_msan_gyp_defines."""
+
+  def test_default_origins(self):
+    """Tests tracking origins by default."""
+    self.assertEqual(
+        binary_providers.get_msan_gyp_defines({}),
+        'msan=1 msan_track_origins=2 use_prebuilt_instrumented_libraries=1')
+
+
+class ExecuteCheckoutStepTest(helpers.ExtendedTestCase):
+  """Tests execute_checkout_step."""
+
+  def setUp(self):
+    self.setup_fake_filesystem()
+    helpers.patch(self, [
+        'clusterfuzz.common.execute',
+        'clusterfuzz.binary_providers.sha_from_revision',
+        'clusterfuzz.binary_providers.GenericBuilder.get_current_sha',
+        'fcntl.flock'])
+    self.mock.get_current_sha.return_value = 'sha1'
+    self.mock_os_environment({'V8_SRC': '/chrome/src'})
+    self.fs.CreateFile('/chrome/src/DEPS', contents='deps')
+    testcase = mock.Mock(id=12345, build_url='', revision=4567)
+    binary_definition = mock.Mock(source_var='V8_SRC', binary_name='binary')
+    self.builder = binary_providers.ChromiumBuilder(
+        testcase, binary_definition, False, '/goma/dir', None, False)
+
+  def run_sync(self, **kwargs):
+    """Runs gclient sync as a checkout step."""
+    self.builder.execute_checkout_step('sync', 'gclient', 'sync', **kwargs)
+
+  def test_unchanged(self):
+    """Tests that a step which completed for the checkout is skipped."""
+    self.run_sync()
+    self.run_sync()
+
+    self.assert_exact_calls(self.mock.execute, [
+        mock.call('gclient', 'sync', '/chrome/src')])
+
+  def test_changed(self):
+    """Tests that a step runs again when HEAD, DEPS or GYP_DEFINES change."""
+    self.run_sync()
+    self.mock.get_current_sha.return_value = 'sha2'
+    self.run_sync()
+    self.fs.RemoveObject('/chrome/src/DEPS')
+    self.fs.CreateFile('/chrome/src/DEPS', contents='new deps')
+    self.run_sync()
+    self.run_sync(env={'GYP_DEFINES': 'msan=1'})
+    self.run_sync(env={'GYP_DEFINES': 'msan=1'})
+
+    self.assert_n_calls(4, [self.mock.execute])
+
+  def test_steps(self):
+    """Tests that the steps of a checkout are recorded separately."""
+    self.run_sync()
+    self.builder.run_hooks()
+    self.builder.run_hooks()
+
+    self.assert_exact_calls(self.mock.execute, [
+        mock.call('gclient', 'sync', '/chrome/src'),
+        mock.call('gclient', 'runhooks', '/chrome/src')])
+
+  def test_failed(self):
+    """Tests that a step which failed isn't skipped next time."""
+    self.mock.execute.side_effect = SystemExit
+    with self.assertRaises(SystemExit):
+      self.run_sync()
+    self.mock.execute.side_effect = None
+
+    self.run_sync()
+
+    self.assert_n_calls(2, [self.mock.execute])
@@ -0,0 +1,317 @@
+"""Test the cache module."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import errno
+import fcntl
+import mock
+
+import helpers
+from clusterfuzz import cache
+from clusterfuzz import common
+
+
+class GetBuildDirTest(helpers.ExtendedTestCase):
+  """Tests get_build_key and get_build_dir."""
+
+  def test_same_url(self):
+    """Tests that a build URL always maps to the same directory."""
+    self.assertEqual(
+        os.path.join(common.CLUSTERFUZZ_BUILDS_DIR,
+                     'a2cc2b4b342404ab1475dad3e63743cbd159a6cf'),
+        cache.get_build_dir('https://storage.cloud.google.com/abc.zip'))
+    self.assertNotEqual(
+        cache.get_build_dir('https://storage.cloud.google.com/abc.zip'),
+        cache.get_build_dir('https://storage.cloud.google.com/abd.zip'))
+
+
+class ParseSizeTest(helpers.ExtendedTestCase):
+  """Tests parse_size and get_max_size."""
+
+  def test_parse(self):
+    """Tests parsing sizes with and without units."""
+    self.assertEqual(1234, cache.parse_size('1234'))
+    self.assertEqual(1234, cache.parse_size(1234))
+    self.assertEqual(512 * 1024, cache.parse_size('512k'))
+    self.assertEqual(1536 * 1024 ** 2, cache.parse_size('1.5G'))
+
+  def test_max_size(self):
+    """Tests configuring the budget through the environment."""
+    self.mock_os_environment({'CF_CACHE_MAX_SIZE': '10M'})
+    self.assertEqual(10 * 1024 ** 2, cache.get_max_size())
+
+    self.mock_os_environment({})
+    self.assertEqual(50 * 1024 ** 3, cache.get_max_size())
+
+
+class LinkTestcaseTest(helpers.ExtendedTestCase):
+  """Tests link_testcase."""
+
+  def setUp(self):
+    self.setup_fake_filesystem()
+    helpers.patch(self, ['fcntl.flock', 'time.time', 'psutil.pid_exists'])
+    self.mock.time.return_value = 100
+    self.mock.pid_exists.return_value = True
+    self.build_url = 'https://storage.cloud.google.com/abc.zip'
+    self.build_dir = cache.get_build_dir(self.build_url)
+    self.fs.CreateFile(os.path.join(self.build_dir, 'd8'), contents='a' * 10)
+
+  def test_link(self):
+    """Tests linking two testcases to the same build."""
+    link_1 = os.path.join(common.CLUSTERFUZZ_BUILDS_DIR, '1_build')
+    link_2 = os.path.join(common.CLUSTERFUZZ_BUILDS_DIR, '2_build')
+
+    cache.link_testcase(self.build_url, 1, link_1)
+    cache.link_testcase(self.build_url, 2, link_2)
+    cache.link_testcase(self.build_url, 2, link_2)
+
+    self.assertEqual(self.build_dir, os.readlink(link_1))
+    self.assertEqual(self.build_dir, os.readlink(link_2))
+    self.assertEqual(
+        {cache.get_build_key(self.build_url): {
+            'build_url': self.build_url,
+            'testcases': {'1': link_1, '2': link_2},
+            'path': self.build_dir,
+            'size': 10,
+            'last_access': 100,
+            'pids': [os.getpid()]}},
+        cache.get_index()['builds'])
+
+  def test_replace_dangling_link(self):
+    """Tests replacing a link to a build that no longer exists."""
+    link = os.path.join(common.CLUSTERFUZZ_BUILDS_DIR, '1_build')
+    os.symlink('/does/not/exist', link)
+
+    cache.link_testcase(self.build_url, 1, link)
+
+    self.assertEqual(self.build_dir, os.readlink(link))
+
+
+class ClaimBuildTest(helpers.ExtendedTestCase):
+  """Tests claim_build."""
+
+  def setUp(self):
+    self.setup_fake_filesystem()
+    helpers.patch(self, ['fcntl.flock', 'time.time', 'psutil.pid_exists',
+                         'atexit.register'])
+    self.mock.time.return_value = 100
+    self.mock.pid_exists.return_value = True
+    self.build_url = 'https://storage.cloud.google.com/abc.zip'
+    self.build_dir = cache.get_build_dir(self.build_url)
+
+  def test_claim_before_download(self):
+    """Tests that a build is in use before it's downloaded and linked."""
+    cache.claim_build(self.build_url)
+
+    entry = cache.get_index()['builds'][cache.get_build_key(self.build_url)]
+    self.assertTrue(cache.is_in_use(entry))
+    self.assertNotIn('size', entry)
+
+    self.fs.CreateFile(os.path.join(self.build_dir, 'd8'), contents='abc')
+    cache.link_testcase(self.build_url, 1, '/1_build')
+
+    entry = cache.get_index()['builds'][cache.get_build_key(self.build_url)]
+    self.assertEqual(3, entry['size'])
+    self.assertEqual([os.getpid()], entry['pids'])
+
+
+class UpdateBuildSizeTest(helpers.ExtendedTestCase):
+  """Tests the update_build_size method."""
+
+  def setUp(self):
+    self.setup_fake_filesystem()
+    helpers.patch(self, ['fcntl.flock'])
+
+  def test_update(self):
+    """Tests recomputing the size of a build."""
+    build_url = 'https://storage.cloud.google.com/abc.zip'
+    build_dir = cache.get_build_dir(build_url)
+    self.fs.CreateFile(os.path.join(build_dir, 'd8'), contents='abcd')
+    common.write_json_file(cache.INDEX_FILE, {'builds': {
+        cache.get_build_key(build_url): {'path': build_dir, 'size': 1}}})
+
+    cache.update_build_size(build_url)
+    cache.update_build_size('https://storage.cloud.google.com/other.zip')
+    self.assertEqual(4, cache.get_index()['builds'][
+        cache.get_build_key(build_url)]['size'])
+
+
+class RecordTestcaseTest(helpers.ExtendedTestCase):
+  """Tests record_testcase and release."""
+
+  def setUp(self):
+    self.setup_fake_filesystem()
+    helpers.patch(self, ['fcntl.flock', 'time.time', 'psutil.pid_exists'])
+    self.mock.time.return_value = 100
+    self.mock.pid_exists.side_effect = lambda pid: pid == os.getpid()
+    self.testcase_dir = os.path.join(
+        common.CLUSTERFUZZ_TESTCASES_DIR, '1_testcase')
+    self.fs.CreateFile(
+        os.path.join(self.testcase_dir, 'testcase.js'), contents='abc')
+
+  def test_register_release(self):
+    """Tests that only processes using the cache release it at exit."""
+    helpers.patch(self, ['atexit.register'])
+    self.addCleanup(setattr, cache, 'RELEASING_PIDS', cache.RELEASING_PIDS)
+    cache.RELEASING_PIDS = set()
+
+    cache.record_testcase(1, self.testcase_dir)
+    cache.record_testcase(1, self.testcase_dir)
+
+    self.assert_exact_calls(self.mock.register, [mock.call(cache.release)])
+
+  def test_record_and_release(self):
+    """Tests that dead pids are dropped and the current one is released."""
+    common.write_json_file(cache.INDEX_FILE, {'testcases': {'1': {
+        'path': self.testcase_dir, 'size': 1, 'last_access': 0,
+        'pids': [-1]}}})
+
+    cache.record_testcase(1, self.testcase_dir)
+    entry = cache.get_index()['testcases']['1']
+    self.assertEqual([os.getpid()], entry['pids'])
+    self.assertEqual(3, entry['size'])
+    self.assertTrue(cache.is_in_use(entry))
+
+    cache.release()
+    entry = cache.get_index()['testcases']['1']
+    self.assertEqual([], entry['pids'])
+    self.assertFalse(cache.is_in_use(entry))
+
+
+class EvictTest(helpers.ExtendedTestCase):
+  """Tests evict."""
+
+  def setUp(self):
+    self.setup_fake_filesystem()
+    helpers.patch(self, ['fcntl.flock', 'psutil.pid_exists'])
+    self.mock.pid_exists.side_effect = lambda pid: pid == 42
+    self.old_build = os.path.join(common.CLUSTERFUZZ_BUILDS_DIR, 'old')
+    self.used_build = os.path.join(common.CLUSTERFUZZ_BUILDS_DIR, 'used')
+    self.new_build = os.path.join(common.CLUSTERFUZZ_BUILDS_DIR, 'new')
+    self.old_link = os.path.join(common.CLUSTERFUZZ_BUILDS_DIR, '1_build')
+    self.testcase_dir = os.path.join(
+        common.CLUSTERFUZZ_TESTCASES_DIR, '1_testcase')
+    for path in [self.old_build, self.used_build, self.new_build,
+                 self.testcase_dir]:
+      os.makedirs(path)
+    os.symlink(self.old_build, self.old_link)
+    common.write_json_file(cache.INDEX_FILE, {
+        'builds': {
+            'old': {'path': self.old_build, 'size': 100, 'last_access': 1,
+                    'pids': [7], 'testcases': {'1': self.old_link}},
+            'used': {'path': self.used_build, 'size': 100, 'last_access': 2,
+                     'pids': [42], 'testcases': {}},
+            'new': {'path': self.new_build, 'size': 100, 'last_access': 4,
+                    'pids': [], 'testcases': {}}},
+        'testcases': {
+            '1': {'path': self.testcase_dir, 'size': 10, 'last_access': 3,
+                  'pids': []}},
+        'out_dirs': {
+            '/src/out/a': {'path': '/src/out/a', 'source_dir': '/src',
+                           'last_access': 0, 'pids': [], 'testcases': []}}})
+
+  def test_under_budget(self):
+    """Tests that nothing is evicted when the cache fits."""
+    self.assertEqual([], cache.evict(310))
+    self.assertTrue(os.path.exists(self.old_build))
+
+  def test_evict_lru(self):
+    """Tests evicting the least recently used entries that aren't in use."""
+    self.assertEqual(
+        [self.old_build, self.testcase_dir], cache.evict(200))
+
+    for path in [self.old_build, self.old_link, self.testcase_dir]:
+      self.assertFalse(os.path.lexists(path))
+    for path in [self.used_build, self.new_build]:
+      self.assertTrue(os.path.exists(path))
+    index = cache.get_index()
+    self.assertEqual(['new', 'used'], sorted(index['builds']))
+    self.assertEqual({}, index['testcases'])
+    self.assertEqual(['/src/out/a'], sorted(index['out_dirs']))
+
+  def test_locked_build(self):
+    """Tests that a build whose lock is held isn't evicted."""
+    def flock(_, operation):
+      if operation & fcntl.LOCK_NB:
+        raise IOError(errno.EAGAIN, 'Busy')
+    self.mock.flock.side_effect = flock
+
+    self.assertEqual([self.testcase_dir], cache.evict(200))
+
+    for path in [self.old_build, self.old_link]:
+      self.assertTrue(os.path.lexists(path))
+    self.assertEqual(['new', 'old', 'used'],
+                     sorted(cache.get_index()['builds']))
+
+  def test_default_budget(self):
+    """Tests using the configured budget."""
+    self.mock_os_environment({'CF_CACHE_MAX_SIZE': '300'})
+    self.assertEqual([self.old_build], cache.evict())
+
+
+class OutDirsTest(helpers.ExtendedTestCase):
+  """Tests record_out_dir and evict_out_dirs."""
+
+  def setUp(self):
+    self.setup_fake_filesystem()
+    helpers.patch(self, ['fcntl.flock', 'psutil.pid_exists', 'atexit.register',
+                         'time.time'])
+    self.mock.pid_exists.side_effect = lambda pid: pid == os.getpid()
+    self.out_dirs = ['/src/out/%d' % i for i in range(4)]
+    for path in self.out_dirs + ['/other/out/0']:
+      os.makedirs(path)
+
+  def record(self, out_dir, source_dir, testcase_id, timestamp):
+    """Records the use of out_dir at timestamp by another process."""
+    self.mock.time.return_value = timestamp
+    cache.record_out_dir(out_dir, source_dir, testcase_id)
+    cache.release()
+
+  def test_record(self):
+    """Tests that the testcases sharing an out dir are recorded."""
+    self.record('/src/out/0', '/src', 1, 10)
+    self.record('/src/out/0', '/src', 2, 20)
+    self.record('/src/out/0', '/src', 1, 30)
+
+    self.assertEqual(cache.get_index()['out_dirs'], {
+        '/src/out/0': {'path': '/src/out/0', 'source_dir': '/src',
+                       'testcases': ['1', '2'], 'last_access': 30,
+                       'pids': []}})
+
+  def test_evict(self):
+    """Tests evicting the least recently used out dirs of a checkout, except
+      those in use."""
+    for i, out_dir in enumerate(self.out_dirs):
+      self.record(out_dir, '/src', i, i)
+    self.record('/other/out/0', '/other', 9, 0)
+    self.mock.time.return_value = 0
+    cache.record_out_dir('/src/out/0', '/src', 0)
+
+    self.assertEqual(['/src/out/1'], cache.evict_out_dirs('/src', 2))
+
+    self.assertFalse(os.path.exists('/src/out/1'))
+    for path in ['/src/out/0', '/src/out/2', '/src/out/3', '/other/out/0']:
+      self.assertTrue(os.path.exists(path))
+    self.assertEqual(
+        ['/other/out/0', '/src/out/0', '/src/out/2', '/src/out/3'],
+        sorted(cache.get_index()['out_dirs']))
+
+  def test_default_count(self):
+    """Tests using the configured number of out dirs."""
+    self.mock_os_environment({'CF_MAX_OUT_DIRS': '3'})
+    for i, out_dir in enumerate(self.out_dirs):
+      self.record(out_dir, '/src', i, i)
+
+    self.assertEqual(['/src/out/0'], cache.evict_out_dirs('/src'))
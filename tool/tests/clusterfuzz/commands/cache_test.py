@@ -0,0 +1,128 @@
+"""Test the module for the 'cache' command"""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import mock
+
+from clusterfuzz.commands import cache
+import helpers
+
+
+class FormatSizeTest(helpers.ExtendedTestCase):
+  """Tests the format_size method."""
+
+  def test_format(self):
+    """Tests formatting sizes."""
+    self.assertEqual('512.0', cache.format_size(512))
+    self.assertEqual('1.5K', cache.format_size(1536))
+    self.assertEqual('2.0G', cache.format_size(2 * 1024 ** 3))
+    self.assertEqual('3.0T', cache.format_size(3 * 1024 ** 4))
+
+
+class PruneTest(helpers.ExtendedTestCase):
+  """Tests the prune method."""
+
+  def setUp(self):
+    helpers.patch(self, ['clusterfuzz.cache.evict',
+                         'clusterfuzz.cache.get_max_size'])
+    self.mock.evict.return_value = ['/path']
+    self.mock.get_max_size.return_value = 100
+
+  def test_default_size(self):
+    """Tests pruning to the configured budget."""
+    cache.execute('prune', None, None, 4)
+    self.assert_exact_calls(self.mock.evict, [mock.call(100)])
+
+  def test_size(self):
+    """Tests pruning to a given size."""
+    cache.execute('prune', '2K', None, 4)
+    self.assert_exact_calls(self.mock.evict, [mock.call(2048)])
+
+
+class ListEntriesTest(helpers.ExtendedTestCase):
+  """Tests the list_entries method."""
+
+  def setUp(self):
+    helpers.patch(self, ['clusterfuzz.cache.get_index',
+                         'clusterfuzz.cache.get_max_size',
+                         'clusterfuzz.cache.get_max_out_dirs',
+                         'clusterfuzz.cache.is_in_use',
+                         'clusterfuzz.commands.cache.logger'])
+    self.mock.get_max_size.return_value = 4096
+    self.mock.get_max_out_dirs.return_value = 3
+    self.mock.is_in_use.return_value = False
+    self.mock.get_index.return_value = {
+        'builds': {'key': {'build_url': 'gs://abc.zip', 'size': 1024,
+                           'last_access': 0, 'testcases': {'1': '/l'}}},
+        'testcases': {'1': {'size': 1024, 'last_access': 0}},
+        'out_dirs': {'/src/out/a': {'path': '/src/out/a', 'last_access': 0,
+                                    'testcases': ['2', '1']}}}
+
+  def test_list(self):
+    """Tests logging the total size and the out dirs."""
+    cache.execute('list', None, None, 4)
+    self.mock.logger.info.assert_any_call(
+        'Total: %s (budget: %s)', '2.0K', '4.0K')
+    self.mock.logger.info.assert_called_with(
+        '  %s  %s%s\n    testcases: %s', mock.ANY, '/src/out/a', '', '1, 2')
+
+
+class PrewarmTest(helpers.ExtendedTestCase):
+  """Tests the prewarm method."""
+
+  def setUp(self):
+    helpers.patch(self, [
+        'clusterfuzz.commands.reproduce.get_binary_definition',
+        'clusterfuzz.commands.reproduce.get_downloaded_binary',
+        'clusterfuzz.commands.reproduce.get_testcase_info',
+        'clusterfuzz.testcase.Testcase',
+        'clusterfuzz.commands.cache.logger'])
+    self.mock.get_testcase_info.side_effect = lambda i: {'id': i}
+    self.download_build_data = (
+        self.mock.get_downloaded_binary.return_value.download_build_data)
+    self.mock.Testcase.return_value = mock.Mock(
+        id=1, job_type='linux_asan_d8', build_url='gs://abc.zip')
+
+  def test_prewarm(self):
+    """Tests downloading several testcases."""
+    cache.execute('prewarm', None, ['1', '2', '3'], 2)
+
+    self.mock.get_testcase_info.assert_has_calls([
+        mock.call('1'), mock.call('2'), mock.call('3')], any_order=True)
+    self.assertEqual(3, self.download_build_data.call_count)
+    self.mock.logger.info.assert_called_with(
+        'Prewarmed %d of %d testcases.', 3, 3)
+
+  def test_failure(self):
+    """Tests that a failing testcase doesn't stop the others."""
+    self.download_build_data.side_effect = [SystemExit, None]
+    cache.execute('prewarm', None, ['1', '2'], 1)
+
+    self.assertEqual(2, self.download_build_data.call_count)
+    self.mock.logger.info.assert_called_with(
+        'Prewarmed %d of %d testcases.', 1, 2)
+
+  def test_first_testcase_invalid(self):
+    """Tests that failing to get the first details doesn't stop the others."""
+    def get_testcase_info(testcase_id):
+      if testcase_id == '1':
+        raise SystemExit
+      return {'id': testcase_id}
+    self.mock.get_testcase_info.side_effect = get_testcase_info
+
+    cache.execute('prewarm', None, ['1', '2', '3'], 2)
+
+    self.assertEqual(2, self.download_build_data.call_count)
+    self.mock.logger.info.assert_called_with(
+        'Prewarmed %d of %d testcases.', 2, 3)
@@ -75,7 +75,8 @@ class ExecuteTest(helpers.ExtendedTestCase):
       reproduce.execute(testcase_id='1234', current=False, build='standalone',
                         disable_goma=False, j=None, iterations=None,
                         disable_xvfb=False, target_args='--test',
-                        edit_mode=True)
+                        edit_mode=True, refresh=False, parallel=1, stats=None,
+                      batch=None, batch_output=None)
 
   def test_unsupported_job(self):
     """Tests to ensure an exception is thrown with an unsupported job type."""
@@ -88,7 +89,8 @@ class ExecuteTest(helpers.ExtendedTestCase):
       reproduce.execute(testcase_id='1234', current=False, build='standalone',
                         disable_goma=False, j=None, iterations=None,
                         disable_xvfb=False, target_args='--test',
-                        edit_mode=True)
+                        edit_mode=True, refresh=False, parallel=1, stats=None,
+                      batch=None, batch_output=None)
 
   def test_download_no_defined_binary(self):
     """Test what happens when no binary name is defined."""
@@ -112,13 +114,17 @@ class ExecuteTest(helpers.ExtendedTestCase):
     reproduce.execute(testcase_id='1234', current=False, build='download',
                       disable_goma=False, j=None, iterations=None,
                       disable_xvfb=False, target_args='--test',
-                      edit_mode=True)
+                      edit_mode=True, refresh=False, parallel=1, stats=None,
+                      batch=None, batch_output=None)
 
-    self.assert_exact_calls(self.mock.get_testcase_info, [mock.call('1234')])
+    self.assert_exact_calls(self.mock.get_testcase_info, [
+        mock.call('1234', refresh=False)])
     self.assert_n_calls(0, [self.mock.ensure_goma])
     self.assert_exact_calls(self.mock.Testcase, [mock.call(self.response)])
-    self.assert_exact_calls(self.mock.DownloadedBinary,
-                            [mock.call(1234, 'chrome_build_url', 'binary')])
+    self.assert_exact_calls(self.mock.DownloadedBinary, [
+        mock.call(1234, 'chrome_build_url', 'binary',
+                  selective_extraction=False,
+                  reproduction_args='--always-opt')])
     self.assert_exact_calls(
         self.mock.get_binary_definition.return_value.reproducer,
         [mock.call(self.mock.DownloadedBinary.return_value, testcase, 'ASAN',
@@ -146,13 +152,21 @@ class ExecuteTest(helpers.ExtendedTestCase):
     reproduce.execute(testcase_id='1234', current=False, build='download',
                       disable_goma=False, j=None, iterations=None,
                       disable_xvfb=False, target_args='--test',
-                      edit_mode=True)
+                      edit_mode=True, refresh=False, parallel=1, stats=None,
+                      batch=None, batch_output=None)
 
-    self.assert_exact_calls(self.mock.get_testcase_info, [mock.call('1234')])
+    self.assert_exact_calls(self.mock.get_testcase_info, [
+        mock.call('1234', refresh=False)])
     self.assert_n_calls(0, [self.mock.ensure_goma])
     self.assert_exact_calls(self.mock.Testcase, [mock.call(self.response)])
-    self.assert_exact_calls(self.mock.DownloadedBinary,
-                            [mock.call(1234, 'chrome_build_url', 'binary')])
+    self.assert_exact_calls(self.mock.DownloadedBinary, [
+        mock.call(1234, 'chrome_build_url', 'binary',
+                  selective_extraction=False,
+                  reproduction_args=testcase.reproduction_args)])
+    self.assert_exact_calls(
+        self.mock.DownloadedBinary.return_value.download_build_data,
+        [mock.call()])
+    self.assert_exact_calls(testcase.get_testcase_path, [mock.call()])
     self.assert_exact_calls(
         self.mock.get_binary_definition.return_value.reproducer,
         [mock.call(self.mock.DownloadedBinary.return_value, testcase, 'ASAN',
@@ -175,31 +189,145 @@ class ExecuteTest(helpers.ExtendedTestCase):
     self.mock.Testcase.return_value = testcase
     reproduce.execute(testcase_id='1234', current=False, build='standalone',
                       disable_goma=False, j=22, iterations=None,
-                      disable_xvfb=False, target_args='--test', edit_mode=True)
+                      disable_xvfb=False, target_args='--test', edit_mode=True,
+                      refresh=False, parallel=1, stats=None,
+                      batch=None, batch_output=None)
 
-    self.assert_exact_calls(self.mock.get_testcase_info, [mock.call('1234')])
+    self.assert_exact_calls(self.mock.get_testcase_info, [
+        mock.call('1234', refresh=False)])
     self.assert_exact_calls(self.mock.ensure_goma, [mock.call()])
     self.assert_exact_calls(self.mock.Testcase, [mock.call(self.response)])
     self.assert_exact_calls(
         self.mock.get_binary_definition.return_value.builder, [
             mock.call(testcase, self.mock.get_binary_definition.return_value,
-                      False, '/goma/dir', 22, True)])
+                      False, None, 22, True)])
+    self.assertEqual(
+        (self.mock.get_binary_definition.return_value.builder.return_value
+         .goma_dir), '/goma/dir')
+    self.assert_exact_calls(testcase.get_testcase_path, [mock.call()])
     self.assert_exact_calls(
         self.mock.get_binary_definition.return_value.reproducer,
         [mock.call(
             self.mock.get_binary_definition.return_value.builder.return_value,
             testcase, 'ASAN', False, '--test', True)])
+    self.assert_exact_calls(
+        (self.mock.get_binary_definition.return_value.reproducer.return_value
+         .reproduce), [mock.call(None, 1)])
+    self.assert_n_calls(0, [
+        (self.mock.get_binary_definition.return_value.reproducer.return_value
+         .reproduce_stats)])
+
+
+class PrefetchTest(helpers.ExtendedTestCase):
+  """Tests prefetch."""
+
+  def setUp(self):
+    helpers.patch(self, ['clusterfuzz.commands.reproduce.ensure_goma'])
+    self.testcase = mock.Mock()
+    self.definition = mock.Mock()
+    self.builder = self.definition.builder.return_value
+
+  def test_build(self):
+    """Tests that the build needed for the GN args is downloaded."""
+    self.mock.ensure_goma.return_value = '/goma/dir'
+    self.builder.gn_args = None
+
+    result = reproduce.prefetch(self.testcase, self.definition, 'chromium',
+                                True, False, 10, False)
+
+    self.assertEqual(result, self.builder)
+    self.assertEqual(result.goma_dir, '/goma/dir')
+    self.assert_exact_calls(self.builder.download_build_data, [mock.call()])
+    self.assert_exact_calls(self.testcase.get_testcase_path, [mock.call()])
+
+  def test_build_with_gn_args(self):
+    """Tests that the build isn't downloaded when the GN args are known."""
+    self.builder.gn_args = 'is_asan = true'
+
+    result = reproduce.prefetch(self.testcase, self.definition, 'chromium',
+                                True, True, 10, False)
+
+    self.assertEqual(result, self.builder)
+    self.assert_exact_calls(self.definition.builder, [
+        mock.call(self.testcase, self.definition, True, None, 10, False)])
+    self.assert_n_calls(0, [self.builder.download_build_data,
+                            self.mock.ensure_goma])
+
+  def test_error(self):
+    """Tests that the error of a step is raised."""
+    self.mock.ensure_goma.side_effect = common.GomaNotInstalledError()
+
+    with self.assertRaises(common.GomaNotInstalledError):
+      reproduce.prefetch(self.testcase, self.definition, 'chromium', True,
+                         False, 10, False)
+
+
+class TestcaseInfoCacheTest(helpers.ExtendedTestCase):
+  """Tests caching the testcase information between runs."""
+
+  def setUp(self):
+    self.setup_fake_filesystem()
+    helpers.patch(self, ['clusterfuzz.commands.reproduce.send_request',
+                         'time.time'])
+    self.mock.send_request.return_value = mock.Mock(text='{"id": 1}')
+    self.mock.time.return_value = 1000.0
+    reproduce.get_testcase_info('1234')
+    self.mock.send_request.reset_mock()
+
+  def test_cached(self):
+    """Tests that fresh information isn't downloaded again."""
+    self.mock.time.return_value = (
+        1000.0 + reproduce.DEFAULT_TESTCASE_INFO_TTL - 1)
+
+    self.assertEqual(reproduce.get_testcase_info('1234'), {'id': 1})
+    self.assert_n_calls(0, [self.mock.send_request])
+
+  def test_expired(self):
+    """Tests that information older than the TTL is downloaded again."""
+    self.mock.time.return_value = 1000.0 + reproduce.DEFAULT_TESTCASE_INFO_TTL
+    self.mock.send_request.return_value = mock.Mock(text='{"id": 2}')
+
+    self.assertEqual(reproduce.get_testcase_info('1234'), {'id': 2})
+    self.assertEqual(len(self.mock.send_request.call_args_list), 1)
+    self.mock.send_request.reset_mock()
+    self.assertEqual(reproduce.get_testcase_info('1234'), {'id': 2})
+    self.assert_n_calls(0, [self.mock.send_request])
+
+  def test_refresh(self):
+    """Tests that refresh downloads the information again."""
+    reproduce.get_testcase_info('1234', refresh=True)
+    self.assertEqual(len(self.mock.send_request.call_args_list), 1)
+
+  def test_unexpected_shape(self):
+    """Tests that a cache file of another shape is a miss."""
+    for content in [{'response': {'id': 3}}, [1]]:
+      common.write_json_file(
+          os.path.join(reproduce.TESTCASE_INFO_CACHE_DIR, '1234.json'),
+          content)
+      self.assertEqual(reproduce.get_testcase_info('1234'), {'id': 1})
+    self.assertEqual(len(self.mock.send_request.call_args_list), 2)
+
+  def test_ttl_env(self):
+    """Tests configuring the TTL."""
+    os.environ['CF_TESTCASE_INFO_TTL'] = '10'
+    self.addCleanup(os.environ.pop, 'CF_TESTCASE_INFO_TTL')
+    self.mock.time.return_value = 1011.0
+
+    reproduce.get_testcase_info('1234')
+    self.assertEqual(len(self.mock.send_request.call_args_list), 1)
 
 
 class GetTestcaseInfoTest(helpers.ExtendedTestCase):
   """Test get_testcase_info."""
 
   def setUp(self):
+    self.setup_fake_filesystem()
     helpers.patch(self, [
         'clusterfuzz.common.get_stored_auth_header',
         'clusterfuzz.common.store_auth_header',
         'clusterfuzz.commands.reproduce.get_verification_header',
-        'requests.post'])
+        'clusterfuzz.http_client.post',
+        'clusterfuzz.http_client.set_auth_header'])
 
   def test_correct_stored_authorization(self):
     """Ensures that the testcase info is returned when stored auth is correct"""
@@ -222,11 +350,8 @@ class GetTestcaseInfoTest(helpers.ExtendedTestCase):
     self.assert_exact_calls(self.mock.store_auth_header, [
         mock.call('Bearer 12345')])
     self.assert_exact_calls(self.mock.post, [mock.call(
-        url=reproduce.CLUSTERFUZZ_TESTCASE_INFO_URL,
-        headers={'Authorization': 'Bearer 12345',
-                 'User-Agent': 'clusterfuzz-tools'},
-        data=json.dumps({'testcaseId': 999}),
-        allow_redirects=True)])
+        reproduce.CLUSTERFUZZ_TESTCASE_INFO_URL, allow_redirects=True,
+        data=json.dumps({'testcaseId': 999}))])
     self.assertEqual(response, response_dict)
 
   def test_incorrect_stored_header(self):
@@ -252,19 +377,16 @@ class GetTestcaseInfoTest(helpers.ExtendedTestCase):
     self.assert_exact_calls(self.mock.get_verification_header, [mock.call()])
     self.assert_exact_calls(self.mock.post, [
         mock.call(
-            allow_redirects=True,
-            url=reproduce.CLUSTERFUZZ_TESTCASE_INFO_URL,
-            data=json.dumps({'testcaseId': 999}),
-            headers={'Authorization': 'Bearer 12345',
-                     'User-Agent': 'clusterfuzz-tools'}),
+            reproduce.CLUSTERFUZZ_TESTCASE_INFO_URL, allow_redirects=True,
+            data=json.dumps({'testcaseId': 999})),
         mock.call(
-            headers={'Authorization': 'VerificationCode 12345',
-                     'User-Agent': 'clusterfuzz-tools'},
-            allow_redirects=True,
-            data=json.dumps({'testcaseId': 999}),
-            url=reproduce.CLUSTERFUZZ_TESTCASE_INFO_URL)])
+            reproduce.CLUSTERFUZZ_TESTCASE_INFO_URL, allow_redirects=True,
+            data=json.dumps({'testcaseId': 999}))])
     self.assert_exact_calls(self.mock.store_auth_header, [
         mock.call('Bearer 12345')])
+    self.assert_exact_calls(self.mock.set_auth_header, [
+        mock.call('Bearer 12345'), mock.call('VerificationCode 12345'),
+        mock.call('Bearer 12345')])
     self.assertEqual(response, response_dict)
 
 
@@ -291,11 +413,10 @@ class GetTestcaseInfoTest(helpers.ExtendedTestCase):
     self.assert_exact_calls(self.mock.store_auth_header, [
         mock.call('Bearer 12345')])
     self.assert_exact_calls(self.mock.post, [mock.call(
-        headers={'Authorization': 'VerificationCode 12345',
-                 'User-Agent': 'clusterfuzz-tools'},
-        allow_redirects=True,
-        data=json.dumps({'testcaseId': 999}),
-        url=reproduce.CLUSTERFUZZ_TESTCASE_INFO_URL)])
+        reproduce.CLUSTERFUZZ_TESTCASE_INFO_URL, allow_redirects=True,
+        data=json.dumps({'testcaseId': 999}))])
+    self.assert_exact_calls(self.mock.set_auth_header, [
+        mock.call('VerificationCode 12345'), mock.call('Bearer 12345')])
     self.assertEqual(response, response_dict)
 
   def test_incorrect_authorization(self):
@@ -325,16 +446,10 @@ class GetTestcaseInfoTest(helpers.ExtendedTestCase):
     self.assertIn('Invalid verification code (12345)', cm.exception.message)
     self.assert_exact_calls(self.mock.post, [
         mock.call(
-            allow_redirects=True,
-            url=reproduce.CLUSTERFUZZ_TESTCASE_INFO_URL,
-            data=json.dumps({'testcaseId': 999}),
-            headers={'Authorization': 'Bearer 12345',
-                     'User-Agent': 'clusterfuzz-tools'}),
+            reproduce.CLUSTERFUZZ_TESTCASE_INFO_URL, allow_redirects=True,
+            data=json.dumps({'testcaseId': 999})),
         mock.call(
-            allow_redirects=True,
-            headers={'Authorization': 'VerificationCode 12345',
-                     'User-Agent': 'clusterfuzz-tools'},
-            url=reproduce.CLUSTERFUZZ_TESTCASE_INFO_URL,
+            reproduce.CLUSTERFUZZ_TESTCASE_INFO_URL, allow_redirects=True,
             data=json.dumps({'testcaseId': 999}))])
 
   def test_incorrect_testcase_id(self):
@@ -355,10 +470,7 @@ class GetTestcaseInfoTest(helpers.ExtendedTestCase):
     self.assertIn('404', cm.exception.message)
     self.assert_exact_calls(self.mock.post, [
         mock.call(
-            allow_redirects=True,
-            headers={'Authorization': 'VerificationCode 12345',
-                     'User-Agent': 'clusterfuzz-tools'},
-            url=reproduce.CLUSTERFUZZ_TESTCASE_INFO_URL,
+            reproduce.CLUSTERFUZZ_TESTCASE_INFO_URL, allow_redirects=True,
             data=json.dumps({'testcaseId': 999}))
     ])
 
@@ -485,16 +597,288 @@ class GetBinaryDefinitionTest(helpers.ExtendedTestCase):
       result = reproduce.get_binary_definition('fuzzlibber_nasm', 'chromium')
 
 
+class GetBinaryNameTest(helpers.ExtendedTestCase):
+  """Tests the get_binary_name method."""
+
+  def setUp(self):
+    helpers.patch(self, ['clusterfuzz.common.get_binary_name'])
+    self.mock.get_binary_name.return_value = 'parsed_binary'
+    self.testcase = mock.Mock(stacktrace_lines=['line'])
+
+  def test_definition_binary_name(self):
+    """Tests using the binary name of the definition."""
+    definition = mock.Mock(binary_name='d8')
+    self.assertEqual('d8', reproduce.get_binary_name(self.testcase, definition))
+    self.assert_n_calls(0, [self.mock.get_binary_name])
+
+  def test_stacktrace_binary_name(self):
+    """Tests parsing the binary name from the stacktrace."""
+    definition = mock.Mock(binary_name=None)
+    self.assertEqual('parsed_binary',
+                     reproduce.get_binary_name(self.testcase, definition))
+    self.assert_exact_calls(self.mock.get_binary_name, [mock.call(['line'])])
+
+
+class GetDownloadedBinaryTest(helpers.ExtendedTestCase):
+  """Tests the get_downloaded_binary method."""
+
+  def setUp(self):
+    helpers.patch(self, ['clusterfuzz.binary_providers.DownloadedBinary'])
+    self.testcase = mock.Mock(id=1234, build_url='build_url',
+                              reproduction_args='-runs=100')
+
+  def test_libfuzzer(self):
+    """Tests that libFuzzer builds are extracted selectively."""
+    definition = mock.Mock(
+        binary_name='fuzzer', reproducer=reproducers.LibfuzzerJobReproducer)
+    reproduce.get_downloaded_binary(self.testcase, definition)
+    self.assert_exact_calls(self.mock.DownloadedBinary, [
+        mock.call(1234, 'build_url', 'fuzzer', selective_extraction=True,
+                  reproduction_args='-runs=100')])
+
+  def test_other(self):
+    """Tests that other builds are extracted entirely."""
+    definition = mock.Mock(
+        binary_name='d8', reproducer=reproducers.BaseReproducer)
+    reproduce.get_downloaded_binary(self.testcase, definition)
+    self.assert_exact_calls(self.mock.DownloadedBinary, [
+        mock.call(1234, 'build_url', 'd8', selective_extraction=False,
+                  reproduction_args='-runs=100')])
+
+
 class GetSupportedJobsTest(helpers.ExtendedTestCase):
   """Tests the get_supported_jobs method."""
 
   def setUp(self):
     helpers.patch(self, [
         'clusterfuzz.commands.reproduce.build_binary_definition'])
-    self.mock.build_binary_definition.side_effect = KeyError
+    patcher = mock.patch.dict(reproduce.SUPPORTED_JOBS, clear=True)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+
+  def test_parse_once(self):
+    """Tests that the job definitions are parsed once."""
+
+    supported_jobs = reproduce.get_supported_jobs()
+    self.assertIs(reproduce.get_supported_jobs(), supported_jobs)
+    self.assertIn('linux_asan_d8', supported_jobs['standalone'])
+    self.assertEqual(
+        len(supported_jobs['standalone']) + len(supported_jobs['chromium']),
+        self.mock.build_binary_definition.call_count)
 
   def test_raise_from_key_error(self):
+    self.mock.build_binary_definition.side_effect = KeyError
+
     """Tests that a BadJobTypeDefinition error is raised when parsing fails."""
 
     with self.assertRaises(common.BadJobTypeDefinitionError):
       reproduce.get_supported_jobs()
+
+
+class GetBatchTestcaseIdsTest(helpers.ExtendedTestCase):
+  """Tests get_batch_testcase_ids."""
+
+  def setUp(self):
+    self.setup_fake_filesystem()
+
+  def test_ids_and_files(self):
+    """Ensures IDs are read from files, skipping comments."""
+    self.fs.CreateFile('/ids.txt', contents='1\n\n# weekly sweep\n2  # old\n')
+    self.assertEqual(reproduce.get_batch_testcase_ids(['/ids.txt', '3']),
+                     ['1', '2', '3'])
+
+
+class FetchBatchTestcasesTest(helpers.ExtendedTestCase):
+  """Tests fetch_batch_testcases."""
+
+  def setUp(self):
+    helpers.patch(self, ['clusterfuzz.commands.reproduce.get_testcase_info',
+                         'clusterfuzz.testcase.Testcase'])
+
+    def get_testcase_info(testcase_id, refresh):
+      del refresh
+      if testcase_id == '2':
+        raise common.ClusterfuzzAuthError('denied')
+      return {'id': testcase_id}
+    self.mock.get_testcase_info.side_effect = get_testcase_info
+    self.mock.Testcase.side_effect = lambda response: response['id']
+
+  def test_fetch(self):
+    """Ensures a failure is recorded without stopping the others."""
+    results = reproduce.fetch_batch_testcases(['1', '2', '3'], True, 2)
+
+    self.assertEqual(results['1'], '1')
+    self.assertEqual(results['3'], '3')
+    self.assertIn('Failed to fetch', results['2'])
+    self.mock.get_testcase_info.assert_has_calls(
+        [mock.call('1', refresh=True)])
+    self.assertEqual(3, self.mock.get_testcase_info.call_count)
+
+
+class GroupBatchTestcasesTest(helpers.ExtendedTestCase):
+  """Tests group_batch_testcases."""
+
+  def setUp(self):
+    helpers.patch(self, [
+        'clusterfuzz.commands.reproduce.get_binary_definition'])
+    self.definition = mock.Mock(binary_name='d8', source_var='V8_SRC')
+
+    def get_binary_definition(job_type, build):
+      del build
+      if job_type == 'bad':
+        raise common.JobTypeNotSupportedError(job_type)
+      return self.definition
+    self.mock.get_binary_definition.side_effect = get_binary_definition
+    self.testcases = [
+        ('1', mock.Mock(job_type='good', build_url='a', revision=1,
+                        gn_args='x')),
+        ('2', mock.Mock(job_type='good', build_url='b', revision=1,
+                        gn_args='x')),
+        ('3', mock.Mock(job_type='good', build_url='a', revision=2,
+                        gn_args='x')),
+        ('4', mock.Mock(job_type='bad'))]
+    self.results = {testcase_id: {'error': None}
+                    for testcase_id in ['1', '2', '3', '4']}
+
+  def test_download(self):
+    """Ensures downloaded testcases are grouped by build URL."""
+    groups = reproduce.group_batch_testcases(
+        self.testcases, 'download', self.results)
+    self.assertEqual(
+        [[testcase_id for testcase_id, _, _ in group] for group in groups],
+        [['1', '3'], ['2']])
+    self.assertIn('bad', self.results['4']['error'])
+
+  def test_build(self):
+    """Ensures built testcases are grouped by revision and gn args."""
+    groups = reproduce.group_batch_testcases(
+        self.testcases, 'standalone', self.results)
+    self.assertEqual(
+        [[testcase_id for testcase_id, _, _ in group] for group in groups],
+        [['1', '2'], ['3']])
+
+
+class RunBatchTestcaseTest(helpers.ExtendedTestCase):
+  """Tests run_batch_testcase."""
+
+  def setUp(self):
+    self.definition = mock.Mock(sanitizer='ASAN')
+    self.reproduce = self.definition.reproducer.return_value.reproduce
+    self.result = {'reproduced': False, 'error': None, 'duration': None}
+
+  def run_testcase(self):
+    reproduce.run_batch_testcase(
+        'testcase', self.definition, 'provider', 10, False, '--test',
+        self.result)
+
+  def test_reproduced(self):
+    """Ensures a reproduced testcase is recorded."""
+    self.reproduce.return_value = True
+    self.run_testcase()
+
+    self.assertTrue(self.result['reproduced'])
+    self.assertIsNotNone(self.result['duration'])
+    self.assert_exact_calls(self.definition.reproducer, [
+        mock.call('provider', 'testcase', 'ASAN', False, '--test', False)])
+    self.assert_exact_calls(self.reproduce, [mock.call(10, isolated=True)])
+
+  def test_not_reproduced(self):
+    """Ensures the exit of an unreproduced testcase is caught."""
+    self.reproduce.side_effect = SystemExit(1)
+    self.run_testcase()
+
+    self.assertFalse(self.result['reproduced'])
+    self.assertIsNone(self.result['error'])
+
+  def test_error(self):
+    """Ensures errors are recorded."""
+    self.reproduce.side_effect = common.NotInstalledError('blackbox')
+    self.run_testcase()
+
+    self.assertFalse(self.result['reproduced'])
+    self.assertIn('NotInstalledError', self.result['error'])
+
+
+class ExecuteBatchTest(helpers.ExtendedTestCase):
+  """Tests execute_batch."""
+
+  def setUp(self):
+    self.setup_fake_filesystem()
+    helpers.patch(self, [
+        'clusterfuzz.commands.reproduce.fetch_batch_testcases',
+        'clusterfuzz.commands.reproduce.get_binary_definition',
+        'clusterfuzz.commands.reproduce.get_downloaded_binary',
+        'clusterfuzz.commands.reproduce.ensure_goma',
+        'clusterfuzz.commands.reproduce.run_batch_testcase'])
+    self.definition = mock.Mock(binary_name='d8')
+    self.mock.get_binary_definition.return_value = self.definition
+    self.testcases = {
+        '1': mock.Mock(job_type='job', build_url='a', revision=1,
+                       gn_args='x'),
+        '2': mock.Mock(job_type='job', build_url='a', revision=2,
+                       gn_args='x'),
+        '3': 'Failed to fetch the testcase details'}
+    self.mock.fetch_batch_testcases.return_value = self.testcases
+    self.mock.get_downloaded_binary.side_effect = (
+        lambda current_testcase, _: mock.Mock(name=current_testcase.revision))
+
+    def run_batch_testcase(current_testcase, *args):
+      args[-1]['reproduced'] = current_testcase.revision == 1
+      args[-1]['duration'] = 1.0
+    self.mock.run_batch_testcase.side_effect = run_batch_testcase
+
+  def execute(self, build):
+    reproduce.execute_batch(['1', '2', '3'], '/results.json', False, build,
+                            False, None, 10, False, '', False, 2)
+    with open('/results.json') as f:
+      return json.load(f)
+
+  def test_download(self):
+    """Ensures a shared build is downloaded once before running."""
+    results = self.execute('download')
+
+    self.assertEqual(results, [
+        {'testcaseId': '1', 'reproduced': True, 'error': None,
+         'duration': 1.0},
+        {'testcaseId': '2', 'reproduced': False, 'error': None,
+         'duration': 1.0},
+        {'testcaseId': '3', 'reproduced': False,
+         'error': 'Failed to fetch the testcase details', 'duration': None}])
+    self.assert_n_calls(0, [self.mock.ensure_goma])
+    self.assertEqual(2, self.mock.get_downloaded_binary.call_count)
+    first, second = [
+        c[0][2] for c in self.mock.run_batch_testcase.call_args_list]
+    self.assert_exact_calls(first.get_build_directory, [mock.call()])
+    self.assert_n_calls(0, [second.get_build_directory])
+
+  def test_build(self):
+    """Ensures each revision is built once, with its own builder."""
+    self.definition.builder.side_effect = lambda *_: mock.Mock()
+    results = self.execute('standalone')
+
+    self.assertEqual([r['reproduced'] for r in results], [True, False, False])
+    self.assert_exact_calls(self.mock.ensure_goma, [mock.call()])
+    self.assert_exact_calls(self.definition.builder, [
+        mock.call(self.testcases['1'], self.definition, False,
+                  self.mock.ensure_goma.return_value, None, False),
+        mock.call(self.testcases['2'], self.definition, False,
+                  self.mock.ensure_goma.return_value, None, False)])
+    for call in self.mock.run_batch_testcase.call_args_list:
+      self.assert_exact_calls(call[0][2].get_build_directory, [mock.call()])
+
+  def test_build_failure(self):
+    """Ensures a failed build is recorded for the testcases of its group."""
+    self.mock.get_downloaded_binary.side_effect = None
+    (self.mock.get_downloaded_binary.return_value.get_build_directory
+     .side_effect) = SystemExit(1)
+    results = self.execute('download')
+
+    self.assertIn('Failed to prepare the build', results[0]['error'])
+    self.assertIn('Failed to prepare the build', results[1]['error'])
+    self.assert_n_calls(0, [self.mock.run_batch_testcase])
+
+  def test_empty(self):
+    """Ensures an empty batch is an error."""
+    with self.assertRaises(common.ExpectedException):
+      reproduce.execute_batch([], '/results.json', False, 'download', False,
+                              None, 10, False, '', False, 2)
@@ -0,0 +1,49 @@
+"""Tests the serve command."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import mock
+
+from clusterfuzz import common
+from clusterfuzz import main
+from clusterfuzz.commands import serve
+import helpers
+
+
+class ExecuteTest(helpers.ExtendedTestCase):
+  """Tests execute."""
+
+  def setUp(self):
+    helpers.patch(self, [
+        'clusterfuzz.daemon.serve',
+        'clusterfuzz.commands.reproduce.get_supported_jobs',
+        'clusterfuzz.reproducers.DisplayPool.acquire',
+        'clusterfuzz.reproducers.DisplayPool.release'])
+
+  def test_warm_up(self):
+    """Ensures the job definitions and a display are ready before serving."""
+    serve.execute()
+
+    self.assert_exact_calls(self.mock.get_supported_jobs, [mock.call()])
+    self.assert_exact_calls(self.mock.release, [
+        mock.call(mock.ANY, self.mock.acquire.return_value)])
+    self.assert_exact_calls(self.mock.serve, [mock.call(main.run)])
+
+  def test_no_display(self):
+    """Ensures the daemon runs without a display."""
+    self.mock.acquire.side_effect = common.NotInstalledError('blackbox')
+    serve.execute()
+
+    self.assert_n_calls(0, [self.mock.release])
+    self.assert_exact_calls(self.mock.serve, [mock.call(main.run)])
@@ -13,10 +13,13 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import cStringIO
+import errno
+import fcntl
+import signal
 import subprocess
 import os
 import stat
+import time
 import mock
 
 from clusterfuzz import common
@@ -98,7 +101,6 @@ class ExecuteTest(helpers.ExtendedTestCase):
                          'logging.getLogger',
                          'logging.config.dictConfig',
                          'clusterfuzz.common.check_binary',
-                         'clusterfuzz.common.wait_timeout',
                          'clusterfuzz.common.interpret_ninja_output',
                          'os.environ.copy'])
     self.mock.copy.return_value = {'OS': 'ENVIRON'}
@@ -108,18 +110,26 @@ class ExecuteTest(helpers.ExtendedTestCase):
     local_logging.start_loggers()
     self.lines = 'Line 1\nLine 2\nLine 3'
 
+  def build_stdout(self, output):
+    """Returns a pipe from which output can be read."""
+    read_fd, write_fd = os.pipe()
+    os.write(write_fd, output)
+    os.close(write_fd)
+    stdout = os.fdopen(read_fd)
+    self.addCleanup(stdout.close)
+    return stdout
+
   def build_popen_mock(self, code):
     """Builds the mocked Popen object."""
     return mock.MagicMock(
-        stdout=cStringIO.StringIO(self.lines),
+        stdout=self.build_stdout(self.lines),
         returncode=code)
 
   def test_with_ninja(self):
     """Ensure interpret_ninja_output is run when the ninja flag is set."""
 
-    x = mock.Mock()
-    x.read.side_effect = ['part1', 'part2\n']
-    self.mock.Popen.return_value = mock.Mock(stdout=x, returncode=0)
+    self.mock.Popen.return_value = mock.Mock(
+        stdout=self.build_stdout('part1part2\n'), returncode=0)
     common.execute('ninja', 'do this plz', '~/working/directory',
                    print_output=True, exit_on_error=True,
                    env={'a': 'b', 1: 2, 'c': None})
@@ -366,92 +376,136 @@ class BinaryDefinitionTest(helpers.ExtendedTestCase):
       common.BinaryDefinition('builder', 'CHROME_SRC', 'reproducer')
 
 
-class WaitTimeoutTest(helpers.ExtendedTestCase):
-  """Tests the wait_timeout method."""
+class ReadOutputTest(helpers.ExtendedTestCase):
+  """Tests the read_output method."""
 
   def setUp(self):
-    helpers.patch(self, ['time.sleep',
-                         'os.getpgid',
-                         'os.killpg'])
-
-  def test_kill_not_needed(self):
-    """Tests when the process exits without needing to be killed."""
-
-    class ProcMock(object):
-      poll_results = [1, None, None, None]
-      pid = 1234
-      def poll(self):
-        return self.poll_results.pop()
-    proc = ProcMock()
+    kill_process_group = common.kill_process_group
+    helpers.patch(self, ['clusterfuzz.common.kill_process_group'])
+    self.mock.kill_process_group.side_effect = kill_process_group
+
+  def read_output(self, command, timeout):
+    """Runs command, and returns its output and how long reading it took."""
+    proc = common.start_execute('sh', "-c '%s'" % command, '.',
+                                print_command=False)
+    self.addCleanup(proc.stdout.close)
+    self.addCleanup(self.reap, proc)
+    start = time.time()
+    output = ''.join(common.read_output(proc, timeout))
+    elapsed = time.time() - start
+    proc.wait()
+    return output, elapsed
+
+  def reap(self, proc):
+    """Kills whatever is left of the process group of proc."""
+    try:
+      os.killpg(proc.pid, signal.SIGKILL)
+    except OSError:
+      pass
+    proc.wait()
+
+  def test_exits_early(self):
+    """Tests that a process exiting with 0 isn't waited on for the timeout."""
+    output, elapsed = self.read_output('echo done', 30)
+
+    self.assertEqual(output, 'done\n')
+    self.assertLess(elapsed, 5)
+    self.assert_n_calls(0, [self.mock.kill_process_group])
+
+  def test_large_output(self):
+    """Tests that output larger than the pipe buffer doesn't block."""
+    output, elapsed = self.read_output('head -c 1000000 /dev/zero', 30)
+
+    self.assertEqual(len(output), 1000000)
+    self.assertLess(elapsed, 5)
+    self.assert_n_calls(0, [self.mock.kill_process_group])
 
-    common.wait_timeout(proc, 5)
-
-    self.assert_n_calls(0, [self.mock.killpg])
-    self.assert_exact_calls(self.mock.sleep, [mock.call(0.5), mock.call(0.5),
-                                              mock.call(0.5), mock.call(0.5)])
-
-  def test_kill_needed(self):
-    """Tests when the process must be killed."""
+  def test_no_timeout(self):
+    """Tests when no timeout is specified."""
+    output, _ = self.read_output('echo a; sleep 0.2; echo b', None)
+
+    self.assertEqual(output, 'a\nb\n')
+    self.assert_n_calls(0, [self.mock.kill_process_group])
+
+  def test_complete(self):
+    """Tests stopping the process group once its output is complete."""
+    self.addCleanup(setattr, common, 'COMPLETE_GRACE_PERIOD',
+                    common.COMPLETE_GRACE_PERIOD)
+    common.COMPLETE_GRACE_PERIOD = 0.2
+    proc = common.start_execute(
+        'sh', "-c 'echo started; echo done; while true; do sleep 0.1; done'",
+        '.', print_command=False)
+    self.addCleanup(proc.stdout.close)
+    self.addCleanup(self.reap, proc)
+
+    start = time.time()
+    output = ''.join(common.read_output(
+        proc, 30, is_complete=lambda chunk: 'done' in chunk))
+
+    self.assertLess(time.time() - start, 5)
+    self.assertTrue(output.startswith('started\ndone\n'))
+    self.assertEqual([c[0][1] for c in
+                      self.mock.kill_process_group.call_args_list],
+                     [signal.SIGTERM])
+
+  def test_terminate(self):
+    """Tests that the process group is sent SIGTERM after the timeout, and
+      that the output it writes on shutdown is kept."""
+    output, elapsed = self.read_output(
+        'trap "echo stopping; exit 1" TERM; echo started; '
+        'while true; do sleep 0.1; done', 1)
+
+    # The shell may also report the sleep it was running as terminated.
+    self.assertTrue(output.startswith('started\n'))
+    self.assertTrue(output.endswith('stopping\n'))
+    self.assertLess(elapsed, 1 + common.KILL_GRACE_PERIOD)
+    self.assertEqual([c[0][1] for c in
+                      self.mock.kill_process_group.call_args_list],
+                     [signal.SIGTERM])
+
+  def test_kill(self):
+    """Tests that a process ignoring SIGTERM is killed after the grace
+      period."""
+    self.addCleanup(setattr, common, 'KILL_GRACE_PERIOD',
+                    common.KILL_GRACE_PERIOD)
+    common.KILL_GRACE_PERIOD = 0.5
+
+    output, elapsed = self.read_output(
+        'trap "" TERM; echo started; while true; do sleep 0.1; done', 1)
+
+    self.assertEqual(output, 'started\n')
+    self.assertLess(elapsed, 5)
+    self.assertEqual([c[0][1] for c in
+                      self.mock.kill_process_group.call_args_list],
+                     [signal.SIGTERM, signal.SIGKILL])
+
+
+class KillProcessGroupTest(helpers.ExtendedTestCase):
+  """Tests the kill_process_group method."""
 
+  def setUp(self):
+    helpers.patch(self, ['os.getpgid', 'os.killpg'])
     self.mock.getpgid.return_value = 345
-    class ProcMock(object):
-      pid = 1234
-      def poll(self):
-        return None
-    proc = ProcMock()
 
-    common.wait_timeout(proc, 5)
+  def test_kill(self):
+    """Tests killing the process group."""
+    common.kill_process_group(mock.Mock(pid=1234), signal.SIGTERM)
 
-    self.assert_exact_calls(self.mock.killpg, [mock.call(345, 15)])
     self.assert_exact_calls(self.mock.getpgid, [mock.call(1234)])
-    self.assert_n_calls(11, [self.mock.sleep])
-
-  def test_no_timeout(self):
-    """Tests when no timeout is specified."""
-
-    common.wait_timeout(mock.Mock(), None)
-
-    self.assert_n_calls(0, [self.mock.sleep, self.mock.getpgid,
-                            self.mock.killpg])
+    self.assert_exact_calls(self.mock.killpg, [mock.call(345, 15)])
 
   def test_no_process(self):
-    """Tests when process died maturely."""
-    error = OSError()
-    error.errno = 3  # No such process.
-    self.mock.killpg.side_effect = error
-
-    self.mock.getpgid.return_value = 345
-    class ProcMock(object):
-      pid = 1234
-      def poll(self):
-        return None
-    proc = ProcMock()
-
-    common.wait_timeout(proc, 5)
+    """Tests when the process has already exited."""
+    self.mock.killpg.side_effect = OSError(errno.ESRCH, 'No such process')
 
-    self.assert_exact_calls(self.mock.killpg, [mock.call(345, 15)])
-    self.assert_exact_calls(self.mock.getpgid, [mock.call(1234)])
-    self.assert_n_calls(10, [self.mock.sleep])
+    common.kill_process_group(mock.Mock(pid=1234), signal.SIGTERM)
 
   def test_kill_error(self):
-    """Test error when killing."""
-    error = OSError()
-    error.errno = 4
-    self.mock.killpg.side_effect = error
-
-    self.mock.getpgid.return_value = 345
-    class ProcMock(object):
-      pid = 1234
-      def poll(self):
-        return None
-    proc = ProcMock()
+    """Tests an error when killing."""
+    self.mock.killpg.side_effect = OSError(errno.EPERM, 'Not permitted')
 
     with self.assertRaises(OSError):
-      common.wait_timeout(proc, 5)
-
-    self.assert_exact_calls(self.mock.killpg, [mock.call(345, 15)])
-    self.assert_exact_calls(self.mock.getpgid, [mock.call(1234)])
-    self.assert_n_calls(10, [self.mock.sleep])
+      common.kill_process_group(mock.Mock(pid=1234), signal.SIGTERM)
 
 
 class InterpretNinjaOutputTest(helpers.ExtendedTestCase):
@@ -555,6 +609,61 @@ class GetSourceDirectoryTest(helpers.ExtendedTestCase):
     self.assertEqual(os.path.abspath('./test-dir'), result)
 
 
+class FileLockTest(helpers.ExtendedTestCase):
+  """Tests file_lock."""
+
+  def setUp(self):
+    self.setup_fake_filesystem()
+    helpers.patch(self, ['fcntl.flock'])
+
+  def test_lock(self):
+    """Tests locking and unlocking, even when the block raises."""
+    with self.assertRaises(ValueError):
+      with common.file_lock('/lock/dir/file.lock'):
+        self.assertTrue(os.path.exists('/lock/dir/file.lock'))
+        raise ValueError()
+
+    self.assertEqual(
+        [fcntl.LOCK_EX, fcntl.LOCK_UN],
+        [c[0][1] for c in self.mock.flock.call_args_list])
+
+  def test_non_blocking(self):
+    """Tests not waiting for a lock which is held."""
+    with common.file_lock('/lock/file.lock', blocking=False) as locked:
+      self.assertTrue(locked)
+
+    self.mock.flock.side_effect = IOError(errno.EAGAIN, 'Busy')
+    with common.file_lock('/lock/file.lock', blocking=False) as locked:
+      self.assertFalse(locked)
+
+    self.assertEqual(
+        [fcntl.LOCK_EX | fcntl.LOCK_NB, fcntl.LOCK_UN,
+         fcntl.LOCK_EX | fcntl.LOCK_NB],
+        [c[0][1] for c in self.mock.flock.call_args_list])
+
+
+class JsonFileTest(helpers.ExtendedTestCase):
+  """Tests read_json_file and write_json_file."""
+
+  def setUp(self):
+    self.setup_fake_filesystem()
+
+  def test_round_trip(self):
+    """Tests writing and reading back a JSON file."""
+    common.write_json_file('/json/dir/file.json', {'a': [1, 2]})
+
+    self.assertEqual(
+        {'a': [1, 2]}, common.read_json_file('/json/dir/file.json'))
+    self.assertEqual(['file.json'], os.listdir('/json/dir'))
+
+  def test_missing_or_malformed(self):
+    """Tests that the default is returned for unusable files."""
+    self.fs.CreateFile('/json/bad.json', contents='{not json')
+
+    self.assertEqual({}, common.read_json_file('/json/bad.json', default={}))
+    self.assertIsNone(common.read_json_file('/json/missing.json'))
+
+
 class GetValidAbsDirTest(helpers.ExtendedTestCase):
   """Tests for get_valid_abs_dir."""
 
@@ -0,0 +1,186 @@
+"""Tests the daemon module."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import sys
+import json
+import socket
+import logging
+import StringIO
+import threading
+import mock
+
+from clusterfuzz import common
+from clusterfuzz import daemon
+import helpers
+
+
+class FrameTest(helpers.ExtendedTestCase):
+  """Tests sending and reading frames."""
+
+  def setUp(self):
+    self.server, self.client = socket.socketpair()
+    self.addCleanup(self.server.close)
+    self.addCleanup(self.client.close)
+
+  def test_frames(self):
+    """Ensures frames are read back whole, in order."""
+    writer = daemon.FrameWriter(self.server)
+    writer.write('output')
+    writer.write(u'\xe9')
+    writer.write('')
+    writer.send(daemon.EXIT_FRAME, '2')
+    self.server.close()
+
+    self.assertEqual(daemon.read_frame(self.client),
+                     (daemon.OUTPUT_FRAME, 'output'))
+    self.assertEqual(daemon.read_frame(self.client),
+                     (daemon.OUTPUT_FRAME, '\xc3\xa9'))
+    self.assertEqual(daemon.read_frame(self.client), (daemon.EXIT_FRAME, '2'))
+    self.assertEqual(daemon.read_frame(self.client), (None, None))
+
+
+class ShouldForwardTest(helpers.ExtendedTestCase):
+  """Tests should_forward."""
+
+  def test_should_forward(self):
+    """Ensures serve and disabled forwarding run locally."""
+    self.mock_os_environment({})
+    self.assertTrue(daemon.should_forward(['reproduce', '1234']))
+    self.assertFalse(daemon.should_forward(['serve']))
+    self.assertFalse(daemon.should_forward([]))
+
+    self.mock_os_environment({'CF_NO_DAEMON': '1'})
+    self.assertFalse(daemon.should_forward(['reproduce', '1234']))
+
+
+class HandleConnectionTest(helpers.ExtendedTestCase):
+  """Tests running a forwarded command in the daemon."""
+
+  def setUp(self):
+    self.server, self.client = socket.socketpair()
+    self.addCleanup(self.server.close)
+    self.addCleanup(self.client.close)
+    self.stream = StringIO.StringIO()
+    self.handler = logging.StreamHandler(self.stream)
+    daemon.logger.addHandler(self.handler)
+    self.addCleanup(daemon.logger.removeHandler, self.handler)
+    self.addCleanup(daemon.logger.setLevel, daemon.logger.level)
+    daemon.logger.setLevel(logging.INFO)
+    self.cwd = os.getcwd()
+    self.mock_os_environment({'DAEMON': 'env'})
+
+  def run_command(self, run, stdin=''):
+    """Sends a request, runs it and returns the frames the client got."""
+    self.client.sendall(
+        '{"argv": ["cmd"], "cwd": "/", "env": {"CLIENT": "env"}}\n' + stdin)
+    daemon.handle_connection(self.server, run)
+    self.server.close()
+
+    frames = []
+    while True:
+      frame = daemon.read_frame(self.client)
+      if frame == (None, None):
+        return frames
+      frames.append(frame)
+
+  def test_output_and_exit_code(self):
+    """Ensures the command runs with the client's settings."""
+    seen = {}
+
+    def run(argv):
+      seen['argv'] = argv
+      seen['cwd'] = os.getcwd()
+      seen['env'] = dict(os.environ)
+      seen['input'] = sys.stdin.readline()
+      print 'printed'
+      daemon.logger.info('logged')
+      sys.exit(3)
+
+    frames = self.run_command(run, 'yes\n')
+    self.assertEqual(seen, {'argv': ['cmd'], 'cwd': '/',
+                            'env': {'CLIENT': 'env'}, 'input': 'yes\n'})
+    self.assertEqual(frames[-1], (daemon.EXIT_FRAME, '3'))
+    self.assertEqual(
+        ''.join(data for t, data in frames if t == daemon.OUTPUT_FRAME),
+        'printed\nlogged\n')
+    self.assertEqual(self.stream.getvalue(), '')
+    self.assertIs(self.handler.stream, self.stream)
+    self.assertEqual(os.getcwd(), self.cwd)
+    self.assertEqual(os.environ.get('DAEMON'), 'env')
+    self.assertNotIn('CLIENT', os.environ)
+
+  def test_exception(self):
+    """Ensures an exception is reported and gives exit code 1."""
+
+    def run(_):
+      raise ValueError('broken')
+
+    frames = self.run_command(run)
+    self.assertEqual(frames[-1], (daemon.EXIT_FRAME, '1'))
+    self.assertIn('ValueError: broken', frames[0][1])
+
+
+class ForwardTest(helpers.ExtendedTestCase):
+  """Tests forwarding a command."""
+
+  def setUp(self):
+    self.server, self.client = socket.socketpair()
+    self.addCleanup(self.server.close)
+    helpers.patch(self, ['clusterfuzz.daemon.relay_stdin', 'os.getcwd'])
+    self.mock.getcwd.return_value = '/work'
+    self.mock_os_environment({'CLIENT': 'env'})
+    self.stdout = StringIO.StringIO()
+    patcher = mock.patch('sys.stdout', self.stdout)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+
+  def test_forward(self):
+    """Ensures the output is printed and the exit code returned."""
+    request = []
+
+    def serve():
+      request.append(self.server.makefile('rb', 0).readline())
+      writer = daemon.FrameWriter(self.server)
+      writer.write('out')
+      writer.write('put\n')
+      writer.send(daemon.EXIT_FRAME, '4')
+    thread = threading.Thread(target=serve)
+    thread.start()
+
+    self.assertEqual(daemon.forward(self.client, ['reproduce', '1']), 4)
+    thread.join()
+    self.assertEqual(self.stdout.getvalue(), 'output\n')
+    self.assertEqual(json.loads(request[0]), {
+        'argv': ['reproduce', '1'], 'cwd': '/work', 'env': {'CLIENT': 'env'}})
+
+  def test_daemon_went_away(self):
+    """Ensures a closed connection is an error."""
+    self.server.close()
+    self.assertEqual(daemon.forward(self.client, ['reproduce', '1']), 1)
+
+
+class ServeTest(helpers.ExtendedTestCase):
+  """Tests serve."""
+
+  def setUp(self):
+    helpers.patch(self, ['clusterfuzz.daemon.connect'])
+
+  def test_already_running(self):
+    """Ensures a second daemon isn't started."""
+    with self.assertRaises(common.ExpectedException):
+      daemon.serve(None)
+    self.assert_exact_calls(self.mock.connect.return_value.close,
+                            [mock.call()])
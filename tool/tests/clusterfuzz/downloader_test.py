@@ -0,0 +1,207 @@
+"""Tests the module for resumable, parallel downloads."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import re
+import base64
+import shutil
+import tempfile
+import hashlib
+import threading
+import BaseHTTPServer
+import SocketServer
+
+from clusterfuzz import common
+from clusterfuzz import downloader
+from clusterfuzz import http_client
+import helpers
+
+CONTENT = ''.join(chr(i % 251) for i in range(45))
+
+
+class FileHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+  """Serves CONTENT, with or without range requests."""
+
+  def do_GET(self):  # pylint: disable=invalid-name
+    server = self.server
+    server.ranges.append(self.headers.get('Range'))
+    start, end, status = 0, len(CONTENT) - 1, 200
+    match = re.match(r'bytes=(\d+)-(\d+)$', self.headers.get('Range', ''))
+    if server.supports_ranges and match:
+      start, end, status = int(match.group(1)), int(match.group(2)), 206
+    if (self.headers.get('If-None-Match') and
+        self.headers.get('If-None-Match') == server.extra_headers.get('ETag')):
+      self.send_response(304)
+      self.end_headers()
+      return
+    if start in server.failing_starts:
+      server.failing_starts.remove(start)
+      self.send_error(503)
+      return
+
+    self.send_response(status)
+    self.send_header('Content-Length', str(end - start + 1))
+    if status == 206:
+      self.send_header('Content-Range', 'bytes %d-%d/%d' % (
+          start, end, len(CONTENT)))
+    for name, value in server.extra_headers.iteritems():
+      self.send_header(name, value)
+    self.end_headers()
+    self.wfile.write(CONTENT[start:end + 1])
+
+  def log_message(self, *unused_args):  # pylint: disable=arguments-differ
+    pass
+
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+  """A local stand-in for the servers builds and testcases come from."""
+  daemon_threads = True
+
+
+class DownloadTest(helpers.ExtendedTestCase):
+  """Tests downloading from a local server."""
+
+  def setUp(self):
+    # Other tests reload common, which DownloadError must extend.
+    reload(downloader)
+    # The ranges are written concurrently, which the fake file system can't
+    # do, so a temporary directory is used instead.
+    self.temp_dir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.temp_dir)
+    self.dest_dir = os.path.join(self.temp_dir, 'dest')
+    os.makedirs(self.dest_dir)
+    for name, value in [
+        ('RANGE_SIZE', 10),
+        ('DOWNLOADS_DIR', os.path.join(self.temp_dir, 'downloads'))]:
+      self.addCleanup(setattr, downloader, name, getattr(downloader, name))
+      setattr(downloader, name, value)
+    # A session without backoff, so that retries don't slow the tests down.
+    for name, value in [('BACKOFF_FACTOR', 0), ('SESSION', None)]:
+      self.addCleanup(setattr, http_client, name, getattr(http_client, name))
+      setattr(http_client, name, value)
+
+    self.server = Server(('127.0.0.1', 0), FileHandler)
+    self.server.supports_ranges = True
+    self.server.failing_starts = []
+    self.server.extra_headers = {}
+    self.server.ranges = []
+    thread = threading.Thread(target=self.server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    self.addCleanup(self.server.server_close)
+    self.addCleanup(self.server.shutdown)
+    self.url = 'http://127.0.0.1:%d/path/file.zip?id=1' % (
+        self.server.server_address[1])
+
+  def get_partial_files(self):
+    """Returns the files left in the downloads directory, without locks."""
+    return sorted(f for f in os.listdir(downloader.DOWNLOADS_DIR)
+                  if not f.endswith('.lock'))
+
+  def test_ranges(self):
+    """Tests downloading a file in ranges."""
+    path = downloader.download(
+        self.url, self.dest_dir, connections=2)['path']
+
+    self.assertEqual(path, os.path.join(self.dest_dir, 'file.zip'))
+    with open(path) as f:
+      self.assertEqual(f.read(), CONTENT)
+    self.assertEqual(
+        sorted(self.server.ranges),
+        ['bytes=0-0', 'bytes=0-9', 'bytes=10-19', 'bytes=20-29',
+         'bytes=30-39', 'bytes=40-44'])
+    self.assertEqual(self.get_partial_files(), [])
+
+  def test_no_ranges(self):
+    """Tests downloading from a server which ignores ranges."""
+    self.server.supports_ranges = False
+
+    path = downloader.download(self.url, self.dest_dir)['path']
+
+    with open(path) as f:
+      self.assertEqual(f.read(), CONTENT)
+    self.assertEqual(self.server.ranges, ['bytes=0-0'])
+
+  def test_content_disposition_and_md5(self):
+    """Tests naming the file after Content-Disposition and checking its MD5."""
+    self.server.extra_headers = {
+        'Content-Disposition': 'attachment; filename="testcase.js"',
+        'x-goog-hash': 'crc32c=abc=, md5=%s' % base64.b64encode(
+            hashlib.md5(CONTENT).digest())}
+
+    path = downloader.download(self.url, self.dest_dir)['path']
+
+    self.assertEqual(path, os.path.join(self.dest_dir, 'testcase.js'))
+
+  def test_md5_mismatch(self):
+    """Tests that a corrupt download is deleted."""
+    self.server.extra_headers = {
+        'Content-MD5': base64.b64encode(hashlib.md5('other').digest())}
+
+    with self.assertRaises(downloader.DownloadError):
+      downloader.download(self.url, self.dest_dir)
+    self.assertEqual(os.listdir(self.dest_dir), [])
+    self.assertEqual(self.get_partial_files(), [])
+
+  def test_resume(self):
+    """Tests that an interrupted download only fetches the missing ranges."""
+    self.server.failing_starts = [20] * (http_client.MAX_RETRIES + 1)
+
+    with self.assertRaises(downloader.DownloadError):
+      downloader.download(self.url, self.dest_dir, connections=1)
+    key = hashlib.sha1(self.url).hexdigest()
+    self.assertEqual(self.get_partial_files(),
+                     [key + '.journal', key + '.partial'])
+    journal = common.read_json_file(
+        os.path.join(downloader.DOWNLOADS_DIR, key + '.journal'))
+    self.assertEqual(sorted(journal['done']), [0, 10, 30, 40])
+
+    self.server.ranges = []
+    path = downloader.download(
+        self.url, self.dest_dir, connections=1)['path']
+
+    with open(path) as f:
+      self.assertEqual(f.read(), CONTENT)
+    self.assertEqual(self.server.ranges, ['bytes=0-0', 'bytes=20-29'])
+    self.assertEqual(self.get_partial_files(), [])
+
+  def test_http_error(self):
+    """Tests that an HTTP error is reported."""
+    self.server.failing_starts = [0] * (http_client.MAX_RETRIES + 1)
+
+    with self.assertRaises(downloader.DownloadError):
+      downloader.download(self.url, self.dest_dir)
+
+  def test_retry(self):
+    """Tests that a server error is retried."""
+    self.server.failing_starts = [20]
+
+    path = downloader.download(
+        self.url, self.dest_dir, connections=1)['path']
+
+    with open(path) as f:
+      self.assertEqual(f.read(), CONTENT)
+    self.assertEqual(self.server.ranges.count('bytes=20-29'), 2)
+
+  def test_is_unchanged(self):
+    """Tests revalidating a download with its ETag."""
+    self.server.extra_headers = {'ETag': '"abc"'}
+
+    info = downloader.download(self.url, self.dest_dir)
+
+    self.assertEqual(info['etag'], '"abc"')
+    self.assertTrue(downloader.is_unchanged(self.url, info))
+    self.assertFalse(downloader.is_unchanged(self.url, {'etag': '"def"'}))
+    self.assertFalse(downloader.is_unchanged(self.url, {}))
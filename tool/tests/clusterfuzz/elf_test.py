@@ -0,0 +1,41 @@
+"""Tests the module for reading the libraries needed by ELF binaries."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+
+from clusterfuzz import elf
+import helpers
+
+
+class GetNeededLibrariesTest(helpers.ExtendedTestCase):
+  """Tests the get_needed_libraries method."""
+
+  def test_binary(self):
+    """Tests reading the DT_NEEDED entries of the bundled llvm-symbolizer."""
+    path = os.path.join(os.path.dirname(elf.__file__), 'resources',
+                        'llvm-symbolizer')
+    self.assertEqual(
+        ['libpthread.so.0', 'librt.so.1', 'libdl.so.2', 'libtinfo.so.5',
+         'libz.so.1', 'libm.so.6', 'libstdc++.so.6', 'libgcc_s.so.1',
+         'libc.so.6', 'ld-linux-x86-64.so.2'],
+        elf.get_needed_libraries(path))
+
+  def test_not_elf(self):
+    """Tests that files which aren't ELF binaries need nothing."""
+    self.setup_fake_filesystem()
+    self.fs.CreateFile('/script.sh', contents='#!/bin/sh\n')
+    self.fs.CreateFile('/empty')
+    self.assertEqual([], elf.get_needed_libraries('/script.sh'))
+    self.assertEqual([], elf.get_needed_libraries('/empty'))
@@ -0,0 +1,79 @@
+"""Test the http_client module."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import mock
+import requests
+
+import helpers
+from clusterfuzz import http_client
+
+
+class SessionTest(helpers.ExtendedTestCase):
+  """Tests get_session and set_auth_header."""
+
+  def setUp(self):
+    helpers.patch(self, ['clusterfuzz.common.get_stored_auth_header'])
+    self.mock.get_stored_auth_header.return_value = 'Bearer 1234'
+    self.addCleanup(setattr, http_client, 'SESSION', http_client.SESSION)
+    http_client.SESSION = None
+
+  def test_shared(self):
+    """Tests that the session is created once, with pooled connections."""
+    session = http_client.get_session()
+
+    self.assertIs(http_client.get_session(), session)
+    self.assert_exact_calls(self.mock.get_stored_auth_header, [mock.call()])
+    self.assertEqual(session.headers['User-Agent'], 'clusterfuzz-tools')
+    adapter = session.get_adapter('https://clusterfuzz.com')
+    self.assertEqual(adapter.max_retries.total, http_client.MAX_RETRIES)
+    self.assertEqual(adapter.max_retries.backoff_factor,
+                     http_client.BACKOFF_FACTOR)
+    # pylint: disable=protected-access
+    self.assertEqual(adapter._pool_maxsize, http_client.POOL_MAXSIZE)
+
+  def test_auth_header(self):
+    """Tests that the auth header is only sent to ClusterFuzz."""
+    http_client.set_auth_header('Bearer 5678')
+    session = http_client.get_session()
+
+    clusterfuzz_request = session.prepare_request(
+        requests.Request('POST', 'https://clusterfuzz.com/v2/testcase'))
+    other_request = session.prepare_request(
+        requests.Request('GET', 'https://storage.googleapis.com/build.zip'))
+
+    self.assertEqual(clusterfuzz_request.headers['Authorization'],
+                     'Bearer 5678')
+    self.assertNotIn('Authorization', other_request.headers)
+    self.assertEqual(other_request.headers['User-Agent'], 'clusterfuzz-tools')
+
+
+class RequestTest(helpers.ExtendedTestCase):
+  """Tests the request helpers."""
+
+  def setUp(self):
+    helpers.patch(self, ['clusterfuzz.http_client.get_session'])
+
+  def test_default_timeout(self):
+    """Tests that requests time out unless told otherwise."""
+    http_client.get('https://a.com', stream=True)
+    http_client.post('https://a.com', data='d', timeout=5)
+    http_client.head('https://a.com')
+
+    self.assert_exact_calls(self.mock.get_session.return_value.request, [
+        mock.call('GET', 'https://a.com', stream=True,
+                  timeout=http_client.DEFAULT_TIMEOUT),
+        mock.call('POST', 'https://a.com', data='d', timeout=5),
+        mock.call('HEAD', 'https://a.com', allow_redirects=True,
+                  timeout=http_client.DEFAULT_TIMEOUT)])
@@ -26,8 +26,12 @@ class MainTest(unittest.TestCase):
   def setUp(self):
     helpers.patch(self, [
         'clusterfuzz.commands.reproduce.execute',
-        'clusterfuzz.local_logging.start_loggers'
+        ('cache_execute', 'clusterfuzz.commands.cache.execute'),
+        'clusterfuzz.local_logging.start_loggers',
+        'clusterfuzz.daemon.connect',
+        'clusterfuzz.daemon.forward'
     ])
+    self.mock.connect.return_value = None
 
   def test_parse_reproduce(self):
     """Test parse reproduce command."""
@@ -38,29 +42,106 @@ class MainTest(unittest.TestCase):
     main.execute(['reproduce', '1234', '--build', 'chromium', '-i', '500'])
     main.execute(['reproduce', '1234', '--target-args', '--test --test2'])
     main.execute(['reproduce', '1234', '--edit-mode'])
+    main.execute(['reproduce', '1234', '--refresh'])
+    main.execute(['reproduce', '1234', '--parallel', '4'])
+    main.execute(['reproduce', '1234', '--stats', '100'])
+    main.execute(['reproduce', '--batch', 'ids.txt', '5678', '--batch-output',
+                  'out.json'])
 
     self.mock.start_loggers.assert_has_calls([mock.call()])
     self.mock.execute.assert_has_calls([
         mock.call(build='chromium', current=False, disable_goma=False,
                   j=None, testcase_id='1234', iterations=10,
-                  disable_xvfb=True, target_args='', edit_mode=False),
+                  disable_xvfb=True, target_args='', edit_mode=False,
+                  refresh=False, parallel=1, stats=None, batch=None,
+                  batch_output='batch_results.json'),
         mock.call(build='chromium', current=True, disable_goma=False,
                   j=25, testcase_id='1234', iterations=10,
-                  disable_xvfb=False, target_args='', edit_mode=False),
+                  disable_xvfb=False, target_args='', edit_mode=False,
+                  refresh=False, parallel=1, stats=None, batch=None,
+                  batch_output='batch_results.json'),
         mock.call(build='download', current=False, disable_goma=True,
                   j=None, testcase_id='1234', iterations=10,
-                  disable_xvfb=False, target_args='', edit_mode=False),
+                  disable_xvfb=False, target_args='', edit_mode=False,
+                  refresh=False, parallel=1, stats=None, batch=None,
+                  batch_output='batch_results.json'),
         mock.call(build='standalone', current=True, disable_goma=False,
                   j=None, testcase_id='1234', iterations=10,
-                  disable_xvfb=False, target_args='', edit_mode=False),
+                  disable_xvfb=False, target_args='', edit_mode=False,
+                  refresh=False, parallel=1, stats=None, batch=None,
+                  batch_output='batch_results.json'),
         mock.call(build='chromium', current=False, disable_goma=False,
                   j=None, testcase_id='1234', iterations=500,
-                  disable_xvfb=False, target_args='', edit_mode=False),
+                  disable_xvfb=False, target_args='', edit_mode=False,
+                  refresh=False, parallel=1, stats=None, batch=None,
+                  batch_output='batch_results.json'),
         mock.call(build='chromium', current=False, disable_goma=False,
                   j=None, testcase_id='1234', iterations=10,
                   disable_xvfb=False, target_args='--test --test2',
-                  edit_mode=False),
+                  edit_mode=False, refresh=False, parallel=1, stats=None,
+                  batch=None, batch_output='batch_results.json'),
         mock.call(build='chromium', current=False, disable_goma=False,
                   j=None, testcase_id='1234', iterations=10,
-                  disable_xvfb=False, target_args='', edit_mode=True)
+                  disable_xvfb=False, target_args='', edit_mode=True,
+                  refresh=False, parallel=1, stats=None, batch=None,
+                  batch_output='batch_results.json'),
+        mock.call(build='chromium', current=False, disable_goma=False,
+                  j=None, testcase_id='1234', iterations=10,
+                  disable_xvfb=False, target_args='', edit_mode=False,
+                  refresh=True, parallel=1, stats=None, batch=None,
+                  batch_output='batch_results.json'),
+        mock.call(build='chromium', current=False, disable_goma=False,
+                  j=None, testcase_id='1234', iterations=10,
+                  disable_xvfb=False, target_args='', edit_mode=False,
+                  refresh=False, parallel=4, stats=None, batch=None,
+                  batch_output='batch_results.json'),
+        mock.call(build='chromium', current=False, disable_goma=False,
+                  j=None, testcase_id='1234', iterations=10,
+                  disable_xvfb=False, target_args='', edit_mode=False,
+                  refresh=False, parallel=1, stats=100, batch=None,
+                  batch_output='batch_results.json'),
+        mock.call(build='chromium', current=False, disable_goma=False,
+                  j=None, testcase_id=None, iterations=10,
+                  disable_xvfb=False, target_args='', edit_mode=False,
+                  refresh=False, parallel=1, stats=None,
+                  batch=['ids.txt', '5678'], batch_output='out.json')
     ])
+
+  def test_parse_reproduce_without_testcase(self):
+    """Test that reproduce needs a testcase ID or --batch."""
+    with self.assertRaises(SystemExit):
+      main.execute(['reproduce', '--disable-xvfb'])
+    self.assertFalse(self.mock.execute.called)
+
+  def test_parse_cache(self):
+    """Test parse cache command."""
+    main.execute(['cache', 'list'])
+    main.execute(['cache', 'prune', '--size', '20G'])
+    main.execute(['cache', 'prewarm', '1', '2', '-j', '3'])
+
+    self.mock.cache_execute.assert_has_calls([
+        mock.call(action='list', size=None, testcase_ids=None, j=4),
+        mock.call(action='prune', size='20G', testcase_ids=None, j=4),
+        mock.call(action='prewarm', size=None, testcase_ids=['1', '2'], j=3)
+    ])
+
+  def test_forward_to_daemon(self):
+    """Test that commands are forwarded to a running daemon."""
+    self.mock.connect.return_value = mock.Mock()
+    self.mock.forward.return_value = 3
+
+    with self.assertRaises(SystemExit) as cm:
+      main.execute(['reproduce', '1234'])
+    self.assertEqual(cm.exception.code, 3)
+    self.mock.forward.assert_called_once_with(
+        self.mock.connect.return_value, ['reproduce', '1234'])
+    self.assertFalse(self.mock.execute.called)
+    self.assertFalse(self.mock.start_loggers.called)
+
+  def test_serve_not_forwarded(self):
+    """Test that serve runs locally."""
+    self.mock.connect.return_value = mock.Mock()
+    with mock.patch('clusterfuzz.commands.serve.execute') as serve_execute:
+      main.execute(['serve'])
+    serve_execute.assert_called_once_with()
+    self.assertFalse(self.mock.forward.called)
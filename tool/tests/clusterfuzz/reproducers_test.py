@@ -15,7 +15,14 @@
 
 import os
 import json
+import shutil
+import signal
+import socket
+import tempfile
+import threading
+import time
 import mock
+import requests
 
 import helpers
 from clusterfuzz import reproducers
@@ -24,7 +31,7 @@ from clusterfuzz import common
 def patch_stacktrace_info(obj):
   """Patches get_stacktrace_info for initializing a Reproducer."""
 
-  patcher = mock.patch('requests.post',
+  patcher = mock.patch('clusterfuzz.http_client.post',
                        return_value=mock.Mock(text=json.dumps({
                            'crash_state': 'original\nstate',
                            'crash_type': 'original_type'})))
@@ -38,6 +45,7 @@ def create_reproducer(klass):
   binary_provider = mock.Mock(symbolizer_path='/path/to/symbolizer')
   binary_provider.get_binary_path.return_value = '/fake/build_dir/test_binary'
   binary_provider.get_build_directory.return_value = '/fake/build_dir'
+  binary_provider.extract_missing_files.return_value = False
   testcase = mock.Mock(gestures=None, stacktrace_lines=[{'content': 'line'}],
                        job_type='job_type', reproduction_args='--original')
   reproducer = klass(binary_provider, testcase, 'UBSAN', False, '--test', False)
@@ -174,14 +182,15 @@ class ReproduceCrashTest(helpers.ExtendedTestCase):
         mocked_provider, mocked_testcase, 'UBSAN', False, '--test', False)
     reproducer.setup_args()
     reproducer.reproduce_crash()
-    self.assert_exact_calls(self.mock.execute, [
+    self.assert_exact_calls(self.mock.start_execute, [
         mock.call(
             '/chrome/source/folder/d8',
             '--repro --test %s' % self.testcase_path,
             '/chrome/source/folder',
-            env={'ASAN_OPTIONS': 'test-asan'},
-            exit_on_error=False)
+            env={'ASAN_OPTIONS': 'test-asan'})
     ])
+    self.assert_exact_calls(self.mock.wait_execute, [
+        mock.call(self.mock.start_execute.return_value, exit_on_error=False)])
 
   def test_base_with_env_args(self):
     """Test base's reproduce_crash with environment args."""
@@ -201,15 +210,46 @@ class ReproduceCrashTest(helpers.ExtendedTestCase):
         mocked_provider, mocked_testcase, 'UBSAN', False, '--test', False)
     reproducer.setup_args()
     reproducer.reproduce_crash()
-    self.assert_exact_calls(self.mock.execute, [
+    self.assert_exact_calls(self.mock.start_execute, [
         mock.call(
             '/chrome/source/folder/d8',
             '--app-dir=%s --testcase=%s --test' % (self.app_directory,
                                                    self.testcase_path),
             '/chrome/source/folder',
-            env={'ASAN_OPTIONS': 'test-asan'},
-            exit_on_error=False)
+            env={'ASAN_OPTIONS': 'test-asan'})
     ])
+    self.assert_exact_calls(self.mock.wait_execute, [
+        mock.call(self.mock.start_execute.return_value, exit_on_error=False)])
+
+  def test_base_attempt(self):
+    """Test base's reproduce_crash within an attempt."""
+
+    mocked_testcase = mock.Mock(
+        id=1234, reproduction_args='--repro',
+        environment={'ASAN_OPTIONS': 'test-asan'}, gestures=None,
+        stacktrace_lines=[{'content': 'line'}],
+        job_type='job_type')
+    mocked_testcase.get_testcase_path.return_value = self.testcase_path
+    mocked_provider = mock.Mock(
+        symbolizer_path='%s/llvm-symbolizer' % self.app_directory)
+    mocked_provider.get_binary_path.return_value = '%s/d8' % self.app_directory
+    mocked_provider.get_build_directory.return_value = self.app_directory
+    attempt = mock.Mock(directory='/tmp/attempt')
+
+    reproducer = reproducers.BaseReproducer(
+        mocked_provider, mocked_testcase, 'UBSAN', False, '--test', False)
+    reproducer.setup_args()
+    reproducer.reproduce_crash(attempt)
+    self.assert_exact_calls(self.mock.start_execute, [
+        mock.call(
+            '/chrome/source/folder/d8',
+            '--repro --test %s' % self.testcase_path,
+            '/chrome/source/folder',
+            env={'ASAN_OPTIONS': 'test-asan', 'TMPDIR': '/tmp/attempt'})
+    ])
+    self.assert_exact_calls(attempt.set_process, [
+        mock.call(self.mock.start_execute.return_value)])
+    self.assertEqual(reproducer.environment, {'ASAN_OPTIONS': 'test-asan'})
 
   def test_chromium(self):
     """Test chromium's reproduce_crash."""
@@ -245,7 +285,11 @@ class ReproduceCrashTest(helpers.ExtendedTestCase):
             })
     ])
     self.assert_exact_calls(self.mock.wait_execute, [mock.call(
-        self.mock.start_execute.return_value, exit_on_error=False, timeout=30)])
+        self.mock.start_execute.return_value, exit_on_error=False, timeout=30,
+        is_complete=mock.ANY)])
+    is_complete = self.mock.wait_execute.call_args[1]['is_complete']
+    self.assertFalse(is_complete('==1==ERROR: AddressSanitizer: SEGV\n'))
+    self.assertTrue(is_complete('SUMMARY: AddressSanitizer: SEGV\n'))
     self.assert_exact_calls(self.mock.run_gestures, [mock.call(
         reproducer, self.mock.start_execute.return_value, ':display')])
 
@@ -302,13 +346,14 @@ class LinuxChromeJobReproducerTest(helpers.ExtendedTestCase):
     helpers.patch(self, [
         'clusterfuzz.reproducers.BaseReproducer.pre_build_steps',
         'clusterfuzz.common.get_resource',
-        'pyfakefs.fake_filesystem.FakeFilesystem.RenameObject',
     ])
     self.mock.get_resource.return_value = 'llvm'
     os.makedirs('/tmp/clusterfuzz-user-profile-data')
     patch_stacktrace_info(self)
     self.reproducer = create_reproducer(reproducers.LinuxChromeJobReproducer)
     self.reproducer.original_testcase_path = '/fake/LayoutTests/testcase'
+    self.fs.CreateFile('/fake/testcase_dir/testcase', contents='testcase')
+    os.makedirs('/fake/source_dir/third_party/WebKit/LayoutTests')
 
   def test_reproduce_crash(self):
     """Ensures pre-build steps run correctly."""
@@ -318,37 +363,26 @@ class LinuxChromeJobReproducerTest(helpers.ExtendedTestCase):
     self.assertEqual(
         self.reproducer.testcase_path,
         '/fake/source_dir/third_party/WebKit/LayoutTests/testcase')
+    self.assertTrue(os.path.exists('/fake/testcase_dir/testcase'))
+    with open('/fake/source_dir/third_party/WebKit/LayoutTests/testcase') as f:
+      self.assertEqual(f.read(), 'testcase')
     self.assert_exact_calls(self.mock.pre_build_steps,
                             [mock.call(self.reproducer)])
     self.assertEqual(
         self.reproducer.args,
         '--always-opt --user-data-dir=/tmp/clusterfuzz-user-profile-data')
 
-class XdotoolCommandTest(helpers.ExtendedTestCase):
-  """Tests the xdotool_command method."""
-
-  def setUp(self):
-    helpers.patch(self, ['clusterfuzz.common.execute'])
-    patch_stacktrace_info(self)
-    self.reproducer = create_reproducer(reproducers.LinuxChromeJobReproducer)
-
-  def test_call(self):
-    """Tests calling the method."""
-
-    self.reproducer.xdotool_command('command to run', ':2753')
-    self.assert_exact_calls(self.mock.execute, [
-        mock.call('xdotool', 'command to run', '.', env={'DISPLAY': ':2753'})
-    ])
-
-
 class FindWindowsForProcessTest(helpers.ExtendedTestCase):
   """Tests the find_windows_for_process method."""
 
   def setUp(self):
     helpers.patch(self, [
         'clusterfuzz.reproducers.LinuxChromeJobReproducer.get_process_ids',
+        ('clusterfuzz.reproducers.LinuxChromeJobReproducer.'
+         'list_visible_windows'),
         'clusterfuzz.common.execute',
-        'time.sleep'])
+        'time.sleep',
+        'time.time'])
     patch_stacktrace_info(self)
     self.reproducer = create_reproducer(reproducers.LinuxChromeJobReproducer)
 
@@ -360,16 +394,51 @@ class FindWindowsForProcessTest(helpers.ExtendedTestCase):
     self.reproducer.find_windows_for_process(1234, ':45434')
     self.assert_n_calls(0, [self.mock.execute])
 
+  def test_settle(self):
+    """Tests that it returns once the windows stop changing."""
+
+    self.mock.get_process_ids.return_value = [1234]
+    self.mock.time.side_effect = [0, 0, 0.5, 1, 1.5, 2, 2.5, 3]
+    self.mock.list_visible_windows.side_effect = [
+        set(), set(['1']), set(['1', '2']), set(['1', '2']), set(['1', '2']),
+        set(['1', '2'])]
+
+    result = self.reproducer.find_windows_for_process(1234, ':45434',
+                                                      settle_time=1)
+    self.assertEqual(result, set(['1', '2']))
+    self.assertEqual(4, self.mock.sleep.call_count)
+    self.assertEqual(5, self.mock.list_visible_windows.call_count)
+
+  def test_timeout(self):
+    """Tests that it gives up waiting after the timeout."""
+
+    self.mock.get_process_ids.return_value = [1234]
+    self.mock.time.side_effect = [0, 0, 10, 20]
+    self.mock.list_visible_windows.side_effect = [
+        set(['1']), set(['1', '2']), set(['1', '2', '3'])]
+
+    result = self.reproducer.find_windows_for_process(1234, ':45434',
+                                                      timeout=20)
+    self.assertEqual(result, set(['1', '2', '3']))
+    self.assertEqual(2, self.mock.sleep.call_count)
+
+
+class ListVisibleWindowsTest(helpers.ExtendedTestCase):
+  """Tests the list_visible_windows method."""
+
+  def setUp(self):
+    helpers.patch(self, ['clusterfuzz.common.execute'])
+    patch_stacktrace_info(self)
+    self.reproducer = create_reproducer(reproducers.LinuxChromeJobReproducer)
+
   def test_dedup_pids(self):
     """Tests when duplicate pids are introduced."""
 
-    self.mock.get_process_ids.return_value = [1234, 5678]
     self.mock.execute.side_effect = [(0, '234\n567\nabcd\n890'),
                                      (0, '123\n567\n345')]
 
-    result = self.reproducer.find_windows_for_process(1234, ':45434')
+    result = self.reproducer.list_visible_windows([1234, 5678], ':45434')
     self.assertEqual(result, set(['234', '567', '890', '123', '345']))
-    self.assert_exact_calls(self.mock.sleep, [mock.call(20)])
 
 
 class GetProcessIdsTest(helpers.ExtendedTestCase):
@@ -419,18 +488,15 @@ class RunGesturesTest(helpers.ExtendedTestCase):
   def setUp(self):
     helpers.patch(self, [
         'time.sleep',
-        ('clusterfuzz.reproducers.LinuxChromeJobReproducer.get_gesture_start_'
-         'time'),
         ('clusterfuzz.reproducers.LinuxChromeJobReproducer.find_windows_for'
          '_process'),
-        'clusterfuzz.reproducers.LinuxChromeJobReproducer.xdotool_command',
-        'clusterfuzz.reproducers.LinuxChromeJobReproducer.execute_gesture'])
+        ('clusterfuzz.reproducers.LinuxChromeJobReproducer.execute_gesture_'
+         'script')])
     patch_stacktrace_info(self)
     self.reproducer = create_reproducer(reproducers.LinuxChromeJobReproducer)
-    self.mock.get_gesture_start_time.return_value = 5
     self.mock.find_windows_for_process.return_value = ['123']
-    self.reproducer.gestures = ['windowsize,2', 'type,\'ValeM1khbW4Gt!\'',
-                                'Trigger:2']
+    self.mock.execute_gesture_script.return_value = [0.1, 0.2, 0.3]
+    self.reproducer.gestures = ['windowsize,2', 'type,\'ValeM1khbW4Gt!\'']
     self.reproducer.gesture_start_time = 5
 
   def test_execute_gestures(self):
@@ -438,10 +504,55 @@ class RunGesturesTest(helpers.ExtendedTestCase):
 
     self.reproducer.run_gestures(mock.Mock(pid=1234), ':display')
 
-    self.assert_exact_calls(self.mock.xdotool_command, [
-        mock.call(self.reproducer, 'windowactivate --sync 123', ':display')])
+    self.assert_exact_calls(self.mock.execute_gesture_script, [
+        mock.call(self.reproducer, [
+            ('windowactivate 123', 'windowactivate --sync 123'),
+            ('windowsize,2', 'windowsize 123 2'),
+            ('type,\'ValeM1khbW4Gt!\'', 'type -- ValeM1khbW4Gt!')],
+                  ':display')])
     self.assert_exact_calls(self.mock.sleep, [mock.call(5)])
 
+  def test_no_windows(self):
+    """Tests that xdotool doesn't run without windows."""
+
+    self.mock.find_windows_for_process.return_value = []
+    self.reproducer.run_gestures(mock.Mock(pid=1234), ':display')
+    self.assert_n_calls(0, [self.mock.execute_gesture_script])
+
+
+class ExecuteGestureScriptTest(helpers.ExtendedTestCase):
+  """Tests the execute_gesture_script method."""
+
+  def setUp(self):
+    helpers.patch(self, ['clusterfuzz.common.start_execute',
+                         'clusterfuzz.common.read_output',
+                         'time.time'])
+    patch_stacktrace_info(self)
+    self.reproducer = create_reproducer(reproducers.LinuxChromeJobReproducer)
+    self.mock.time.side_effect = [10, 11, 13.5]
+    self.mock.read_output.return_value = iter([
+        'x:1 y:2 scr', 'een:0 window:3\nx:1 y:2 screen:0 window:3\n'])
+
+  def test_execute(self):
+    """Tests running all steps in one xdotool process."""
+
+    durations = self.reproducer.execute_gesture_script(
+        [('activate', 'windowactivate --sync 1'), ('key', 'key -- a')],
+        ':display')
+
+    self.assertEqual(durations, [1, 2.5])
+    process = self.mock.start_execute.return_value
+    self.assert_exact_calls(self.mock.start_execute, [
+        mock.call('xdotool', '-', '.', env={'DISPLAY': ':display'},
+                  print_command=False)])
+    self.assert_exact_calls(process.stdin.write, [
+        mock.call('windowactivate --sync 1\ngetmouselocation\n'
+                  'key -- a\ngetmouselocation\n')])
+    self.assert_exact_calls(process.stdin.close, [mock.call()])
+    self.assert_exact_calls(self.mock.read_output, [
+        mock.call(process, timeout=reproducers.TEST_TIMEOUT)])
+    self.assert_exact_calls(process.wait, [mock.call()])
+
 
 class GetGestureStartTimeTest(helpers.ExtendedTestCase):
   """Test the get_gesture_start_time method."""
@@ -462,103 +573,456 @@ class GetGestureStartTimeTest(helpers.ExtendedTestCase):
     self.assertEqual(result, 5)
 
 
-class ExecuteGestureTest(helpers.ExtendedTestCase):
-  """Test the execute_gesture method."""
+class CompileGestureTest(helpers.ExtendedTestCase):
+  """Test the compile_gesture method."""
 
   def setUp(self):
-    helpers.patch(self, [
-        'clusterfuzz.reproducers.LinuxChromeJobReproducer.xdotool_command'])
     patch_stacktrace_info(self)
     self.reproducer = create_reproducer(reproducers.LinuxChromeJobReproducer)
-    self.reproducer.gestures = ['windowsize,2', 'type,\'ValeM1khbW4Gt!\'']
 
-  def test_call_execute_gesture(self):
+  def test_compile_gesture(self):
     """Test parsing gestures."""
 
-    for gesture in self.reproducer.gestures:
-      self.reproducer.execute_gesture(gesture, '12345', ':display')
+    self.assertEqual(
+        self.reproducer.compile_gesture('windowsize,2', '12345'),
+        'windowsize 12345 2')
+    self.assertEqual(
+        self.reproducer.compile_gesture('type,\'ValeM1khbW4Gt!\'', '12345'),
+        'type -- ValeM1khbW4Gt!')
+    self.assertEqual(
+        self.reproducer.compile_gesture('type,\'a, b\'', '12345'),
+        'type -- a, b')
+    self.assertEqual(
+        self.reproducer.compile_gesture('type,it\'s', '12345'),
+        'type -- it\'s')
 
-    self.assert_exact_calls(self.mock.xdotool_command, [
-        mock.call(self.reproducer, 'windowsize 12345 2', ':display'),
-        mock.call(self.reproducer, 'type -- \'ValeM1khbW4Gt!\'', ':display')])
 
+class WaitForDisplayTest(helpers.ExtendedTestCase):
+  """Tests wait_for_display."""
 
-class XvfbTest(helpers.ExtendedTestCase):
-  """Used to test the Xvfb context manager."""
+  def setUp(self):
+    self.socket_dir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.socket_dir)
+    helpers.patch(self, ['time.sleep'])
+    for name, value in [('X_SOCKET_DIR', self.socket_dir),
+                        ('DISPLAY_READY_TIMEOUT', 0.2)]:
+      patcher = mock.patch.object(reproducers, name, value)
+      patcher.start()
+      self.addCleanup(patcher.stop)
+
+  def test_ready(self):
+    """Ensures it returns once the X server listens."""
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    self.addCleanup(server.close)
+    server.bind(os.path.join(self.socket_dir, 'X99'))
+    server.listen(1)
+
+    reproducers.wait_for_display(':99')
+    self.assert_n_calls(0, [self.mock.sleep])
+
+  def test_timeout(self):
+    """Ensures an error is raised when the X server never listens."""
+    with self.assertRaises(common.ExpectedException):
+      reproducers.wait_for_display(':99')
+    self.assertTrue(self.mock.sleep.called)
+
+
+class DisplayTest(helpers.ExtendedTestCase):
+  """Tests the Display class."""
 
   def setUp(self):
     helpers.patch(self, ['xvfbwrapper.Xvfb',
                          'subprocess.Popen',
-                         'time.sleep'])
-
-  def test_correct_oserror_exception(self):
-    """Ensures the correct exception is raised when Xvfb is not found."""
-
-    def _raise_with_message(*_unused, **_kwunused):
-      del _unused, _kwunused #Not used by this method
-      raise OSError('[Errno 2] No such file or directory')
-
-    self.mock.Popen.side_effect = _raise_with_message
+                         'clusterfuzz.reproducers.wait_for_display'])
     self.mock.Xvfb.return_value = mock.Mock(xvfb_cmd=['not_display',
                                                       ':display'])
+    self.mock.Xvfb.return_value.proc.poll.return_value = None
+    self.mock.Popen.return_value.poll.return_value = None
+    self.display = reproducers.Display()
+
+  def test_start_stop(self):
+    """Ensures Xvfb and blackbox are started once Xvfb is ready."""
+    self.display.start()
+    self.assertEqual(self.display.name, ':display')
+    self.assert_exact_calls(self.mock.Xvfb, [mock.call(
+        width=1280, height=1024)])
+    self.assert_exact_calls(self.mock.Xvfb.return_value.start, [mock.call()])
+    self.assert_exact_calls(self.mock.wait_for_display,
+                            [mock.call(':display')])
+    self.assert_exact_calls(self.mock.Popen, [
+        mock.call(['blackbox'], env={'DISPLAY': ':display'})])
 
-    with self.assertRaises(common.NotInstalledError):
-      with reproducers.Xvfb(False) as display_name:
-        self.assertNotEqual(display_name, ':display')
+    self.display.stop()
+    self.assert_exact_calls(self.mock.Popen.return_value.kill, [mock.call()])
+    self.assert_exact_calls(self.mock.Xvfb.return_value.stop, [mock.call()])
 
-    self.assert_n_calls(0, [self.mock.Popen.return_value.kill,
-                            self.mock.sleep,
-                            self.mock.Xvfb.return_value.stop])
+  def test_blackbox_not_installed(self):
+    """Ensures the correct exception is raised when blackbox is not found."""
+    self.mock.Popen.side_effect = OSError('[Errno 2] No such file or directory')
 
-  def test_incorrect_oserror_exception(self):
-    """Ensures OSError raises when message is not Errno 2."""
+    with self.assertRaises(common.NotInstalledError):
+      self.display.start()
+    self.assert_exact_calls(self.mock.Xvfb.return_value.stop, [mock.call()])
 
+  def test_blackbox_other_error(self):
+    """Ensures OSError raises when message is not Errno 2."""
     self.mock.Popen.side_effect = OSError
-    self.mock.Xvfb.return_value = mock.Mock(xvfb_cmd=['not_display',
-                                                      ':display'])
 
     with self.assertRaises(OSError):
-      with reproducers.Xvfb(False) as display_name:
-        self.assertNotEqual(display_name, ':display')
+      self.display.start()
+    self.assert_exact_calls(self.mock.Xvfb.return_value.stop, [mock.call()])
+
+  def test_reset_alive(self):
+    """Ensures nothing is restarted when both processes are alive."""
+    self.display.start()
+    self.display.reset()
+    self.assertEqual(1, self.mock.Xvfb.return_value.start.call_count)
+    self.assertEqual(1, self.mock.Popen.call_count)
+
+  def test_reset_blackbox_died(self):
+    """Ensures a dead window manager is restarted."""
+    self.display.start()
+    self.mock.Popen.return_value.poll.return_value = 1
+    self.display.reset()
+    self.assertEqual(1, self.mock.Xvfb.return_value.start.call_count)
+    self.assertEqual(2, self.mock.Popen.call_count)
+
+  def test_reset_xvfb_died(self):
+    """Ensures a dead display is started again."""
+    self.display.start()
+    self.mock.Xvfb.return_value.proc.poll.return_value = 1
+    self.display.reset()
+    self.assert_exact_calls(self.mock.Xvfb.return_value.stop, [mock.call()])
+    self.assertEqual(2, self.mock.Xvfb.return_value.start.call_count)
+    self.assertEqual(2, self.mock.Popen.call_count)
+
+
+class DisplayPoolTest(helpers.ExtendedTestCase):
+  """Tests the DisplayPool class."""
 
-    self.assert_n_calls(0, [self.mock.Popen.return_value.kill,
-                            self.mock.sleep,
-                            self.mock.Xvfb.return_value.stop])
+  def setUp(self):
+    helpers.patch(self, ['clusterfuzz.reproducers.Display',
+                         'atexit.register'])
+    self.mock.Display.side_effect = lambda: mock.Mock()
+    self.pool = reproducers.DisplayPool()
+
+  def test_reuse(self):
+    """Ensures released displays are reset and handed out again."""
+    first = self.pool.acquire()
+    second = self.pool.acquire()
+    self.assertIsNot(first, second)
+    self.assertEqual(2, self.mock.Display.call_count)
+    self.assert_exact_calls(first.start, [mock.call()])
+    self.assert_exact_calls(self.mock.register, [mock.call(self.pool.stop)])
+
+    self.pool.release(first)
+    self.assert_exact_calls(first.reset, [mock.call()])
+    self.assertIs(self.pool.acquire(), first)
+    self.assertEqual(2, self.mock.Display.call_count)
+
+    self.pool.stop()
+    self.assert_exact_calls(first.stop, [mock.call()])
+    self.assert_exact_calls(second.stop, [mock.call()])
+
+  def test_reset_failure(self):
+    """Ensures a display that can't be reset is dropped."""
+    display = self.pool.acquire()
+    display.reset.side_effect = common.NotInstalledError('blackbox')
 
-  def test_start_stop_blackbox(self):
-    """Tests that the context manager starts/stops xvfbwrapper and blackbox."""
+    with self.assertRaises(common.NotInstalledError):
+      self.pool.release(display)
+    self.assertIsNot(self.pool.acquire(), display)
+    self.pool.stop()
+    self.assert_n_calls(0, [display.stop])
 
-    self.mock.Xvfb.return_value = mock.Mock(xvfb_cmd=['not_display',
-                                                      ':display'])
 
-    with reproducers.Xvfb(False) as display_name:
-      self.assertEqual(display_name, ':display')
+class XvfbTest(helpers.ExtendedTestCase):
+  """Used to test the Xvfb context manager."""
 
-    self.assert_exact_calls(self.mock.Xvfb, [mock.call(
-        width=1280, height=1024)])
-    self.assert_exact_calls(self.mock.Xvfb.return_value.start, [mock.call()])
-    self.assert_exact_calls(self.mock.Xvfb.return_value.stop,
-                            [mock.call.stop()])
-    self.assert_exact_calls(self.mock.Popen, [
-        mock.call(['blackbox'], env={'DISPLAY': ':display'})])
-    self.assert_exact_calls(self.mock.Popen.return_value.kill, [mock.call()])
-    self.assert_exact_calls(self.mock.sleep, [mock.call(3)])
+  def setUp(self):
+    helpers.patch(self, ['clusterfuzz.reproducers.DisplayPool.acquire',
+                         'clusterfuzz.reproducers.DisplayPool.release'])
+    self.mock.acquire.return_value = mock.Mock()
+    self.mock.acquire.return_value.name = ':display'
 
-  def test_no_blackbox(self):
-    """Tests that the manager doesnt start blackbox when disabled."""
+  def test_acquire_release(self):
+    """Ensures a display of the pool is used and given back."""
+    with reproducers.Xvfb(False) as display_name:
+      self.assertEqual(display_name, ':display')
+      self.assert_n_calls(0, [self.mock.release])
 
-    self.mock.Xvfb.return_value = mock.Mock(xvfb_cmd=['not_display',
-                                                      ':display'])
+    self.assert_exact_calls(self.mock.acquire, [
+        mock.call(reproducers.DISPLAY_POOL)])
+    self.assert_exact_calls(self.mock.release, [
+        mock.call(reproducers.DISPLAY_POOL, self.mock.acquire.return_value)])
 
+  def test_disabled(self):
+    """Tests that no display is used when disabled."""
     with reproducers.Xvfb(True) as display_name:
       self.assertEqual(display_name, None)
 
-    self.assert_n_calls(0, [self.mock.Xvfb,
-                            self.mock.Xvfb.return_value.start,
-                            self.mock.Xvfb.return_value.stop,
-                            self.mock.Popen,
-                            self.mock.Popen.return_value.kill,
-                            self.mock.sleep])
+    self.assert_n_calls(0, [self.mock.acquire, self.mock.release])
+
+
+class GetStacktraceInfoTest(helpers.ExtendedTestCase):
+  """Tests the get_stacktrace_info method."""
+
+  def setUp(self):
+    patch_stacktrace_info(self)
+    self.reproducer = create_reproducer(reproducers.BaseReproducer)
+    helpers.patch(self, ['clusterfuzz.http_client.post'])
+
+  def test_local(self):
+    """Tests that recognized stacktraces are parsed locally."""
+    result = self.reproducer.get_stacktrace_info(
+        '==1==ERROR: AddressSanitizer: stack-overflow on address 0x7ffe\n'
+        '    #0 0x4f2a60 in foo::Bar(int) /src/foo.cc:23:3\n')
+
+    self.assertEqual(result, (['foo::Bar'], 'Stack-overflow'))
+    self.assert_n_calls(0, [self.mock.post])
+
+  def test_not_remote_by_default(self):
+    """Tests that unrecognized stacktraces aren't posted unless enabled."""
+    self.assertEqual(
+        self.reproducer.get_stacktrace_info('unknown output'), ([], ''))
+    self.assert_n_calls(0, [self.mock.post])
+
+  def test_remote(self):
+    """Tests that unrecognized stacktraces are posted to ClusterFuzz."""
+    self.mock_os_environment({'CF_REMOTE_STACKTRACE_PARSING': '1'})
+    self.mock.post.return_value = mock.Mock(text=json.dumps({
+        'crash_state': 'remote\nstate', 'crash_type': 'remote_type'}))
+
+    result = self.reproducer.get_stacktrace_info('unknown output')
+
+    self.assertEqual(result, (['remote', 'state'], 'remote_type'))
+    self.assert_exact_calls(self.mock.post, [mock.call(
+        'https://clusterfuzz.com/v2/parse_stacktrace',
+        data=json.dumps({'job': 'job_type', 'stacktrace': 'unknown output'}),
+        timeout=reproducers.PARSE_STACKTRACE_TIMEOUT)])
+
+  def test_offline(self):
+    """Tests unrecognized stacktraces when ClusterFuzz can't be reached."""
+    self.mock_os_environment({'CF_REMOTE_STACKTRACE_PARSING': '1'})
+    self.mock.post.side_effect = requests.ConnectionError()
+
+    self.assertEqual(
+        self.reproducer.get_stacktrace_info('unknown output'), ([], ''))
+
+
+class LinuxChromeAttemptSettingsTest(helpers.ExtendedTestCase):
+  """Tests LinuxChromeJobReproducer.get_attempt_settings."""
+
+  def setUp(self):
+    patch_stacktrace_info(self)
+    self.reproducer = create_reproducer(reproducers.LinuxChromeJobReproducer)
+    self.reproducer.args = (
+        '--always-opt --user-data-dir=/tmp/clusterfuzz-user-profile-data')
+    self.reproducer.environment = {'ASAN_OPTIONS': 'test-asan'}
+
+  def test_no_attempt(self):
+    """Ensures the shared profile is used without an attempt."""
+    self.assertEqual(
+        self.reproducer.get_attempt_settings(None),
+        (self.reproducer.args, {'ASAN_OPTIONS': 'test-asan'}))
+
+  def test_attempt(self):
+    """Ensures an attempt uses its own profile and temporary directory."""
+    attempt = mock.Mock(directory='/tmp/attempt')
+    self.assertEqual(
+        self.reproducer.get_attempt_settings(attempt),
+        ('--always-opt --user-data-dir=/tmp/attempt/user-profile',
+         {'ASAN_OPTIONS': 'test-asan', 'TMPDIR': '/tmp/attempt'}))
+
+
+class AttemptTest(helpers.ExtendedTestCase):
+  """Tests the Attempt class."""
+
+  def setUp(self):
+    helpers.patch(self, ['clusterfuzz.common.kill_process_group',
+                         'tempfile.mkdtemp'])
+    self.mock.mkdtemp.return_value = '/tmp/attempt'
+    self.attempt = reproducers.Attempt(2)
+    self.process = mock.Mock()
+
+  def test_init(self):
+    """Ensures every attempt gets a directory."""
+    self.assertEqual(self.attempt.directory, '/tmp/attempt')
+    self.assert_exact_calls(self.mock.mkdtemp, [
+        mock.call(prefix='clusterfuzz-attempt-2-')])
+
+  def test_cancel_running(self):
+    """Ensures cancelling kills the running process."""
+    self.attempt.set_process(self.process)
+    self.assert_n_calls(0, [self.mock.kill_process_group])
+    self.attempt.cancel()
+    self.assertTrue(self.attempt.cancelled)
+    self.assert_exact_calls(self.mock.kill_process_group, [
+        mock.call(self.process, signal.SIGKILL)])
+
+  def test_cancel_before_start(self):
+    """Ensures a process started after cancelling is killed."""
+    self.attempt.cancel()
+    self.assert_n_calls(0, [self.mock.kill_process_group])
+    self.attempt.set_process(self.process)
+    self.assert_exact_calls(self.mock.kill_process_group, [
+        mock.call(self.process, signal.SIGKILL)])
+
+
+class ReproduceInParallelTest(helpers.ExtendedTestCase):
+  """Tests reproducing with several attempts at once."""
+
+  def setUp(self):
+    patch_stacktrace_info(self)
+    self.reproducer = create_reproducer(reproducers.BaseReproducer)
+    helpers.patch(self, [
+        'clusterfuzz.reproducers.BaseReproducer.pre_build_steps',
+        'clusterfuzz.reproducers.BaseReproducer.reproduce_crash',
+        'clusterfuzz.reproducers.BaseReproducer.is_reproduced',
+        'clusterfuzz.reproducers.Attempt.cleanup',
+        'clusterfuzz.common.kill_process_group',
+        'tempfile.mkdtemp'])
+    self.mock.mkdtemp.return_value = '/tmp/attempt'
+    self.mock.reproduce_crash.side_effect = (
+        lambda _, attempt: (0, 'output %d' % attempt.number))
+
+  def test_no_match(self):
+    """Ensures every attempt runs when none of them matches."""
+    self.mock.is_reproduced.return_value = False
+
+    with self.assertRaises(SystemExit):
+      self.reproducer.reproduce(5, 2)
+    self.assertEqual(5, self.mock.reproduce_crash.call_count)
+    self.assertEqual(5, self.mock.cleanup.call_count)
+    self.assert_n_calls(0, [self.mock.kill_process_group])
+
+  def test_match(self):
+    """Ensures a matching attempt cancels the others and stops the run."""
+    self.mock.is_reproduced.side_effect = (
+        lambda _, output: output == 'output 1')
+    started = threading.Event()
+    cancelled = []
+
+    def reproduce_crash(_, attempt):
+      if attempt.number == 1:
+        started.wait(5)
+        return 0, 'output 1'
+      attempt.set_process(mock.Mock())
+      started.set()
+      while not attempt.cancelled:
+        time.sleep(0.01)
+      cancelled.append(attempt.number)
+      return -9, 'killed'
+    self.mock.reproduce_crash.side_effect = reproduce_crash
+
+    self.assertTrue(self.reproducer.reproduce(10, 2))
+    self.assertEqual(cancelled, [2])
+    self.assertEqual(1, self.mock.kill_process_group.call_count)
+    self.assertEqual(2, self.mock.reproduce_crash.call_count)
+    self.assertEqual(2, self.mock.cleanup.call_count)
+
+  def test_isolated(self):
+    """Ensures an isolated attempt runs in its own directory."""
+    self.mock.is_reproduced.return_value = True
+
+    self.assertTrue(self.reproducer.reproduce(3, isolated=True))
+    self.assertEqual(1, self.mock.reproduce_crash.call_count)
+    attempt = self.mock.reproduce_crash.call_args[0][1]
+    self.assertEqual(attempt.directory, '/tmp/attempt')
+
+  def test_sequential(self):
+    """Ensures a single attempt at a time doesn't use the pool."""
+    self.mock.is_reproduced.return_value = True
+    self.reproducer.binary_provider.extract_missing_files.return_value = False
+    self.mock.reproduce_crash.side_effect = None
+    self.mock.reproduce_crash.return_value = (0, 'output')
+
+    self.assertTrue(self.reproducer.reproduce(3))
+    self.assert_exact_calls(self.mock.reproduce_crash, [
+        mock.call(self.reproducer)])
+    self.assert_n_calls(0, [self.mock.mkdtemp])
+
+
+class GetPercentileTest(helpers.ExtendedTestCase):
+  """Tests get_percentile."""
+
+  def test_percentiles(self):
+    """Ensures the nearest rank is picked."""
+    values = range(1, 11)
+    self.assertEqual(reproducers.get_percentile(values, 50), 5)
+    self.assertEqual(reproducers.get_percentile(values, 90), 9)
+    self.assertEqual(reproducers.get_percentile(values, 99), 10)
+    self.assertEqual(reproducers.get_percentile([3], 50), 3)
+
+
+class SummarizeAttemptsTest(helpers.ExtendedTestCase):
+  """Tests summarize_attempts."""
+
+  def test_summarize(self):
+    """Ensures signatures are counted and the match rate is computed."""
+    results = [
+        {'crashType': 'type', 'crashState': ['a', 'b'], 'matches': True,
+         'wallTime': 4.0},
+        {'crashType': 'other', 'crashState': ['c'], 'matches': False,
+         'wallTime': 1.0},
+        {'crashType': 'type', 'crashState': ['a', 'b'], 'matches': True,
+         'wallTime': 2.0},
+        {'crashType': '', 'crashState': [], 'matches': False,
+         'wallTime': 3.0}]
+
+    stats = reproducers.summarize_attempts(results)
+    self.assertEqual(stats['attempts'], 4)
+    self.assertEqual(stats['matches'], 2)
+    self.assertEqual(stats['matchRate'], 0.5)
+    self.assertEqual(stats['signatures'][0], {
+        'crashType': 'type', 'crashState': ['a', 'b'], 'matches': True,
+        'count': 2})
+    self.assertItemsEqual(stats['signatures'][1:], [
+        {'crashType': 'other', 'crashState': ['c'], 'matches': False,
+         'count': 1},
+        {'crashType': '', 'crashState': [], 'matches': False, 'count': 1}])
+    self.assertEqual(stats['wallTime'], {
+        'min': 1.0, 'p50': 2.0, 'p90': 4.0, 'p99': 4.0, 'max': 4.0})
+
+
+class ReproduceStatsTest(helpers.ExtendedTestCase):
+  """Tests reproduce_stats."""
+
+  def setUp(self):
+    patch_stacktrace_info(self)
+    self.reproducer = create_reproducer(reproducers.BaseReproducer)
+    helpers.patch(self, [
+        'clusterfuzz.reproducers.BaseReproducer.pre_build_steps',
+        'clusterfuzz.reproducers.BaseReproducer.reproduce_crash',
+        'clusterfuzz.reproducers.BaseReproducer.get_stacktrace_info',
+        'clusterfuzz.reproducers.Attempt.cleanup',
+        'tempfile.mkdtemp'])
+    self.mock.mkdtemp.return_value = '/tmp/attempt'
+    self.mock.reproduce_crash.side_effect = (
+        lambda _, attempt: (0, 'output %d' % attempt.number))
+    self.mock.get_stacktrace_info.side_effect = (
+        lambda _, output: ((['original', 'state'], 'original_type')
+                           if output in ('output 1', 'output 3')
+                           else (['other'], 'other_type')))
+    self.reproducer.crash_type = 'original_type'
+    self.reproducer.crash_state = ['original', 'state']
+
+  def test_stats(self):
+    """Ensures every attempt runs and the statistics are returned."""
+    stats = self.reproducer.reproduce_stats(4, 2)
+
+    self.assertEqual(4, self.mock.reproduce_crash.call_count)
+    self.assertEqual(4, self.mock.cleanup.call_count)
+    self.assertEqual(stats['attempts'], 4)
+    self.assertEqual(stats['matches'], 2)
+    self.assertEqual(stats['matchRate'], 0.5)
+    self.assertEqual(stats['signatures'], [
+        {'crashType': 'original_type', 'crashState': ['original', 'state'],
+         'matches': True, 'count': 2},
+        {'crashType': 'other_type', 'crashState': ['other'],
+         'matches': False, 'count': 2}])
+    self.assertItemsEqual(
+        stats['wallTime'].keys(), ['min', 'p50', 'p90', 'p99', 'max'])
 
 
 class ReproduceTest(helpers.ExtendedTestCase):
@@ -570,9 +1034,9 @@ class ReproduceTest(helpers.ExtendedTestCase):
     helpers.patch(self, [
         'clusterfuzz.reproducers.LinuxChromeJobReproducer.reproduce_crash',
         'clusterfuzz.reproducers.LinuxChromeJobReproducer.post_run_symbolize',
-        'requests.post',
+        'clusterfuzz.reproducers.LinuxChromeJobReproducer.get_stacktrace_info',
         'time.sleep'])
-    self.mock.reproduce_crash.return_value = (0, ['stuff'])
+    self.mock.reproduce_crash.return_value = (0, 'stuff')
     self.mock.post_run_symbolize.return_value = 'stuff'
     self.reproducer.crash_type = 'original_type'
     self.reproducer.crash_state = ['original', 'state']
@@ -580,28 +1044,18 @@ class ReproduceTest(helpers.ExtendedTestCase):
 
   def test_bad_stacktrace(self):
     """Tests system exit when the stacktrace doesn't match."""
-
-    wrong_response = {
-        'crash_type': 'wrong type',
-        'crash_state': 'incorrect\nstate2'}
-    self.mock.post.side_effect = [
-        mock.Mock(text=json.dumps(wrong_response)),
-        mock.Mock(text=json.dumps(wrong_response))]
+    self.mock.get_stacktrace_info.side_effect = [
+        (['incorrect', 'state2'], 'wrong type'),
+        (['incorrect', 'state2'], 'wrong type')]
 
     with self.assertRaises(SystemExit):
       self.reproducer.reproduce(2)
 
   def test_good_stacktrace(self):
     """Tests functionality when the stacktrace matches"""
-    correct_response = {
-        'crash_type': 'original_type',
-        'crash_state': 'original\nstate'}
-    wrong_response = {
-        'crash_type': 'wrong type',
-        'crash_state': 'incorrect\nstate2'}
-    self.mock.post.side_effect = [
-        mock.Mock(text=json.dumps(wrong_response)),
-        mock.Mock(text=json.dumps(correct_response))]
+    self.mock.get_stacktrace_info.side_effect = [
+        (['incorrect', 'state2'], 'wrong type'),
+        (['original', 'state'], 'original_type')]
 
     result = self.reproducer.reproduce(10)
     self.assertTrue(result)
@@ -609,6 +1063,19 @@ class ReproduceTest(helpers.ExtendedTestCase):
         mock.call(self.reproducer), mock.call(self.reproducer)])
 
 
+  def test_missing_files(self):
+    """Tests running again when the binary misses files of the build."""
+    self.mock.get_stacktrace_info.side_effect = [
+        (['original', 'state'], 'original_type')]
+    self.reproducer.binary_provider.extract_missing_files.side_effect = [
+        True, False]
+
+    result = self.reproducer.reproduce(1)
+    self.assertTrue(result)
+    self.assert_exact_calls(self.mock.reproduce_crash, [
+        mock.call(self.reproducer), mock.call(self.reproducer)])
+
+
 class PostRunSymbolizeTest(helpers.ExtendedTestCase):
   """Tests the post_run_symbolize method."""
 
@@ -0,0 +1,143 @@
+"""Tests the module for finding the crash type and state of stacktraces."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import json
+import unittest
+
+from clusterfuzz import stack_analyzer
+
+# Each <name>.txt holds a stacktrace and <name>.json the crash type and state
+# that the ClusterFuzz parse_stacktrace endpoint returns for it.
+GOLDEN_DIR = os.path.join(os.path.dirname(__file__), 'stacktraces')
+
+
+class GoldenFilesTest(unittest.TestCase):
+  """Tests that the local results match the server's."""
+
+  def test_golden_files(self):
+    """Compares the crash info of every golden stacktrace."""
+    names = sorted(os.path.splitext(f)[0] for f in os.listdir(GOLDEN_DIR)
+                   if f.endswith('.txt'))
+    self.assertTrue(names)
+    for name in names:
+      with open(os.path.join(GOLDEN_DIR, name + '.txt')) as f:
+        crash_state, crash_type = stack_analyzer.get_crash_info(f.read())
+      with open(os.path.join(GOLDEN_DIR, name + '.json')) as f:
+        expected = json.load(f)
+      self.assertEqual(
+          (crash_type, crash_state),
+          (expected['crash_type'], expected['crash_state']), name)
+
+
+class GetFrameFunctionTest(unittest.TestCase):
+  """Tests the get_frame_function method."""
+
+  def test_arguments(self):
+    """Tests stripping the parameter list and qualifiers."""
+    self.assertEqual(
+        stack_analyzer.get_frame_function(
+            'in foo::Bar(int, char*) const /src/foo.cc:12:3'),
+        'foo::Bar')
+
+  def test_anonymous_namespace(self):
+    """Tests keeping anonymous namespaces."""
+    self.assertEqual(
+        stack_analyzer.get_frame_function(
+            'in (anonymous namespace)::Foo() /src/foo.cc:12'),
+        '(anonymous namespace)::Foo')
+
+  def test_return_type(self):
+    """Tests stripping the return type of template functions."""
+    self.assertIsNone(stack_analyzer.get_frame_function(
+        'in void std::__1::vector<int, std::__1::allocator<int> >::push_back'
+        '(int const&) /usr/include/c++/v1/vector:1587:9'))
+    self.assertEqual(
+        stack_analyzer.get_frame_function(
+            'in bool (anonymous namespace)::Foo<int>() /src/foo.cc:12'),
+        '(anonymous namespace)::Foo<int>')
+    self.assertEqual(
+        stack_analyzer.get_frame_function(
+            'in foo::Bar::operator delete(void*) /src/foo.cc:12'),
+        'foo::Bar::operator delete')
+
+  def test_unsymbolized(self):
+    """Tests that unsymbolized frames are skipped."""
+    self.assertIsNone(
+        stack_analyzer.get_frame_function('(/out/chrome+0x1234)'))
+
+  def test_ignored(self):
+    """Tests that runtime and libc frames are skipped."""
+    self.assertIsNone(stack_analyzer.get_frame_function(
+        'in __asan_memcpy /src/compiler-rt/lib/asan/asan_rtl.cc:1'))
+    self.assertIsNone(stack_analyzer.get_frame_function(
+        'in gsignal (/lib/x86_64-linux-gnu/libc.so.6+0x35428)'))
+    self.assertIsNone(stack_analyzer.get_frame_function(
+        'in operator new(unsigned long) /src/asan_new_delete.cc:80:3'))
+
+
+class GetCrashInfoTest(unittest.TestCase):
+  """Tests the get_crash_info method."""
+
+  def test_asan_types(self):
+    """Tests the crash types of various ASan errors."""
+    for header, crash_type in [
+        ('heap-buffer-overflow on address 0x6020\nWRITE of size 4 at 0x',
+         'Heap-buffer-overflow WRITE 4'),
+        ('SEGV on unknown address 0x7f0000001234 (pc 0x1 bp 0x2 sp 0x3 T0)',
+         'UNKNOWN'),
+        ('attempting double-free on 0x602000000010 in thread T0:',
+         'Heap-double-free'),
+        ('requested allocation size 0x10000000000 exceeds maximum',
+         'Out-of-memory')]:
+      _, result = stack_analyzer.get_crash_info(
+          '==1==ERROR: AddressSanitizer: %s\n' % header)
+      self.assertEqual(result, crash_type)
+
+  def test_v8_check(self):
+    """Tests a V8 CHECK failure."""
+    crash_state, crash_type = stack_analyzer.get_crash_info(
+        '#\n# Fatal error in ../../src/objects.cc, line 9\n'
+        '# Check failed: IsSmi().\n#\n')
+    self.assertEqual(crash_type, 'CHECK failure')
+    self.assertEqual(crash_state, ['IsSmi() in objects.cc'])
+
+
+class ReportDetectorTest(unittest.TestCase):
+  """Tests the ReportDetector class."""
+
+  def setUp(self):
+    self.detector = stack_analyzer.ReportDetector()
+
+  def test_complete(self):
+    """Tests finding the end of a report split across chunks."""
+    self.assertFalse(self.detector.is_report_complete(
+        'Starting.\nSUMMARY: AddressSanitizer: not a report\n==12=='))
+    self.assertFalse(self.detector.is_report_complete(
+        'ERROR: AddressSanitizer: heap-use-after-free\n    #0 0x1 in foo\n'))
+    self.assertFalse(self.detector.is_report_complete('SUMMARY: Addr'))
+    self.assertTrue(self.detector.is_report_complete(
+        'essSanitizer: heap-use-after-free foo.cc:1\n'))
+
+  def test_ubsan(self):
+    """Tests finding the end of a UBSan report."""
+    self.assertTrue(self.detector.is_report_complete(
+        'foo.cc:12:3: runtime error: signed integer overflow\n'
+        'SUMMARY: UndefinedBehaviorSanitizer: undefined-behavior foo.cc\n'))
+
+  def test_no_report(self):
+    """Tests output without a report."""
+    self.assertFalse(self.detector.is_report_complete(
+        'Fatal error.\nSUMMARY: nothing\n'))
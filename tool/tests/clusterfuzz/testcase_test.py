@@ -14,10 +14,13 @@
 # limitations under the License.
 
 import os
+import json
+import shutil
 import mock
 
 import helpers
 from clusterfuzz import common
+from clusterfuzz import downloader
 from clusterfuzz import testcase
 
 def build_base_testcase(stacktrace_lines=None, revision=None, build_url=None,
@@ -124,14 +127,16 @@ class GetTestcasePathTest(helpers.ExtendedTestCase):
   """Tests the get_testcase_path method."""
 
   def setUp(self):
+    # Other tests reload common, which DownloadError must extend.
+    reload(downloader)
     self.setup_fake_filesystem()
     helpers.patch(self, [
-        'clusterfuzz.common.get_stored_auth_header',
-        'clusterfuzz.common.execute',
+        'clusterfuzz.downloader.download',
+        'clusterfuzz.downloader.is_unchanged',
         'clusterfuzz.common.delete_if_exists',
-        'os.listdir',
+        'clusterfuzz.cache.record_testcase',
+        'clusterfuzz.cache.evict',
         'clusterfuzz.testcase.Testcase.get_true_testcase_path'])
-    self.mock.get_stored_auth_header.return_value = 'Bearer 1a2s3d4f'
     self.testcase_dir = os.path.join(
         common.CLUSTERFUZZ_TESTCASES_DIR, '12345_testcase')
     self.test = build_base_testcase()
@@ -139,12 +144,9 @@ class GetTestcasePathTest(helpers.ExtendedTestCase):
   def test_downloading_testcase(self):
     """Tests the creation of folders & downloading of the testcase"""
 
-    def do_wget(*unused_args):
-      path = os.path.join(
-          common.CLUSTERFUZZ_TESTCASES_DIR, '12345_testcase/testcase.js')
-      with open(path, 'w') as f:
-        f.write('Fake testcase')
-    self.mock.execute.side_effect = do_wget
+    self.mock.download.return_value = {
+        'filename': 'orig.js', 'etag': '"abc"', 'last_modified': None,
+        'md5': None}
     file_path = os.path.join(self.testcase_dir, 'testcase.js')
     self.mock.get_true_testcase_path.return_value = file_path
     self.assertFalse(os.path.exists(self.testcase_dir))
@@ -152,16 +154,81 @@ class GetTestcasePathTest(helpers.ExtendedTestCase):
     result = self.test.get_testcase_path()
 
     self.assertEqual(result, file_path)
-    self.assert_exact_calls(self.mock.get_stored_auth_header, [mock.call()])
-    self.assert_exact_calls(self.mock.execute, [
-        mock.call(
-            'wget',
-            '--content-disposition --header="Authorization: %s" "%s"' % (
-                self.mock.get_stored_auth_header.return_value,
-                testcase.CLUSTERFUZZ_TESTCASE_URL % str(12345)),
-            self.testcase_dir)
+    self.assert_exact_calls(self.mock.download, [
+        mock.call(testcase.CLUSTERFUZZ_TESTCASE_URL % str(12345),
+                  self.testcase_dir)
     ])
+    self.assert_exact_calls(self.mock.get_true_testcase_path, [
+        mock.call(self.test, 'orig.js')])
     self.assertTrue(os.path.exists(self.testcase_dir))
+    self.assertEqual(
+        common.read_json_file(os.path.join(
+            self.testcase_dir, testcase.TESTCASE_METADATA_FILE)),
+        {'etag': '"abc"', 'last_modified': None, 'md5': None,
+         'testcase_path': file_path})
+    self.assert_exact_calls(self.mock.record_testcase, [
+        mock.call('12345', self.testcase_dir)])
+    self.assert_exact_calls(self.mock.evict, [mock.call()])
+
+  def test_downloaded_once(self):
+    """Tests that the path is kept once the testcase is downloaded."""
+    self.mock.download.return_value = {
+        'filename': 'orig.js', 'etag': None, 'last_modified': None,
+        'md5': None}
+    self.mock.get_true_testcase_path.return_value = 'testcase.js'
+
+    self.assertEqual(self.test.get_testcase_path(), 'testcase.js')
+    self.assertEqual(self.test.get_testcase_path(), 'testcase.js')
+    self.assert_n_calls(1, [self.mock.download])
+
+  def create_cached_testcase(self):
+    """Creates a testcase downloaded by an earlier run."""
+    file_path = os.path.join(self.testcase_dir, 'testcase.js')
+    self.fs.CreateFile(file_path, contents='testcase')
+    self.fs.CreateFile(
+        os.path.join(self.testcase_dir, testcase.TESTCASE_METADATA_FILE),
+        contents=json.dumps({'etag': '"abc"', 'testcase_path': file_path}))
+    return file_path
+
+  def test_cached_testcase(self):
+    """Tests reusing a testcase which hasn't changed on the server."""
+    file_path = self.create_cached_testcase()
+    self.mock.is_unchanged.return_value = True
+
+    result = self.test.get_testcase_path()
+
+    self.assertEqual(result, file_path)
+    self.assert_exact_calls(self.mock.is_unchanged, [
+        mock.call(testcase.CLUSTERFUZZ_TESTCASE_URL % str(12345),
+                  {'etag': '"abc"', 'testcase_path': file_path})])
+    self.assert_n_calls(0, [self.mock.download, self.mock.delete_if_exists])
+    self.assert_exact_calls(self.mock.record_testcase, [
+        mock.call('12345', self.testcase_dir)])
+
+  def test_cached_testcase_offline(self):
+    """Tests reusing a testcase when the server can't be reached."""
+    file_path = self.create_cached_testcase()
+    self.mock.is_unchanged.side_effect = downloader.DownloadError(
+        'url', 'reason')
+
+    self.assertEqual(self.test.get_testcase_path(), file_path)
+    self.assert_n_calls(0, [self.mock.download])
+
+  def test_changed_testcase(self):
+    """Tests downloading a testcase again when it changed."""
+    self.create_cached_testcase()
+    self.mock.is_unchanged.return_value = False
+    self.mock.delete_if_exists.side_effect = shutil.rmtree
+    self.mock.download.return_value = {
+        'filename': 'orig.js', 'etag': '"def"', 'last_modified': None,
+        'md5': None}
+    self.mock.get_true_testcase_path.return_value = 'path'
+
+    self.test.get_testcase_path()
+
+    self.assert_exact_calls(self.mock.delete_if_exists, [
+        mock.call(self.testcase_dir)])
+    self.assertEqual(len(self.mock.download.call_args_list), 1)
 
 
 class GetTrueTestcasePathTest(helpers.ExtendedTestCase):